@@ -0,0 +1,493 @@
+"""
+性能基准
+    decode:   convert 的解析流程（加载 lookup、批量解码、写出 JSON）
+    scalar:   convert.parse_data_from_lookup 逐帧解析（最多 SCALAR_LIMIT 帧）
+    validate: checkright.check_frames 的检查流程（读取日志、校验、生成错误信息）
+    export:   send2sac.export 单遍导出 ASC/CSV/列式
+    socket:   对 can_sim 模拟总线测量指令写入延迟、指令生效延迟与接收通道吞吐
+日志与 lookup 表按需合成（同一规模只生成一次），每个用例在独立子进程中运行，
+分别记录帧率、峰值内存和各阶段耗时，结果写入 JSON；指定 --baseline 时与基线
+比较，帧率下降或内存增长超过阈值的用例视为回退，退出码为1。
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+import checkright
+import convert
+import send2sac
+from can_records import RECORD_SIZE, frombuffer
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000, "10M": 10_000_000}
+# lookup 表规模：(ID个数, 每个ID的信号数)
+LOOKUP_SIZES = {"small": (8, 8), "large": (256, 24)}
+SCALAR_LIMIT = 100_000
+GEN_CHUNK = 1 << 20  # 合成日志时每块的行数
+BASE_SECONDS = 1_700_000_000
+
+# 每个字节对应的8位二进制与两位十六进制 ASCII
+BIT_TABLE = np.array([list(format(i, "08b").encode()) for i in range(256)], dtype=np.uint8)
+HEX_TABLE = np.array([list(f"{i:02X}".encode()) for i in range(256)], dtype=np.uint8)
+HEX_DIGITS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+
+
+# ---------------- 合成数据 ----------------
+
+def _literal(text, n):
+    return np.broadcast_to(np.frombuffer(text.encode(), dtype=np.uint8), (n, len(text)))
+
+
+def _decimal(values, width):
+    """定宽十进制 ASCII 列"""
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return ((values.astype(np.int64)[:, None] // powers) % 10 + 48).astype(np.uint8)
+
+
+def _hex_id(ids):
+    """8位十六进制 ASCII 列"""
+    shifts = np.arange(28, -1, -4, dtype=np.uint32)
+    return HEX_DIGITS[(ids.astype(np.uint32)[:, None] >> shifts) & 0xF]
+
+
+def _byte_columns(data, table, sep):
+    """把 (n, 8) 字节矩阵按 table 编码，每个字节后接 sep"""
+    n = len(data)
+    parts = []
+    for k in range(data.shape[1]):
+        parts.append(table[data[:, k]])
+        parts.append(_literal(sep, n))
+    return parts
+
+
+def _write_lines(f, parts):
+    f.write(np.hstack(parts).tobytes())
+
+
+def make_lookup(n_ids, n_signals, seed=0):
+    """合成 lookup 表：数值信号带 factor/offset，约四分之一为枚举"""
+    rng = np.random.default_rng(seed)
+    lookup = {}
+    ids = rng.choice(np.arange(0x18000000, 0x18FFFFFF), n_ids, replace=False)
+    for frame_id in sorted(ids.tolist()):
+        fields = []
+        for k in range(n_signals):
+            start = int(rng.integers(0, 63))
+            length = int(rng.integers(1, min(32, 64 - start) + 1))
+            field = {'name': f"s{frame_id:X}_{k}", 'start_bit': start, 'length': length}
+            if k % 4 == 3:
+                field['type'] = 'enum'
+                field['dic'] = {v: f"v{v}" for v in range(min(1 << length, 8))}
+            elif k % 2:
+                field['factor'] = 0.1
+                field['offset'] = -40
+            fields.append(field)
+        lookup[frame_id] = fields
+    return lookup
+
+
+def make_record(path, n, ids, seed=0):
+    """合成 convert 使用的 record.txt"""
+    rng = np.random.default_rng(seed)
+    ids = np.asarray(ids, dtype=np.uint32)
+    with open(path, "wb") as f:
+        for start in range(0, n, GEN_CHUNK):
+            m = min(GEN_CHUNK, n - start)
+            seconds = BASE_SECONDS + (start + np.arange(m)) // 10000
+            data = rng.integers(0, 256, (m, 8), dtype=np.uint8)
+            _write_lines(f, [_literal("[", m), _decimal(seconds, 10), _literal("] 0 Rx ", m),
+                             _hex_id(ids[rng.integers(0, len(ids), m)]), _literal(" Ext 8 ", m)]
+                         + _byte_columns(data, BIT_TABLE, " ")[:-1] + [_literal("\n", m)])
+
+
+def make_right(path, n, seed=0):
+    """合成 checkright 使用的 right.txt：4个控制帧按周期交错，心跳与异或正确"""
+    rng = np.random.default_rng(seed)
+    specs = [(frame_id, checkright.TIME_INTERVALS[frame_id], checkright.HEARTBEAT_BYTES[frame_id],
+              frame_id in checkright.XOR_IDS) for frame_id in checkright.TIME_INTERVALS]
+    # 100ms 内各ID的帧数之比为 5:5:2:1
+    per_cycle = sum(100 // interval for _, interval, _, _ in specs)
+    cycles = -(-n // per_cycle)
+    times, ids, data = [], [], []
+    for frame_id, interval, heartbeat, has_xor in specs:
+        count = cycles * (100 // interval)
+        rows = rng.integers(0, 256, (count, 8), dtype=np.uint8)
+        rows[:, heartbeat] = np.arange(1, count + 1) & 0xFF
+        if has_xor:
+            rows[:, 7] = np.bitwise_xor.reduce(rows[:, :7], axis=1)
+        times.append(np.arange(1, count + 1, dtype=np.int64) * interval)
+        ids.append(np.full(count, int(frame_id, 16), dtype=np.uint32))
+        data.append(rows)
+    order = np.argsort(np.concatenate(times), kind='stable')[:n]
+    times = np.concatenate(times)[order] + BASE_SECONDS * 1000
+    ids = np.concatenate(ids)[order]
+    data = np.concatenate(data)[order]
+    with open(path, "wb") as f:
+        for start in range(0, n, GEN_CHUNK):
+            sl = slice(start, start + GEN_CHUNK)
+            m = len(ids[sl])
+            _write_lines(f, [_literal("time: ", m), _decimal(times[sl], 13), _literal(" id: ", m),
+                             _hex_id(ids[sl]), _literal(", data: ", m)]
+                         + _byte_columns(data[sl], HEX_TABLE, " ") + [_literal("\n", m)])
+
+
+def make_senddebug(path, n, seed=0):
+    """合成 send2sac 使用的 senddebug.txt"""
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as f:
+        for start in range(0, n, GEN_CHUNK):
+            m = min(GEN_CHUNK, n - start)
+            times = BASE_SECONDS * 1000 + start + np.arange(m)
+            ids = rng.integers(0x18000000, 0x18FFFFFF, m, dtype=np.uint32)
+            data = rng.integers(0, 256, (m, 8), dtype=np.uint8)
+            _write_lines(f, [_decimal(times, 13), _literal(" 0 ", m), _hex_id(ids),
+                             _literal("x Rx d 8 ", m)]
+                         + _byte_columns(data, HEX_TABLE, " ")[:-1] + [_literal("\n", m)])
+
+
+class Workdir:
+    """合成数据的存放目录，同名文件只生成一次"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, name, make, *args):
+        path = os.path.join(self.path, name)
+        if not os.path.exists(path):
+            make(path + ".tmp", *args)
+            os.replace(path + ".tmp", path)
+        return path
+
+    def lookup(self, lookup_name):
+        def make(path, n_ids, n_signals):
+            with open(path, "w") as f:
+                yaml.safe_dump(make_lookup(n_ids, n_signals), f)
+        return self.file(f"lookup_{lookup_name}.yaml", make, *LOOKUP_SIZES[lookup_name])
+
+
+# ---------------- 用例 ----------------
+
+class Timer:
+    """按阶段记录耗时"""
+
+    def __init__(self):
+        self.phases = {}
+        self.last = time.perf_counter()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases[name] = now - self.last
+        self.last = now
+
+
+def bench_decode(work, size, lookup_name):
+    lookup_file = work.lookup(lookup_name)
+    with open(lookup_file) as f:
+        ids = list(yaml.safe_load(f))
+    record_file = work.file(f"record_{size}_{lookup_name}.txt", make_record, SIZES[size], ids)
+    timer = Timer()
+    decoders = convert.load_decoders(lookup_file, use_cache=False)
+    timer.mark("load_lookup")
+    results = []
+    for batch in convert.iter_decoded(record_file, decoders):
+        results.extend(batch)
+    timer.mark("decode")
+    json.dump(results, io.StringIO(), indent=4, ensure_ascii=False)
+    timer.mark("write_json")
+    return len(results), timer.phases
+
+
+def bench_scalar(work, size, lookup_name):
+    lookup_file = work.lookup(lookup_name)
+    with open(lookup_file) as f:
+        lookup_data = yaml.safe_load(f)
+    record_file = work.file(f"record_{size}_{lookup_name}.txt", make_record, SIZES[size],
+                            list(lookup_data))
+    timer = Timer()
+    frames = []
+    with open(record_file) as f:
+        for line, _ in zip(f, range(SCALAR_LIMIT)):
+            _, frame_id, _, data = convert.parse_line(line.strip())
+            frames.append((lookup_data[int(frame_id, 16)], data))
+    timer.mark("read")
+    for lookup, data in frames:
+        convert.parse_data_from_lookup(data, lookup)
+    timer.mark("decode")
+    return len(frames), timer.phases
+
+
+def bench_validate(work, size, lookup_name):
+    right_file = work.file(f"right_{size}.txt", make_right, SIZES[size])
+    timer = Timer()
+    logs = checkright.load_log(right_file)
+    timer.mark("load_log")
+    reports = {frame_id: checkright.validate(frame_id, log) for frame_id, log in logs.items()}
+    timer.mark("validate")
+    for frame_id, log in logs.items():
+        checkright.error_messages(frame_id, log, reports[frame_id])
+    timer.mark("messages")
+    return sum(len(log) for log in logs.values()), timer.phases
+
+
+def bench_export(work, size, lookup_name):
+    senddebug_file = work.file(f"senddebug_{size}.txt", make_senddebug, SIZES[size])
+    out = os.path.join(work.path, f"export_{os.getpid()}")
+    timer = Timer()
+    count = send2sac.export(senddebug_file, {"asc": out + ".asc", "csv": out + ".csv",
+                                             "columns": out + "_columns"})
+    timer.mark("export")
+    for suffix in (".asc", ".csv"):
+        os.remove(out + suffix)
+    for name in os.listdir(out + "_columns"):
+        os.remove(os.path.join(out + "_columns", name))
+    os.rmdir(out + "_columns")
+    return count, timer.phases
+
+
+def _connect(path, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return sock
+        except OSError:
+            sock.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _receive_for(path, seconds, binary):
+    """连接接收通道并持续读取 seconds 秒，返回收到的帧数"""
+    sock = _connect(path)
+    if binary:
+        sock.sendall(b"format binary\n")
+    received = 0
+    pending = 0
+    end = time.monotonic() + seconds
+    sock.settimeout(0.2)
+    while time.monotonic() < end:
+        try:
+            chunk = sock.recv(1 << 20)
+        except socket.timeout:
+            continue
+        if not chunk:
+            break
+        if binary:
+            pending += len(chunk)
+            received += pending // RECORD_SIZE
+            pending %= RECORD_SIZE
+        else:
+            received += chunk.count(b"\n")
+    sock.close()
+    return received
+
+
+def bench_socket(work, size, lookup_name, rate=20000, seconds=3.0, commands=2000, probes=30):
+    """对本地模拟总线测量端到端性能，不使用合成日志"""
+    cmd_path = os.path.join(work.path, f"cmd_{os.getpid()}.sock")
+    read_path = os.path.join(work.path, f"read_{os.getpid()}.sock")
+    sim = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "can_sim.py"),
+         "--socket", cmd_path, "--read-socket", read_path, "--rate", str(rate), "--seed", "0"],
+        stdout=subprocess.DEVNULL)
+    timer = Timer()
+    try:
+        cmd = _connect(cmd_path)
+        timer.mark("connect")
+
+        # 指令写入延迟：单条文本指令 sendall 的耗时
+        write_us = []
+        for i in range(commands):
+            line = f"send {0x1805B0A0} 8 8 {i & 0xFF:08b}\n".encode()
+            t0 = time.perf_counter()
+            cmd.sendall(line)
+            write_us.append((time.perf_counter() - t0) * 1e6)
+        timer.mark("command_write")
+
+        # 指令生效延迟：写入后到接收通道出现新值的时间（包含控制帧周期）
+        rx = _connect(read_path)
+        rx.sendall(b"format binary\n")
+        effect_ms = []
+        pending = b""
+        for i in range(probes):
+            value = (i * 37 + 1) & 0xFF
+            t0 = time.perf_counter()
+            cmd.sendall(f"send {0x1801B0A0} 32 8 {value:08b}\n".encode())
+            seen = False
+            while not seen:
+                pending += rx.recv(1 << 20)
+                complete = len(pending) - len(pending) % RECORD_SIZE
+                records = frombuffer(pending[:complete])
+                pending = pending[complete:]
+                hits = records[(records['id'] == 0x1801B0A0) & (records['data'][:, 4] == value)]
+                seen = len(hits) > 0
+            effect_ms.append((time.perf_counter() - t0) * 1000)
+        rx.close()
+        cmd.close()
+        timer.mark("command_effect")
+
+        received_binary = _receive_for(read_path, seconds, binary=True)
+        timer.mark("receive_binary")
+        received_text = _receive_for(read_path, seconds, binary=False)
+        timer.mark("receive_text")
+    finally:
+        sim.terminate()
+        sim.wait()
+
+    extra = {
+        "command_write_us": dict(zip(("p50", "p99", "max"), np.percentile(
+            write_us, [50, 99, 100]).round(2).tolist())),
+        "command_effect_ms": dict(zip(("p50", "p99", "max"), np.percentile(
+            effect_ms, [50, 99, 100]).round(2).tolist())),
+        "receive_binary_fps": round(received_binary / seconds, 1),
+        "receive_text_fps": round(received_text / seconds, 1),
+    }
+    return received_binary, timer.phases, extra
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "scalar": bench_scalar,
+    "validate": bench_validate,
+    "export": bench_export,
+    "socket": bench_socket,
+}
+# 与 lookup 表无关的用例只按 "-" 运行一次
+USES_LOOKUP = {"decode", "scalar"}
+
+
+def _child(conn, name, workdir, size, lookup_name):
+    try:
+        result = BENCHMARKS[name](Workdir(workdir), size, lookup_name)
+        conn.send(("ok", result, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    except Exception as e:
+        conn.send(("error", repr(e), 0))
+    conn.close()
+
+
+def run_case(name, workdir, size, lookup_name):
+    """在子进程中运行一个用例，返回结果字典"""
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_child, args=(child, name, workdir, size, lookup_name))
+    process.start()
+    child.close()
+    status, result, maxrss_kb = parent.recv()
+    process.join()
+    if status != "ok":
+        return {"error": result}
+    frames, phases, *extra = result
+    seconds = sum(phases.values())
+    out = {
+        "frames": frames,
+        "seconds": round(seconds, 4),
+        "fps": round(frames / seconds, 1) if seconds else 0.0,
+        "peak_rss_mb": round(maxrss_kb / 1024, 1),
+        "phases": {phase: round(t, 4) for phase, t in phases.items()},
+    }
+    if extra:
+        out.update(extra[0])
+    return out
+
+
+def compare(results, baseline, threshold):
+    """
+    与基线比较
+    Returns:
+        回退的用例列表 [(用例名, 指标, 基线值, 当前值)]。
+    """
+    regressions = []
+    print(f"{'Case':<28} {'Baseline fps':>14} {'Current fps':>14} {'Change':>8}")
+    for case, current in results.items():
+        base = baseline.get(case)
+        if not base or "error" in base or "error" in current:
+            continue
+        change = current["fps"] / base["fps"] - 1 if base["fps"] else 0.0
+        flag = ""
+        if change < -threshold:
+            regressions.append((case, "fps", base["fps"], current["fps"]))
+            flag = "  REGRESSION"
+        if base["peak_rss_mb"] and current["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold):
+            regressions.append((case, "peak_rss_mb", base["peak_rss_mb"], current["peak_rss_mb"]))
+            flag += "  RSS"
+        print(f"{case:<28} {base['fps']:>14.1f} {current['fps']:>14.1f} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解码、校验、导出与套接字的性能基准")
+    parser.add_argument("--only", default=",".join(BENCHMARKS),
+                        help=f"运行的用例，逗号分隔（{','.join(BENCHMARKS)}）")
+    parser.add_argument("--sizes", default="10k,100k",
+                        help=f"日志规模，逗号分隔（{','.join(SIZES)}）")
+    parser.add_argument("--lookup-sizes", default=",".join(LOOKUP_SIZES),
+                        help=f"lookup 表规模，逗号分隔（{','.join(LOOKUP_SIZES)}）")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "can_bench"),
+                        help="合成数据目录，重复运行时复用")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="结果文件")
+    parser.add_argument("--baseline", default=None, help="基线结果文件，用于检测回退")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定回退的相对变化")
+    args = parser.parse_args()
+
+    names = [name for name in args.only.split(",") if name]
+    sizes = [size for size in args.sizes.split(",") if size]
+    lookup_sizes = [name for name in args.lookup_sizes.split(",") if name]
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"未知用例: {name}")
+    for size in sizes:
+        if size not in SIZES:
+            parser.error(f"未知规模: {size}")
+
+    results = {}
+    for name in names:
+        for size in (sizes if name != "socket" else ["-"]):
+            for lookup_name in (lookup_sizes if name in USES_LOOKUP else ["-"]):
+                case = f"{name}/{size}/{lookup_name}"
+                result = run_case(name, args.workdir, size, lookup_name)
+                results[case] = result
+                if "error" in result:
+                    print(f"{case:<28} 失败: {result['error']}")
+                else:
+                    print(f"{case:<28} {result['fps']:>12.1f} fps  {result['seconds']:>8.3f}s  "
+                          f"{result['peak_rss_mb']:>8.1f} MB")
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"结果已保存到 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"发现 {len(regressions)} 项性能回退")
+            sys.exit(1)
+        print("未发现性能回退")
+
+
+if __name__ == "__main__":
+    main()
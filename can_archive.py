@@ -0,0 +1,482 @@
+"""
+按变化压缩的长期归档文件（.canarc）
+总线上大部分帧的载荷重复，只有心跳字节加1、异或字节随之变化。归档按块（BLOCK_RECORDS 条）
+把记录按ID分组，每个ID只保存：
+    时间戳：首帧时间、名义周期（块内间隔的中位数）以及每帧间隔与名义周期之差；
+    信号：按 lookup.yaml / control_frames.yaml 的位段拆分载荷，每个位段只保存发生变化的位置和新值，
+        未被信号覆盖的位作为一个位段处理；滚动计数器类的位段只保存计数中断的位置；
+    心跳字节：只保存不等于 "上一帧+1" 的位置和值；
+    异或字节：只保存不等于前7字节异或值的位置和值；
+    通道、DLC、标志：游程编码。
+帧在块内的顺序能由 (时间戳, ID) 推出时不保存，否则额外保存每帧的ID序号。
+各列拼接后用 lzma 压缩，解码全部向量化，逐块产出与 can_records.RECORD_DTYPE 完全相同的记录，
+可以直接交给 checkright.py 与 convert.py。位段布局保存在文件头中，解码不依赖外部配置。
+"""
+import argparse
+import json
+import lzma
+import os
+import struct
+import time
+
+import numpy as np
+import yaml
+
+from can_records import RECORD_DTYPE, RECORD_SIZE, SOCKET_READ_PATH, BinaryReceiver
+from can_store import TEXT_FORMATS, Recorder, Store, _id_index, is_store
+from frame_config import DEFAULT_FRAME_CONFIG, load_frame_config
+
+MAGIC = b"CANARC01"
+VERSION = 1
+HEADER = struct.Struct("<8sII")  # magic, version, layout_len
+BLOCK_HEADER = struct.Struct("<III")  # records, meta_len, payload_len
+BLOCK_RECORDS = 1 << 18  # 每块的最大记录条数
+COMPRESS_PRESET = 6  # lzma 预设，解压速度与预设基本无关
+
+# 按取值范围选择的列类型，从窄到宽
+_NARROW_TYPES = (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32, np.uint64, np.int64)
+
+
+def is_archive(path):
+    """判断文件是否为归档文件"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _byte_mask(byte):
+    """第 byte 字节在 uint64 载荷（第0字节在最高位）中的掩码"""
+    return 0xFF << (56 - 8 * byte)
+
+
+def _field_mask(start_bit, length):
+    """lookup.yaml 位段（第0字节最高位为 start_bit=0）在 uint64 载荷中的掩码"""
+    return ((1 << length) - 1) << (64 - start_bit - length)
+
+
+def build_layout(lookup_file=None, frames_file=None):
+    """
+    由 lookup.yaml 与控制帧表生成各ID的位段布局
+    Returns:
+        {frame_id: {"heartbeat": 字节或 None, "xor": bool, "fields": [掩码, ...]}}
+    """
+    layout = {}
+
+    def entry(frame_id):
+        return layout.setdefault(frame_id, {"heartbeat": None, "xor": False, "fields": []})
+
+    if frames_file:
+        for spec in load_frame_config(frames_file):
+            frame = entry(spec.id)
+            frame["heartbeat"] = spec.heartbeat
+            frame["xor"] = spec.checksum == "xor"
+            frame["fields"] += [_field_mask(s["start_bit"], s["length"]) for s in spec.signals]
+    if lookup_file:
+        with open(lookup_file, 'r') as f:
+            lookup = yaml.safe_load(f) or {}
+        for frame_id, fields in lookup.items():
+            masks = entry(int(frame_id))["fields"]
+            for field in fields or []:
+                start_bit, length = field.get('start_bit'), field.get('length')
+                if (isinstance(start_bit, int) and isinstance(length, int)
+                        and start_bit >= 0 and length > 0 and start_bit + length <= 64):
+                    masks.append(_field_mask(start_bit, length))
+    return layout
+
+
+def _plan(spec):
+    """
+    把布局整理为互不重叠的位段
+    Returns:
+        (heartbeat, xor, masks)，masks 覆盖心跳与异或字节以外的全部64位。
+    """
+    heartbeat = spec.get("heartbeat") if spec else None
+    xor = bool(spec and spec.get("xor")) and heartbeat != 7
+    special = (_byte_mask(heartbeat) if heartbeat is not None else 0) | (_byte_mask(7) if xor else 0)
+    covered = special
+    masks = []
+    for mask in (spec.get("fields", []) if spec else []):
+        mask &= ~covered & 0xFFFFFFFFFFFFFFFF
+        if mask:
+            masks.append(mask)
+            covered |= mask
+    rest = ~covered & 0xFFFFFFFFFFFFFFFF
+    if rest:
+        masks.append(rest)
+    return heartbeat, xor, masks
+
+
+def _narrow(values):
+    """把整数列转为能容纳其取值范围的最窄类型"""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return values.astype(np.uint8)
+    lo, hi = int(values.min()), int(values.max())
+    for dtype in _NARROW_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return values.astype(dtype)
+    raise ValueError("取值超出64位")
+
+
+def _store_runs(columns, key, values, positions):
+    """保存分段起点（首段起点0省略，存间隔）与每段的首值"""
+    columns[key + "p"] = _narrow(np.diff(positions))
+    columns[key + "v"] = _narrow(values[positions])
+
+
+def _changes(values):
+    """取值发生变化的位置，首帧总是计入"""
+    return np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+
+
+def _counter_breaks(values, wrap):
+    """计数器（每帧加1，按 wrap 回绕）中不等于 "上一帧+1" 的位置，首帧总是计入"""
+    values = values.astype(np.int64)
+    return np.flatnonzero(values != np.concatenate(([-1], (values[:-1] + 1) & wrap)))
+
+
+def _expand(columns, key, n, wrap=None):
+    """_store_runs 的逆过程；wrap 不为 None 时段内按计数器逐帧加1"""
+    positions = np.concatenate(([0], np.cumsum(columns[key + "p"], dtype=np.int64)))
+    runs = np.repeat(np.arange(len(positions)), np.diff(np.append(positions, n)))
+    if wrap is None:
+        return columns[key + "v"].astype(np.uint64)[runs]
+    return (columns[key + "v"].astype(np.int64)[runs] + np.arange(n) - positions[runs]) & wrap
+
+
+def _encode_frames(columns, prefix, records, spec):
+    """把同一ID的记录（按时间顺序）编码为若干列"""
+    ts = records['timestamp_us'].astype(np.int64)
+    dt = np.diff(ts)
+    period = int(np.median(dt)) if len(dt) else 0
+    columns[prefix + "t"] = np.array([ts[0], period], dtype=np.int64)
+    columns[prefix + "dt"] = _narrow(dt - period)
+    meta = (records['channel'].astype(np.uint32) | records['dlc'].astype(np.uint32) << 8
+            | records['flags'].astype(np.uint32) << 16 | records['reserved'].astype(np.uint32) << 24)
+    _store_runs(columns, prefix + "m", meta, _changes(meta))
+
+    heartbeat, xor, masks = _plan(spec)
+    payload = records['data'].copy().view('>u8').reshape(-1).astype(np.uint64)
+    for j, mask in enumerate(masks):
+        key = f"{prefix}f{j}"
+        shift = (mask & -mask).bit_length() - 1
+        wrap = mask >> shift
+        values = (payload & np.uint64(mask)) >> np.uint64(shift)
+        positions = _changes(values)
+        # 连续的窄位段若按滚动计数器保存的断点更少，则只保存断点（如报文自带的 counter 信号）
+        if wrap & (wrap + 1) == 0 and wrap < (1 << 32):
+            breaks = _counter_breaks(values, wrap)
+            if len(breaks) < len(positions):
+                positions = breaks
+                columns[key + "c"] = np.zeros(0, dtype=np.uint8)
+        _store_runs(columns, key, values, positions)
+    if heartbeat is not None:
+        beats = records['data'][:, heartbeat]
+        _store_runs(columns, prefix + "h", beats, _counter_breaks(beats, 0xFF))
+    if xor:
+        expected = np.bitwise_xor.reduce(records['data'][:, :7], axis=1)
+        positions = np.flatnonzero(records['data'][:, 7] != expected)
+        columns[prefix + "xp"] = _narrow(np.diff(positions, prepend=0))
+        columns[prefix + "xv"] = records['data'][positions, 7]
+
+
+def _decode_frames(columns, prefix, n, frame_id, spec):
+    """_encode_frames 的逆过程，返回该ID的记录"""
+    out = np.zeros(n, dtype=RECORD_DTYPE)
+    out['id'] = frame_id
+    t0, period = columns[prefix + "t"].tolist()
+    dt = columns[prefix + "dt"].astype(np.int64) + period
+    out['timestamp_us'] = t0 + np.concatenate(([0], np.cumsum(dt)))
+    meta = _expand(columns, prefix + "m", n)
+    out['channel'] = meta & np.uint64(0xFF)
+    out['dlc'] = (meta >> np.uint64(8)) & np.uint64(0xFF)
+    out['flags'] = (meta >> np.uint64(16)) & np.uint64(0xFF)
+    out['reserved'] = meta >> np.uint64(24)
+
+    heartbeat, xor, masks = _plan(spec)
+    payload = np.zeros(n, dtype=np.uint64)
+    for j, mask in enumerate(masks):
+        key = f"{prefix}f{j}"
+        shift = (mask & -mask).bit_length() - 1
+        wrap = mask >> shift if key + "c" in columns else None
+        payload |= _expand(columns, key, n, wrap).astype(np.uint64) << np.uint64(shift)
+    data = payload.astype('>u8').view(np.uint8).reshape(n, 8)
+    if heartbeat is not None:
+        data[:, heartbeat] = _expand(columns, prefix + "h", n, 0xFF)
+    if xor:
+        data[:, 7] = np.bitwise_xor.reduce(data[:, :7], axis=1)
+        data[np.cumsum(columns[prefix + "xp"], dtype=np.int64), 7] = columns[prefix + "xv"]
+    out['data'] = data
+    return out
+
+
+def _derived_order(keys, timestamps):
+    """按 (时间戳, ID序号) 稳定排序得到的帧顺序，参数为按ID分组拼接后的列"""
+    return np.lexsort((keys, timestamps))
+
+
+def encode_block(records, layout):
+    """
+    编码一块记录
+    Returns:
+        块的字节串（块头 + 列说明 + 压缩后的列数据）。
+    """
+    ids, first, keys = np.unique(records['id'], return_index=True, return_inverse=True)
+    # ID序号按首次出现的顺序编号
+    rank = np.empty(len(ids), dtype=np.int64)
+    rank[np.argsort(first, kind='stable')] = np.arange(len(ids))
+    keys = rank[keys]
+    ids = ids[np.argsort(first, kind='stable')]
+    grouped = np.argsort(keys, kind='stable')
+    counts = np.bincount(keys, minlength=len(ids))
+
+    columns = {"ids": ids.astype(np.uint32), "counts": _narrow(counts)}
+    for k, frame_id in enumerate(ids.tolist()):
+        start = int(counts[:k].sum())
+        _encode_frames(columns, f"{k}/", records[grouped[start:start + counts[k]]],
+                       layout.get(frame_id))
+    derived = _derived_order(keys[grouped], records['timestamp_us'][grouped])
+    if not np.array_equal(grouped[derived], np.arange(len(records))):
+        columns["order"] = _narrow(keys)
+
+    meta = json.dumps([[name, column.dtype.str, len(column)] for name, column in columns.items()],
+                      separators=(",", ":")).encode('ascii')
+    payload = lzma.compress(b"".join(np.ascontiguousarray(c).tobytes() for c in columns.values()),
+                            preset=COMPRESS_PRESET)
+    return BLOCK_HEADER.pack(len(records), len(meta), len(payload)) + meta + payload
+
+
+def decode_block(count, meta, payload, layout):
+    """encode_block 的逆过程，返回 RECORD_DTYPE 记录"""
+    raw = lzma.decompress(payload)
+    columns = {}
+    offset = 0
+    for name, dtype, length in json.loads(meta):
+        dtype = np.dtype(dtype)
+        columns[name] = np.frombuffer(raw, dtype=dtype, count=length, offset=offset)
+        offset += dtype.itemsize * length
+    ids = columns["ids"].tolist()
+    counts = columns["counts"].astype(np.int64)
+    parts = [_decode_frames(columns, f"{k}/", int(counts[k]), frame_id, layout.get(frame_id))
+             for k, frame_id in enumerate(ids)]
+    grouped = np.concatenate(parts) if parts else np.zeros(0, dtype=RECORD_DTYPE)
+    if "order" in columns:
+        records = np.empty(count, dtype=RECORD_DTYPE)
+        records[np.argsort(columns["order"], kind='stable')] = grouped
+        return records
+    keys = np.repeat(np.arange(len(ids)), counts)
+    return grouped[_derived_order(keys, grouped['timestamp_us'])]
+
+
+class ArchiveWriter:
+    """
+    写入归档文件
+    Args:
+        path: 归档文件名（覆盖已有文件）。
+        layout: build_layout 生成的位段布局。
+        block_records: 每块的记录条数，越大压缩率越高，流式读取时每次解码一块。
+    """
+
+    def __init__(self, path, layout, block_records=BLOCK_RECORDS):
+        self.path = path
+        self.layout = layout
+        self.block_records = block_records
+        self.count = 0
+        self.pending = []
+        self.pending_count = 0
+        text = json.dumps({str(k): v for k, v in layout.items()}).encode('utf-8')
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(text)) + text)
+
+    def append(self, records):
+        """追加一批记录，凑满一块即编码写出"""
+        if len(records) == 0:
+            return
+        self.pending.append(np.array(records, dtype=RECORD_DTYPE))
+        self.pending_count += len(records)
+        if self.pending_count >= self.block_records:
+            buffered = np.concatenate(self.pending)
+            whole = len(buffered) - len(buffered) % self.block_records
+            for start in range(0, whole, self.block_records):
+                self._write_block(buffered[start:start + self.block_records])
+            self.pending = [buffered[whole:]]
+            self.pending_count = len(buffered) - whole
+
+    def _write_block(self, records):
+        self.file.write(encode_block(records, self.layout))
+        self.count += len(records)
+
+    def flush(self):
+        """把未满一块的记录也写出（作为一个较小的块）"""
+        if self.pending_count:
+            self._write_block(np.concatenate(self.pending))
+            self.pending = []
+            self.pending_count = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class Archive:
+    """
+    只读打开归档文件，接口与 can_store.Store 相同的部分：len、iter_chunks、records、ids、positions
+    Args:
+        path: 归档文件名。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, layout_len = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} 不是可识别的归档文件")
+            self.layout = {int(k): v for k, v in json.loads(f.read(layout_len)).items()}
+            # 只读块头建立块目录，末尾不完整的块（写入中断）忽略
+            self.blocks = []
+            size = os.fstat(f.fileno()).st_size
+            offset = HEADER.size + layout_len
+            while offset + BLOCK_HEADER.size <= size:
+                f.seek(offset)
+                count, meta_len, payload_len = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+                end = offset + BLOCK_HEADER.size + meta_len + payload_len
+                if end > size:
+                    break
+                self.blocks.append((offset, count, meta_len, payload_len))
+                offset = end
+        self.count = sum(block[1] for block in self.blocks)
+        self._records = None
+        self._index = None
+
+    def __len__(self):
+        return self.count
+
+    def iter_chunks(self, chunk=None):
+        """按录制顺序逐块解码，每次产出一块的记录（chunk 参数仅为与 Store 兼容）"""
+        with open(self.path, 'rb') as f:
+            for offset, count, meta_len, payload_len in self.blocks:
+                f.seek(offset + BLOCK_HEADER.size)
+                meta = f.read(meta_len)
+                yield decode_block(count, meta, f.read(payload_len), self.layout)
+
+    def iter_text(self, fmt, chunk=None):
+        """按 can_store.TEXT_FORMATS 中的格式逐行导出为文本"""
+        formatter = TEXT_FORMATS[fmt]
+        for records in self.iter_chunks():
+            yield from formatter(records)
+
+    @property
+    def records(self):
+        """全部记录（首次访问时解码）"""
+        if self._records is None:
+            chunks = list(self.iter_chunks())
+            self._records = np.concatenate(chunks) if chunks else np.zeros(0, dtype=RECORD_DTYPE)
+        return self._records
+
+    def ids(self):
+        if self._index is None:
+            self._index = _id_index(self.records['id'])
+        return self._index[0].tolist()
+
+    def positions(self, frame_id):
+        """某ID全部记录的序号（升序）"""
+        self.ids()
+        keys, starts, positions = self._index
+        k = int(np.searchsorted(keys, frame_id))
+        if k == len(keys) or keys[k] != frame_id:
+            return np.empty(0, dtype=np.int64)
+        return positions[starts[k]:starts[k + 1]]
+
+
+def open_records(path):
+    """打开 can_store 录制文件或归档文件，返回 Store 或 Archive"""
+    return Archive(path) if is_archive(path) else Store(path)
+
+
+def record(path, layout, socket_path=SOCKET_READ_PATH, flush_interval=60.0):
+    """
+    订阅 middleware 的二进制接收流直接写入归档，每 flush_interval 秒把未满的块写出
+    """
+    writer = ArchiveWriter(path, layout)
+    receiver = BinaryReceiver(socket_path)
+    print(f"[INFO] 开始归档到 {path}")
+    next_flush = time.monotonic() + flush_interval
+    try:
+        for records in receiver:
+            writer.append(records)
+            if time.monotonic() >= next_flush:
+                writer.flush()
+                next_flush += flush_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.close()
+        writer.close()
+        print(f"[INFO] 归档结束，共 {writer.count} 帧")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按变化压缩的 CAN 帧归档工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    default_frames = DEFAULT_FRAME_CONFIG if os.path.exists(DEFAULT_FRAME_CONFIG) else None
+    for name, help_text in (("pack", "把 can_store 录制文件压缩为归档"),
+                            ("record", "从接收通道直接归档")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("path", help="录制文件名" if name == "pack" else "归档文件名")
+        if name == "pack":
+            p.add_argument("-o", "--output", required=True, help="归档文件名")
+        else:
+            p.add_argument("--socket", default=SOCKET_READ_PATH)
+        p.add_argument("-l", "--lookup", default=None, help="lookup.yaml，用于按信号拆分载荷")
+        p.add_argument("--frames", default=default_frames,
+                       help="控制帧表，提供心跳字节与异或规则（默认 control_frames.yaml）")
+        p.add_argument("--block", type=int, default=BLOCK_RECORDS, help="每块的记录条数")
+    p = sub.add_parser("unpack", help="还原为 can_store 录制文件")
+    p.add_argument("path")
+    p.add_argument("-o", "--output", required=True, help="录制文件名（已存在时在末尾追加）")
+    p = sub.add_parser("export", help="导出为文本格式")
+    p.add_argument("path")
+    p.add_argument("-f", "--format", choices=sorted(TEXT_FORMATS), default="right")
+    p.add_argument("-o", "--output", required=True)
+    p = sub.add_parser("info", help="显示帧数与压缩率")
+    p.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        if not is_store(args.path):
+            parser.error(f"{args.path} 不是 can_store 录制文件")
+        store = Store(args.path)
+        writer = ArchiveWriter(args.output, build_layout(args.lookup, args.frames), args.block)
+        for records in store.iter_chunks(args.block):
+            writer.append(records)
+        writer.close()
+        size = os.path.getsize(args.output)
+        print(f"归档完成，共 {writer.count} 帧，{size} 字节"
+              f"（每帧 {size / max(writer.count, 1):.2f} 字节），结果已保存到 {args.output} 文件中。")
+    elif args.command == "record":
+        record(args.path, build_layout(args.lookup, args.frames), args.socket)
+    elif args.command == "unpack":
+        recorder = Recorder(args.output)
+        for records in Archive(args.path).iter_chunks():
+            recorder.append(records)
+        recorder.close()
+        print(f"还原完成，共 {recorder.count} 帧，结果已保存到 {args.output} 文件中。")
+    elif args.command == "export":
+        archive = Archive(args.path)
+        with open(args.output, 'w') as f:
+            f.writelines(archive.iter_text(args.format))
+        print(f"导出完成，共 {len(archive)} 帧，结果已保存到 {args.output} 文件中。")
+    else:
+        archive = Archive(args.path)
+        size = os.path.getsize(args.path)
+        per_frame = size / max(len(archive), 1)
+        print(f"{args.path}: {len(archive)} 帧，{len(archive.blocks)} 块，{size} 字节，"
+              f"每帧 {per_frame:.2f} 字节（二进制记录的 1/{RECORD_SIZE / max(per_frame, 1e-9):.1f}）")
+
+
+if __name__ == "__main__":
+    main()
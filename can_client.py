@@ -0,0 +1,286 @@
+"""
+middleware 的 asyncio 客户端
+    CommandChannel: 向 /tmp/can_socket 发送 "send id start_bit length bits" 指令，
+        以换行分帧，同一轮事件循环内的指令合并为一次写入。
+    ReceiveChannel: 订阅 /tmp/can_read_socket，逐帧产出 Frame 对象。
+两个通道都在断线后按指数退避自动重连，并使用有界队列做背压，
+单个事件循环即可同时驱动高频指令与完整接收流，不需要为每个套接字开线程。
+"""
+import asyncio
+from collections import namedtuple
+
+from can_encoder import encode_batch
+from can_records import subscription_request
+
+SOCKET_PATH = "/tmp/can_socket"
+SOCKET_READ_PATH = "/tmp/can_read_socket"
+
+# 接收到的一帧：timestamp 为 middleware 写入的时间（毫秒），id 为整数，data 为 bytes
+Frame = namedtuple("Frame", ["timestamp", "id", "data"])
+
+
+def parse_frame(line):
+    """
+    解析接收通道的一行，如 b"time:1700000000123 id:0x1801b0a0 data:0011223344556677"（毫秒）
+    Returns:
+        Frame，格式错误时返回 None。
+    """
+    try:
+        time_field, id_field, data_field = line.strip().split(b" ")
+        return Frame(int(time_field[5:]), int(id_field[3:], 16),
+                     bytes.fromhex(data_field[5:].decode("ascii")))
+    except ValueError:
+        return None
+
+
+def format_command(frame_id, start_bit, length, value):
+    """
+    生成一条文本指令
+    Args:
+        frame_id: 帧ID。
+        start_bit: 起始位。
+        length: 位长度。
+        value: 整数，或由 '0'/'1' 组成的字符串（高位在前）。
+    Returns:
+        以换行结尾的指令 bytes。
+    """
+    bits = value if isinstance(value, str) else format(value, "b").zfill(length)
+    if len(bits) != length:
+        raise ValueError(f"值 {value} 无法用 {length} 位表示")
+    return f"send {frame_id} {start_bit} {length} {bits}\n".encode("ascii")
+
+
+async def open_unix_with_backoff(path, initial_delay=0.1, max_delay=5.0, limit=1 << 16):
+    """
+    连接 Unix 域套接字，失败时按指数退避重试直到成功
+    Returns:
+        (reader, writer)
+    """
+    delay = initial_delay
+    while True:
+        try:
+            return await asyncio.open_unix_connection(path, limit=limit)
+        except OSError as e:
+            print(f"[WARN] 连接 {path} 失败: {e}，{delay:.1f}s 后重试")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+
+class CommandChannel:
+    """
+    指令通道
+    send() 把指令放入有界队列，队列满时等待（背压）；后台写任务每次取出
+    队列中已有的全部指令合并为一次写入，并等待内核缓冲区排空后再继续。
+    Args:
+        path: 指令套接字路径。
+        max_pending: 队列中最多缓存的指令条数。
+        max_batch: 单次写入最多合并的指令条数。
+        tracer: can_trace.Tracer 实例时，每条指令（或每批二进制指令）前附带追踪行，
+            追踪的发送时刻为放入队列的时刻。
+    middleware 对每条指令按顺序应答 "ok" 或 "err <原因>"，后台读任务统计到
+    acked / rejected，最近一次拒绝的应答保存在 last_error。
+    """
+
+    def __init__(self, path=SOCKET_PATH, max_pending=1024, max_batch=256, tracer=None):
+        self.path = path
+        self.max_batch = max_batch
+        self.tracer = tracer
+        self.queue = asyncio.Queue(max_pending)
+        self.writer = None
+        self.task = None
+        self.ack_task = None
+        self.sent = 0
+        self.writes = 0
+        self.acked = 0
+        self.rejected = 0
+        self.last_error = None
+
+    async def start(self):
+        await self._connect()
+        self.task = asyncio.create_task(self._write_loop())
+
+    async def _connect(self):
+        if self.ack_task is not None:
+            self.ack_task.cancel()
+        reader, self.writer = await open_unix_with_backoff(self.path)
+        self.ack_task = asyncio.create_task(self._ack_loop(reader))
+
+    async def _ack_loop(self, reader):
+        while True:
+            try:
+                line = await reader.readline()
+            except (ConnectionError, OSError):
+                return
+            if not line:
+                return
+            if line.startswith(b"ok"):
+                self.acked += 1
+            else:
+                self.rejected += 1
+                self.last_error = line.decode("ascii", "replace").strip()
+
+    def _traced(self, data):
+        return data if self.tracer is None else self.tracer.line() + data
+
+    async def send(self, frame_id, start_bit, length, value):
+        """发送一条指令，队列满时等待"""
+        await self.queue.put(self._traced(format_command(frame_id, start_bit, length, value)))
+
+    def send_nowait(self, frame_id, start_bit, length, value):
+        """发送一条指令，队列满时抛出 asyncio.QueueFull"""
+        self.queue.put_nowait(self._traced(format_command(frame_id, start_bit, length, value)))
+
+    async def send_raw(self, data):
+        """发送已编码好的数据（如二进制批量指令）"""
+        await self.queue.put(data)
+
+    async def send_batch(self, records):
+        """
+        以二进制批量指令发送多条 (frame_id, start_bit, length, value) 记录，
+        middleware 在一次加锁内全部应用
+        """
+        await self.queue.put(self._traced(encode_batch(records)))
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            payload = b"".join(batch)
+            while True:
+                try:
+                    self.writer.write(payload)
+                    await self.writer.drain()
+                    break
+                except (ConnectionError, OSError) as e:
+                    # 断线后重连并重发本批指令
+                    print(f"[WARN] 指令通道断开: {e}")
+                    self.writer.close()
+                    await self._connect()
+            self.sent += len(batch)
+            self.writes += 1
+            for _ in batch:
+                self.queue.task_done()
+
+    async def flush(self):
+        """等待队列中的指令全部写出"""
+        await self.queue.join()
+
+    async def close(self):
+        for task in (self.task, self.ack_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ReceiveChannel:
+    """
+    接收通道，可用 async for 逐帧读取
+    后台读任务把解析好的帧放入有界队列：overflow 为 "block" 时队列满即暂停读取，
+    由套接字缓冲区向 middleware 施加背压（middleware 端该订阅者的环形缓冲区满后丢弃最旧的帧）；
+    为 "drop_oldest" 时丢弃最旧的帧并计数。
+    连接被重置或断开时自动重连；读任务因其他异常退出时，该异常在下一次读取帧时抛给调用方。
+    Args:
+        path: 接收套接字路径。
+        max_queue: 队列中最多缓存的帧数。
+        overflow: 队列满时的策略，"block" 或 "drop_oldest"。
+        parser: 把一行 bytes 解析为帧对象的函数。
+        ids: 只订阅这些ID，由 middleware 过滤；None 表示全部。
+    """
+
+    def __init__(self, path=SOCKET_READ_PATH, max_queue=10000, overflow="block",
+                 parser=parse_frame, ids=None):
+        if overflow not in ("block", "drop_oldest"):
+            raise ValueError(f"未知的溢出策略: {overflow}")
+        self.path = path
+        self.overflow = overflow
+        self.parser = parser
+        self.ids = ids
+        self.queue = asyncio.Queue(max_queue)
+        self.writer = None
+        self.task = None
+        self.received = 0
+        self.dropped = 0
+        self.malformed = 0
+
+    async def start(self):
+        reader = await self._connect()
+        self.task = asyncio.create_task(self._read_loop(reader))
+
+    async def _connect(self):
+        reader, self.writer = await open_unix_with_backoff(self.path)
+        if self.ids:
+            self.writer.write(subscription_request(False, self.ids))
+        return reader
+
+    async def _put(self, frame):
+        if self.overflow == "block":
+            await self.queue.put(frame)
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+
+    async def _read_loop(self, reader):
+        pending = b""
+        while True:
+            try:
+                chunk = await reader.read(1 << 16)
+            except (ConnectionError, OSError) as e:
+                print(f"[WARN] 接收通道异常: {e}")
+                chunk = b""
+            if not chunk:
+                # 服务器断开，重连后继续
+                print(f"[WARN] 接收通道断开，重新连接 {self.path}")
+                self.writer.close()
+                pending = b""
+                reader = await self._connect()
+                continue
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                frame = self.parser(line)
+                if frame is None:
+                    self.malformed += 1
+                    continue
+                self.received += 1
+                await self._put(frame)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.queue.empty() or self.task is None:
+            return await self.queue.get()
+        # 同时等待后台读任务，读任务异常退出时把异常交给调用方，而不是一直等待队列
+        getter = asyncio.ensure_future(self.queue.get())
+        try:
+            await asyncio.wait({getter, self.task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not getter.done():
+                getter.cancel()  # 调用方被取消或读任务已结束，不留下会取走帧的等待
+        if getter.done() and not getter.cancelled():
+            return getter.result()
+        if self.task.cancelled():
+            raise StopAsyncIteration
+        error = self.task.exception()
+        if error is not None:
+            raise error
+        raise StopAsyncIteration
+
+    async def close(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.writer is not None:
+            self.writer.close()
@@ -0,0 +1,193 @@
+"""
+由 lookup.yaml 驱动的信号编码器
+lookup.yaml 中 start_bit 按 convert.py 的约定计数：第0字节在最前，每字节内高位在前。
+middleware 的 "send id start length bits" 指令则把帧数据看作小端64位整数，
+start 为从第0字节最低位起算的位号。编码器在加载时把每个信号预先换算成
+middleware 位号下的若干连续片段，运行时只做整数位运算。
+同一片段既可以编码为文本指令，也可以编码为 middleware 的二进制批量指令。
+"""
+import struct
+
+import yaml
+
+# 二进制批量指令格式，与 middleware.c 中的 BIN_* 定义一致
+BIN_MAGIC = 0xB1
+BIN_VERSION = 1
+BIN_MAX_RECORDS = 255
+BIN_HEADER = struct.Struct("<BBH")  # magic, version, count
+BIN_RECORD = struct.Struct("<IBBHQ")  # id, start_bit, length, reserved, value
+
+# 面板使用的信号，字段格式与 lookup.yaml 相同；lookup.yaml 中有同名信号时以其为准
+PANEL_SIGNALS = {
+    402763936: [
+        {'name': 'steering_angle', 'start_bit': 32, 'length': 8},
+    ],
+    402895008: [
+        {'name': 'acceleration', 'start_bit': 0, 'length': 8, 'offset': -128},
+        {'name': 'elec_brake', 'start_bit': 10, 'length': 2},
+        {'name': 'gear', 'start_bit': 12, 'length': 4},
+        {'name': 'emergency_braking', 'start_bit': 24, 'length': 1},
+    ],
+    403026080: [
+        {'name': 'big_light', 'start_bit': 16, 'length': 2},
+    ],
+}
+
+
+def encode_batch(records):
+    """
+    把 (frame_id, start_bit, length, value) 记录编码为二进制批量指令
+    start_bit 为 middleware 位号，value 的最低位写入 start_bit。
+    超过 BIN_MAX_RECORDS 条时拆成多批，middleware 对每批加一次锁。
+    Returns:
+        可一次写入指令套接字的 bytes。
+    """
+    out = []
+    for i in range(0, len(records), BIN_MAX_RECORDS):
+        chunk = records[i:i + BIN_MAX_RECORDS]
+        out.append(BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, len(chunk)))
+        out.extend(BIN_RECORD.pack(frame_id, start_bit, length, 0, value)
+                   for frame_id, start_bit, length, value in chunk)
+    return b"".join(out)
+
+
+def to_middleware_bit(bit):
+    """把 lookup.yaml 的位号（字节内高位在前）换算为 middleware 的位号（字节内低位在前）"""
+    return (bit // 8) * 8 + 7 - bit % 8
+
+
+class Signal:
+    """
+    单个信号的编码规则
+    Args:
+        frame_id: 所在帧ID。
+        field: lookup.yaml 中的字段定义。
+    """
+
+    def __init__(self, frame_id, field):
+        self.frame_id = frame_id
+        self.name = field['name']
+        self.start_bit = field['start_bit']
+        self.length = field['length']
+        self.factor = field.get('factor', 1)
+        self.offset = field.get('offset', 0)
+        self.type = field.get('type', 'numeric')
+        # 枚举信号允许直接传入名称
+        self.reverse_dic = {v: k for k, v in (field.get('dic') or {}).items()}
+        self.mask = (1 << self.length) - 1
+        # 在 64 位载荷（第0字节在最高位）中的移位量
+        self.shift = 64 - self.start_bit - self.length
+        # 预先拆分为 middleware 位号下的连续片段：(起始位号, 长度, 值内的低位偏移)
+        self.segments = []
+        j = 0
+        while j < self.length:
+            bit = self.start_bit + self.length - 1 - j  # 值的第 j 位在 lookup 位号中的位置
+            n = min(bit % 8 + 1, self.length - j)  # 同一字节内剩余的位数
+            self.segments.append((to_middleware_bit(bit), n, j))
+            j += n
+        self.prefixes = [f"send {frame_id} {start} {n} ".encode("ascii")
+                         for start, n, _ in self.segments]
+
+    def raw(self, value):
+        """把物理值（或枚举名称）换算为原始整数值，超出位宽时截断到范围内"""
+        if self.type == 'enum' and value in self.reverse_dic:
+            value = self.reverse_dic[value]
+        elif self.type == 'numeric':
+            if self.factor == 1 and isinstance(value, int) and isinstance(self.offset, int):
+                value = value - self.offset  # 整数直接相减，避免大数经浮点损失精度
+            else:
+                value = round((value - self.offset) / self.factor)
+        return min(max(int(value), 0), self.mask)
+
+    def records(self, raw):
+        """生成把该信号设为 raw 的二进制指令记录（每个连续片段一条）"""
+        return [(self.frame_id, start, n, (raw >> j) & ((1 << n) - 1))
+                for start, n, j in self.segments]
+
+    def commands(self, raw):
+        """生成把该信号设为 raw 的文本指令（每个连续片段一条）"""
+        return [prefix + format((raw >> j) & ((1 << n) - 1), "b").zfill(n).encode("ascii") + b"\n"
+                for prefix, (_, n, j) in zip(self.prefixes, self.segments)]
+
+
+class SignalEncoder:
+    """
+    按信号名编码并只输出变化的信号
+    Args:
+        signals: {frame_id: [字段定义, ...]}，格式同 lookup.yaml。
+    """
+
+    def __init__(self, signals):
+        self.signals = {}
+        for frame_id, fields in signals.items():
+            for field in fields:
+                self.signals[field['name']] = Signal(frame_id, field)
+        self.last_raw = {}
+
+    def pack(self, values):
+        """
+        把信号值按帧打包为64位整数载荷（第0字节在最高位）
+        Returns:
+            {frame_id: (载荷, 掩码)}，掩码标出了被这些信号覆盖的位。
+        """
+        frames = {}
+        for name, value in values.items():
+            signal = self.signals[name]
+            payload, mask = frames.get(signal.frame_id, (0, 0))
+            frames[signal.frame_id] = (payload | (signal.raw(value) << signal.shift),
+                                       mask | (signal.mask << signal.shift))
+        return frames
+
+    def changes(self, values, binary=False):
+        """
+        返回与上一次相比发生变化的信号对应的全部指令，合并为一次写入
+        Args:
+            values: {信号名: 物理值}
+            binary: 为 True 时编码为二进制批量指令（middleware 在一次加锁内全部应用），
+                否则为换行分隔的文本指令。
+        Returns:
+            可一次写入指令套接字的 bytes，没有变化时为 b""。
+        """
+        out = []
+        for name, value in values.items():
+            signal = self.signals[name]
+            raw = signal.raw(value)
+            if self.last_raw.get(name) != raw:
+                if binary:
+                    out.extend(signal.records(raw))
+                else:
+                    out.extend(signal.commands(raw))
+                self.last_raw[name] = raw
+        if binary:
+            return encode_batch(out) if out else b""
+        return b"".join(out)
+
+    def reset(self):
+        """忘记已发送的值，下次 changes() 会输出全部信号（用于重连后同步）"""
+        self.last_raw.clear()
+
+
+def load_signals(lookup_file, defaults=PANEL_SIGNALS):
+    """
+    从 lookup.yaml 读取 defaults 中同名信号的定义，文件不存在时使用 defaults
+    Returns:
+        {frame_id: [字段定义, ...]}
+    """
+    try:
+        with open(lookup_file, 'r') as f:
+            lookup_data = yaml.safe_load(f) or {}
+    except OSError:
+        return defaults
+    names = {field['name'] for fields in defaults.values() for field in fields}
+    found = {}
+    for frame_id, fields in lookup_data.items():
+        for field in fields:
+            if field.get('name') in names:
+                found.setdefault(frame_id, []).append(field)
+                names.discard(field['name'])
+    # lookup.yaml 中没有的信号保留默认定义
+    for frame_id, fields in defaults.items():
+        for field in fields:
+            if field['name'] in names:
+                found.setdefault(frame_id, []).append(field)
+    return found
@@ -0,0 +1,282 @@
+"""
+middleware 运行指标的 Prometheus 导出器
+middleware 在 /tmp/can_metrics_socket 上对每个连接返回一份快照后关闭连接，
+快照每行为 "<名称> [<标签>=<值> ...] <数值>"，计数器均为启动以来的累计值。
+本模块定时读取快照并转换为 Prometheus 文本格式，由相邻两次快照计算每个通道的总线负载，
+通过 HTTP /metrics 提供给 Prometheus 抓取。读取快照只涉及 middleware 的原子计数器，
+抓取频率不影响收发线程。
+"""
+import argparse
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_SOCKET_PATH = "/tmp/can_metrics_socket"
+PREFIX = "can_middleware_"
+DEFAULT_PORT = 9108
+POLL_INTERVAL = 1.0
+
+# 快照中的名称 -> (Prometheus 类型, 说明)；counter 输出时加 _total 后缀，
+# 以 _us 结尾的直方图换算为秒
+METRICS = {
+    "uptime_us": ("gauge", "middleware 运行时间（微秒）"),
+    "bus_bitrate": ("gauge", "总线位速率（bit/s），0 表示未知"),
+    "rx_frames": ("counter", "接收帧数"),
+    "rx_bits": ("counter", "接收帧占用的总线位数（不含位填充）"),
+    "rx_reads": ("counter", "读到报文的 VCI_Receive 次数"),
+    "rx_full_reads": ("counter", "一次读满接收缓冲区的次数（设备缓冲区积压）"),
+    "rx_errors": ("counter", "VCI_Receive 返回错误的次数"),
+    "can_errors": ("counter", "VCI_ReadErrInfo 报告的错误次数"),
+    "tx_frames": ("counter", "发送帧数"),
+    "tx_bits": ("counter", "发送帧占用的总线位数（不含位填充）"),
+    "tx_failed": ("counter", "VCI_Transmit 未发出的帧数"),
+    "rx_latency_us": ("histogram", "设备接收时刻到主机收到的延迟"),
+    "send_lateness_us": ("histogram", "控制帧实际发送时刻晚于截止时刻的量"),
+    "commands": ("counter", "文本指令按处理结果计数"),
+    "binary_batches": ("counter", "二进制批量指令数"),
+    "binary_records": ("counter", "二进制批量指令中的记录数"),
+    "binary_invalid": ("counter", "二进制批量指令中的无效记录数"),
+    "acks_dropped": ("counter", "未能写回客户端的应答数"),
+    "command_clients": ("gauge", "已连接的指令客户端数"),
+    "subscribers": ("gauge", "已连接的接收订阅者数"),
+    "sub_delivered": ("counter", "发给订阅者的帧数"),
+    "sub_dropped": ("counter", "订阅者缓冲区满时丢弃的帧数"),
+    "sub_write_errors": ("counter", "写订阅者套接字失败次数"),
+    "sub_overflow_disconnects": ("counter", "缓冲区溢出后被断开的订阅者数"),
+    "frame_sent": ("counter", "控制帧发送次数"),
+    "frame_missed": ("counter", "控制帧晚于截止时刻超过1ms的次数"),
+    "frame_skipped": ("counter", "控制帧整周期未能发送而跳过的次数"),
+    "frame_transmit_failed": ("counter", "控制帧 VCI_Transmit 失败次数"),
+    "frame_lateness_max_us": ("gauge", "控制帧发送时刻与截止时刻之差的最大值（微秒）"),
+    "frame_period_error_max_us": ("gauge", "控制帧相邻发送间隔与周期之差的最大值（微秒）"),
+}
+HISTOGRAM_SUFFIXES = ("_bucket", "_sum", "_count")
+
+
+def read_snapshot(path=METRICS_SOCKET_PATH, timeout=1.0):
+    """
+    读取一份指标快照
+    Returns:
+        快照文本。
+    Raises:
+        OSError: middleware 未运行或未开启指标套接字。
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b"".join(chunks).decode("ascii")
+
+
+def parse_snapshot(text):
+    """
+    解析快照
+    Returns:
+        {(名称, ((标签, 值), ...)): 数值}，保持快照中的顺序。
+    """
+    samples = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        labels = tuple(tuple(field.split("=", 1)) for field in fields[1:-1])
+        samples[(fields[0], labels)] = int(fields[-1])
+    return samples
+
+
+def bus_load(previous, current):
+    """
+    由相邻两次快照计算每个通道的总线负载（收发帧位数之和 / 位速率）
+    middleware 重启（运行时间或计数器减小）或位速率未知时返回空字典。
+    Returns:
+        {通道号字符串: 百分比}
+    """
+    bitrate = current.get(("bus_bitrate", ()), 0)
+    elapsed_us = current.get(("uptime_us", ()), 0) - previous.get(("uptime_us", ()), 0)
+    if bitrate <= 0 or elapsed_us <= 0:
+        return {}
+    load = {}
+    for (name, labels), value in current.items():
+        if name != "rx_bits":
+            continue
+        channel = dict(labels)["channel"]
+        bits = 0
+        for key in (("rx_bits", labels), ("tx_bits", labels)):
+            delta = current.get(key, 0) - previous.get(key, 0)
+            if delta < 0:
+                return {}
+            bits += delta
+        load[channel] = 100.0 * bits / (bitrate * elapsed_us / 1e6)
+    return load
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _histogram_base(name):
+    for suffix in HISTOGRAM_SUFFIXES:
+        if name.endswith(suffix) and METRICS.get(name[:-len(suffix)], ("",))[0] == "histogram":
+            return name[:-len(suffix)], suffix
+    return None, None
+
+
+def to_prometheus(samples, load=None, up=True):
+    """
+    把快照转换为 Prometheus 文本格式
+    Args:
+        samples: parse_snapshot 的结果。
+        load: bus_load 的结果，None 表示不输出总线负载。
+        up: 本次是否成功读取到快照。
+    Returns:
+        文本。
+    """
+    lines = [f"# HELP {PREFIX}up 能否读取 middleware 指标", f"# TYPE {PREFIX}up gauge",
+             f"{PREFIX}up {1 if up else 0}"]
+    # 同一指标的样本必须连续输出，快照中按通道交错的样本在这里重新分组
+    families = {}
+    for (name, labels), value in samples.items():
+        base, suffix = _histogram_base(name)
+        if base is not None:
+            metric_type, help_text = METRICS[base]
+            family = PREFIX + base[:-len("_us")] + "_seconds"
+            if suffix == "_bucket":
+                labels = tuple((key, text) if key != "le" or text == "+Inf"
+                               else (key, repr(int(text) / 1e6)) for key, text in labels)
+            text_value = repr(value / 1e6) if suffix == "_sum" else str(value)
+            sample_name = family + suffix
+        elif name in METRICS:
+            metric_type, help_text = METRICS[name]
+            family = sample_name = PREFIX + name + ("_total" if metric_type == "counter" else "")
+            text_value = str(value)
+        else:
+            # 新版 middleware 增加的指标原样输出
+            metric_type, help_text = "untyped", name
+            family = sample_name = PREFIX + name
+            text_value = str(value)
+        if family not in families:
+            families[family] = [f"# HELP {family} {help_text}", f"# TYPE {family} {metric_type}"]
+        families[family].append(f"{sample_name}{_format_labels(labels)} {text_value}")
+    for family_lines in families.values():
+        lines.extend(family_lines)
+    if load:
+        lines.append(f"# HELP {PREFIX}bus_load_percent 相邻两次采样之间的总线负载（不含位填充）")
+        lines.append(f"# TYPE {PREFIX}bus_load_percent gauge")
+        for channel, percent in sorted(load.items()):
+            lines.append(f'{PREFIX}bus_load_percent{{channel="{channel}"}} {percent:.3f}')
+    return "\n".join(lines) + "\n"
+
+
+class Exporter:
+    """
+    后台线程每隔 interval 秒读取一次快照，render() 返回最近一次的 Prometheus 文本，
+    抓取请求本身不访问 middleware，多个抓取方也只产生固定频率的读取。
+    Args:
+        path: 指标套接字路径。
+        interval: 读取间隔（秒），也是总线负载的统计窗口。
+    """
+
+    def __init__(self, path=METRICS_SOCKET_PATH, interval=POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.previous = None
+        self.up = True
+        self.text = to_prometheus({}, up=False)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def poll(self):
+        """读取一次快照并更新输出文本"""
+        try:
+            samples = parse_snapshot(read_snapshot(self.path))
+        except (OSError, ValueError) as e:
+            if self.up:
+                print(f"[WARN] 读取指标失败: {e}")  # 只在状态变化时打印
+            self.up = False
+            self.previous = None
+            text = to_prometheus({}, up=False)
+        else:
+            load = bus_load(self.previous, samples) if self.previous is not None else None
+            self.previous = samples
+            self.up = True
+            text = to_prometheus(samples, load)
+        with self.lock:
+            self.text = text
+
+    def _run(self):
+        next_time = time.monotonic()
+        while self.running:
+            self.poll()
+            next_time += self.interval
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+    def render(self):
+        with self.lock:
+            return self.text
+
+    def close(self):
+        self.running = False
+
+
+def serve(port=DEFAULT_PORT, host="127.0.0.1", path=METRICS_SOCKET_PATH, interval=POLL_INTERVAL):
+    """在 http://host:port/metrics 上提供 Prometheus 指标，直到 Ctrl+C"""
+    exporter = Exporter(path, interval)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = exporter.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 不为每次抓取打印日志
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"指标导出: http://{host}:{port}/metrics（每 {interval}s 读取 {path}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.close()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="middleware 运行指标的 Prometheus 导出器")
+    parser.add_argument("--socket", default=METRICS_SOCKET_PATH, help="指标套接字路径")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="HTTP 端口")
+    parser.add_argument("--host", default="127.0.0.1", help="HTTP 监听地址")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help="读取快照的间隔（秒），也是总线负载的统计窗口")
+    parser.add_argument("--once", action="store_true",
+                        help="间隔 interval 读取两次快照，打印 Prometheus 文本后退出")
+    args = parser.parse_args()
+
+    if args.once:
+        previous = parse_snapshot(read_snapshot(args.socket))
+        time.sleep(args.interval)
+        samples = parse_snapshot(read_snapshot(args.socket))
+        print(to_prometheus(samples, bus_load(previous, samples)), end="")
+        return
+    serve(args.port, args.host, args.socket, args.interval)
+
+
+if __name__ == "__main__":
+    main()
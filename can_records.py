@@ -0,0 +1,109 @@
+"""
+middleware 接收通道的二进制记录
+客户端连接 /tmp/can_read_socket 后发送 "format binary\n"，middleware 即改为输出
+24 字节定长记录（小端）：timestamp_us(uint64) id(uint32) channel(uint8) dlc(uint8)
+flags(uint8) reserved(uint8) data(8 x uint8)。
+记录可以直接用 numpy.frombuffer 映射为结构化数组，不做任何拷贝。
+接收通道支持多个订阅者，每个订阅者可以另行发送 "filter <id> ..." 只接收指定ID，
+以及 "overflow drop|disconnect" 选择缓冲区满时丢弃最旧的帧还是断开连接。
+"""
+import socket
+
+import numpy as np
+
+SOCKET_READ_PATH = "/tmp/can_read_socket"
+
+RECORD_DTYPE = np.dtype([
+    ("timestamp_us", "<u8"),
+    ("id", "<u4"),
+    ("channel", "u1"),
+    ("dlc", "u1"),
+    ("flags", "u1"),
+    ("reserved", "u1"),
+    ("data", "u1", (8,)),
+])
+RECORD_SIZE = RECORD_DTYPE.itemsize
+
+FLAG_EXTERN = 0x01
+FLAG_REMOTE = 0x02
+
+
+def subscription_request(binary=True, ids=None, overflow=None):
+    """
+    生成订阅接收通道时发送的请求
+    Args:
+        binary: 是否使用二进制记录格式。
+        ids: 只接收这些ID，None 或空表示全部（middleware 最多支持64个）。
+        overflow: middleware 端缓冲区满时的策略，"drop" 或 "disconnect"，None 为默认（drop）。
+    """
+    lines = ["format binary" if binary else "format text"]
+    if ids:
+        lines.append("filter " + " ".join(f"0x{frame_id:X}" for frame_id in ids))
+    if overflow is not None:
+        if overflow not in ("drop", "disconnect"):
+            raise ValueError(f"未知的溢出策略: {overflow}")
+        lines.append(f"overflow {overflow}")
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+
+def frombuffer(buffer, count=-1):
+    """把一段二进制记录映射为结构化数组（共享内存，不拷贝）"""
+    return np.frombuffer(buffer, dtype=RECORD_DTYPE, count=count)
+
+
+def payloads(records):
+    """
+    把记录的数据区转为 uint64 载荷列（第0字节在最高位），可直接交给 convert.FrameDecoder
+    """
+    return records["data"].copy().view(">u8").reshape(-1).astype(np.uint64)
+
+
+class BinaryReceiver:
+    """
+    以二进制格式订阅接收通道
+    read() 把数据直接 recv_into 预分配的缓冲区，并返回映射在缓冲区上的记录数组；
+    返回的数组在下一次 read() 之前有效，需要保留时请自行 copy()。
+    Args:
+        path: 接收套接字路径。
+        capacity: 单次最多读取的记录条数。
+        ids: 只接收这些ID，None 表示全部。
+        overflow: middleware 端缓冲区满时的策略，见 subscription_request。
+    """
+
+    def __init__(self, path=SOCKET_READ_PATH, capacity=4096, ids=None, overflow=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.sock.sendall(subscription_request(True, ids, overflow))
+        self.buffer = bytearray(capacity * RECORD_SIZE)
+        self.view = memoryview(self.buffer)
+        self.pending = 0  # 缓冲区开头残留的半条记录字节数
+        self.last_size = 0
+
+    def read(self):
+        """
+        阻塞读取一批记录
+        Returns:
+            结构化数组；连接关闭时返回 None。
+        """
+        if self.pending:
+            # 把上次残留的半条记录移到缓冲区开头
+            tail = self.last_size - self.pending
+            self.buffer[:self.pending] = self.buffer[tail:self.last_size]
+        n = self.sock.recv_into(self.view[self.pending:])
+        if n == 0:
+            return None
+        size = self.pending + n
+        complete = size - size % RECORD_SIZE
+        self.pending = size - complete
+        self.last_size = size
+        return frombuffer(self.view[:complete])
+
+    def __iter__(self):
+        while True:
+            records = self.read()
+            if records is None:
+                return
+            yield records
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,484 @@
+"""
+录制回放：把录制的会话重新送入协议栈，用于复现现场问题与压力测试
+输入为 right.txt（checkright.py 格式）、record.txt（convert.py 格式）、
+can_store 录制文件或 can_archive 归档文件。回放方式：
+    bus：在 /tmp/can_read_socket 上替代 middleware 的接收通道（订阅请求同 middleware：
+        format binary|text、filter），把帧作为接收报文发给订阅者；
+    command：把控制帧的载荷作为二进制批量指令写入 /tmp/can_socket，
+        middleware（或 can_sim.py）据此更新控制帧。
+速度可以是原始时序（--speed 1）、N 倍速（--speed N）或尽快（--speed max）。
+每帧的发送时刻是 CLOCK_MONOTONIC 上的绝对截止时刻：先睡眠到截止时刻前 SPIN_US 微秒，
+再忙等到截止时刻，误差不累积；此时已到期的帧合并为一批发送。结束时报告实际速率与定时误差。
+"""
+import argparse
+import os
+import re
+import socket
+import threading
+import time
+
+import numpy as np
+
+from can_archive import is_archive, open_records
+from can_encoder import encode_batch
+from can_records import FLAG_EXTERN, RECORD_DTYPE, SOCKET_READ_PATH
+from can_sim import CONTROL_FRAMES, Subscriber, format_text
+from can_store import is_store
+from frame_config import DEFAULT_FRAME_CONFIG, load_frame_config
+
+SOCKET_PATH = "/tmp/can_socket"
+
+SPIN_US = 200  # 截止时刻前改为忙等的提前量
+START_DELAY_US = 50000  # 第一帧的截止时刻距开始回放的时间
+MAX_BATCH = 4096  # 单批最多发送的帧数
+ACK_TIMEOUT = 2.0  # 回放结束后等待指令应答的时间（秒）
+
+RIGHT_PATTERN = re.compile(r"^time: (\d+) id: ([0-9A-F]+), data: ((?:[0-9A-F]+ )*)", re.M)
+
+
+def _spread(timestamps_us, resolution_us):
+    """
+    日志时间戳只精确到 resolution_us 时，把同一时间戳的连续多帧均匀分布在该时间段内，
+    导出后的时间戳不变
+    """
+    n = len(timestamps_us)
+    if n == 0:
+        return timestamps_us
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(timestamps_us) != 0) + 1))
+    sizes = np.diff(np.append(starts, n))
+    run = np.repeat(np.arange(len(starts)), sizes)
+    position = np.arange(n) - starts[run]
+    return timestamps_us + (position * resolution_us // sizes[run]).astype(np.uint64)
+
+
+def _fill_data(records, datas):
+    """按每帧的数据字节填写 dlc 与 data（不足8字节补0）"""
+    records["dlc"] = [len(data) for data in datas]
+    records["data"] = np.frombuffer(b"".join(data.ljust(8, b"\0") for data in datas),
+                                    dtype=np.uint8).reshape(-1, 8)
+
+
+def load_right(path):
+    """读取 right.txt（time: <毫秒> id: <ID>, data: XX XX ...），没有通道信息，通道记为0"""
+    with open(path, "r") as f:
+        matches = RIGHT_PATTERN.findall(f.read())
+    records = np.zeros(len(matches), dtype=RECORD_DTYPE)
+    if not matches:
+        return records
+    timestamps = np.array([int(m[0]) for m in matches], dtype=np.uint64) * 1000
+    records["timestamp_us"] = _spread(timestamps, 1000)
+    records["id"] = [int(m[1], 16) for m in matches]
+    _fill_data(records, [bytes.fromhex(m[2])[:8] for m in matches])
+    records["flags"] = np.where(records["id"] > 0x7FF, FLAG_EXTERN, 0)
+    return records
+
+
+def load_record(path):
+    """读取 record.txt（[<秒>] <通道> Rx <ID> <Ext|Std> <DLC> <每字节8位二进制> ...）"""
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 6 or not parts[0].startswith("["):
+                continue
+            try:
+                data = [int(bits, 2) for bits in parts[6:6 + 8]]
+                rows.append((int(parts[0][1:-1]), int(parts[1]), int(parts[3], 16),
+                             parts[4] == "Ext", data))
+            except ValueError:
+                continue  # 格式异常的行与 convert.py 一样跳过
+    records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    if not rows:
+        return records
+    timestamps = np.array([row[0] for row in rows], dtype=np.uint64) * 1000000
+    records["timestamp_us"] = _spread(timestamps, 1000000)
+    records["channel"] = [row[1] for row in rows]
+    records["id"] = [row[2] for row in rows]
+    records["flags"] = [FLAG_EXTERN if row[3] else 0 for row in rows]
+    _fill_data(records, [bytes(row[4]) for row in rows])
+    return records
+
+
+def load_frames(path):
+    """
+    读取回放的帧，格式按文件内容自动识别
+    Returns:
+        can_records.RECORD_DTYPE 数组，保持文件中的顺序。
+    Raises:
+        ValueError: 无法识别的格式。
+    """
+    if is_store(path) or is_archive(path):
+        return np.asarray(open_records(path).records)
+    with open(path, "r") as f:
+        first = next((line for line in f if line.strip()), "")
+    if first.startswith("time: "):
+        return load_right(path)
+    if first.startswith("["):
+        return load_record(path)
+    raise ValueError(f"无法识别 {path} 的格式（应为 right.txt、record.txt 或录制文件）")
+
+
+def parse_speed(text):
+    """--speed 参数：倍速，max 表示尽快（返回0）"""
+    if text == "max":
+        return 0.0
+    speed = float(text)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("倍速应大于0，或为 max")
+    return speed
+
+
+def schedule(records, speed):
+    """
+    每帧相对第一帧的发送时刻（纳秒）
+    文件中时间戳偶有倒退时（多通道合并）按不早于前一帧处理，保持文件顺序
+    """
+    if len(records) == 0:
+        return np.zeros(0, dtype=np.int64)
+    timestamps = records["timestamp_us"].astype(np.int64)
+    offsets = np.maximum.accumulate(timestamps - timestamps[0]) * 1000
+    return (offsets / speed).astype(np.int64)
+
+
+def start_time(timed=True):
+    """回放的起始时刻（CLOCK_MONOTONIC 纳秒），按时序回放时留出 START_DELAY_US 的准备时间"""
+    return time.monotonic_ns() + (START_DELAY_US * 1000 if timed else 0)
+
+
+def retime(records, speed, start_ns):
+    """
+    把记录的时间戳改写为回放时的墙钟时刻
+    start_ns 应与传给 play() 的起始时刻相同，改写后的时间戳即各帧的截止时刻。
+    """
+    records = records.copy()
+    start_us = (start_ns + time.time_ns() - time.monotonic_ns()) // 1000
+    records["timestamp_us"] = start_us + schedule(records, speed) // 1000
+    return records
+
+
+class ReplayStats:
+    """
+    回放结果
+    Attributes:
+        frames: 发送的帧数。
+        batches: 发送的批数。
+        elapsed: 从第一帧的截止时刻到发送完最后一批的时间（秒）。
+        planned: 按截止时刻计划的用时（秒），尽快模式为0。
+        lateness_us: 每帧实际发送时刻晚于截止时刻的量（微秒），尽快模式为 None。
+    """
+
+    def __init__(self, frames, batches, elapsed, planned, lateness_us):
+        self.frames = frames
+        self.batches = batches
+        self.elapsed = elapsed
+        self.planned = planned
+        self.lateness_us = lateness_us
+
+    @property
+    def rate(self):
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    def report(self):
+        lines = [f"回放 {self.frames} 帧（{self.batches} 批），用时 {self.elapsed:.3f}s",
+                 f"实际速率 {self.rate:.0f} 帧/s"]
+        if self.planned > 0:
+            lines[0] += f"，计划用时 {self.planned:.3f}s"
+            lines[1] += f"，目标速率 {self.frames / self.planned:.0f} 帧/s"
+        if self.lateness_us is not None and len(self.lateness_us):
+            p50, p99 = np.percentile(self.lateness_us, [50, 99])
+            lines.append(f"定时误差 平均 {self.lateness_us.mean():.1f}us p50 {p50:.1f}us "
+                         f"p99 {p99:.1f}us 最大 {self.lateness_us.max():.1f}us")
+        return "\n".join(lines)
+
+
+def play(records, sink, speed=1.0, spin_us=SPIN_US, max_batch=MAX_BATCH, start_ns=None):
+    """
+    按截止时刻把帧分批交给 sink
+    Args:
+        records: RECORD_DTYPE 数组。
+        sink: 可调用对象，每批调用一次 sink(records[i:j])。
+        speed: 倍速，0 表示尽快（每批 max_batch 帧连续发送）。
+        spin_us: 截止时刻前改为忙等的提前量。
+        max_batch: 单批最多发送的帧数。
+        start_ns: 第一帧的截止时刻（CLOCK_MONOTONIC 纳秒），None 表示 start_time()。
+    Returns:
+        ReplayStats
+    """
+    n = len(records)
+    timed = speed > 0
+    offsets = schedule(records, speed) if timed else np.zeros(n, dtype=np.int64)
+    lateness = np.zeros(n, dtype=np.int64) if timed else None
+    spin_ns = spin_us * 1000
+    start = start_time(timed) if start_ns is None else start_ns
+    deadlines = offsets + start
+    batches = 0
+    i = 0
+    while i < n:
+        now = time.monotonic_ns()
+        if timed:
+            wait = int(deadlines[i]) - now
+            if wait > spin_ns:
+                time.sleep((wait - spin_ns) / 1e9)
+                now = time.monotonic_ns()
+            while now < deadlines[i]:
+                now = time.monotonic_ns()
+            # 已到期的帧合并为一批
+            j = min(int(np.searchsorted(deadlines, now, "right")), i + max_batch)
+            lateness[i:j] = now - deadlines[i:j]
+        else:
+            j = min(n, i + max_batch)
+        sink(records[i:j])
+        batches += 1
+        i = j
+    elapsed = (time.monotonic_ns() - start) / 1e9
+    planned = int(offsets[-1]) / 1e9 if n else 0.0
+    return ReplayStats(n, batches, elapsed, planned,
+                       lateness / 1000 if lateness is not None else None)
+
+
+class ReplaySubscriber(Subscriber):
+    """
+    回放接收通道的一个订阅者，请求的处理同 can_sim.Subscriber
+    写入是阻塞的：订阅者读取过慢时回放随之变慢（体现为定时误差），不丢帧。
+    """
+
+    def __init__(self, sock):
+        super().__init__(None)
+        self.sock = sock
+        self.thread = threading.Thread(target=self._read_requests, daemon=True)
+        self.thread.start()
+
+    def _read_requests(self):
+        pending = b""
+        while True:
+            try:
+                request = self.sock.recv(256)
+            except OSError:
+                return
+            if not request:
+                return
+            lines = (pending + request).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                self.request(line.decode("ascii", "replace").strip())
+
+    def publish(self, records):
+        if self.ids is not None:
+            records = records[np.isin(records["id"], self.ids)]
+        if len(records):
+            self.sock.sendall(records.tobytes() if self.binary else format_text(records))
+            self.delivered += len(records)
+        return True
+
+
+class ReadChannelServer:
+    """
+    替代 middleware 接收通道的服务端，实例可直接作为 play() 的 sink
+    Args:
+        path: 接收套接字路径，已存在时先删除。
+    """
+
+    def __init__(self, path=SOCKET_READ_PATH):
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(8)
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            print("Rx 数据通道客户端已连接。")
+            with self.lock:
+                self.subscribers.append(ReplaySubscriber(sock))
+
+    def wait(self, count, timeout=None):
+        """等待至少 count 个订阅者连接并发送完订阅请求，超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.subscribers) < count:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        time.sleep(0.1)  # 订阅者连接后紧接着发送 format/filter 请求
+        return True
+
+    def __call__(self, records):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.publish(records)
+            except OSError:
+                print(f"Rx 数据通道客户端断开，已发送 {subscriber.delivered} 帧。")
+                with self.lock:
+                    self.subscribers.remove(subscriber)
+                subscriber.sock.close()
+
+    def close(self):
+        with self.lock:
+            for subscriber in self.subscribers:
+                print(f"Rx 数据通道关闭，已发送 {subscriber.delivered} 帧。")
+                subscriber.sock.close()
+            self.subscribers = []
+        self.server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class CommandSink:
+    """
+    把控制帧的载荷作为二进制批量指令写入指令通道，实例可直接作为 play() 的 sink
+    心跳字节与异或字节由 middleware 维护，只写入其余字节；不在控制帧表中的帧跳过。
+    后台线程读取应答并计数。
+    Args:
+        specs: [frame_config.FrameSpec, ...]。
+        path: 指令套接字路径。
+    """
+
+    def __init__(self, specs, path=SOCKET_PATH):
+        self.runs = {spec.id: self._byte_runs(spec) for spec in specs}
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.sent = 0  # 写入的指令记录条数
+        self.skipped = 0  # 不在控制帧表中的帧
+        self.batches = 0  # 写入的二进制批数（每批一条应答）
+        self.acks = 0
+        self.rejected = 0
+        self.last_error = None
+        self.thread = threading.Thread(target=self._read_acks, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _byte_runs(spec):
+        """除心跳与异或字节外的连续字节区间 [(起始字节, 结束字节), ...]"""
+        protected = {spec.heartbeat} if spec.heartbeat is not None else set()
+        if spec.checksum == "xor":
+            protected.add(7)
+        runs = []
+        start = None
+        for index in range(9):
+            if index < 8 and index not in protected:
+                if start is None:
+                    start = index
+            elif start is not None:
+                runs.append((start, index))
+                start = None
+        return runs
+
+    def _read_acks(self):
+        pending = b""
+        while True:
+            try:
+                chunk = self.sock.recv(65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                self.acks += 1
+                if not line.startswith(b"ok"):
+                    self.rejected += 1
+                    self.last_error = line.decode("ascii", "replace")
+
+    def __call__(self, records):
+        commands = []
+        for frame_id, dlc, data in zip(records["id"].tolist(), records["dlc"].tolist(),
+                                       (row.tobytes() for row in records["data"])):
+            runs = self.runs.get(frame_id)
+            if runs is None:
+                self.skipped += 1
+                continue
+            for start, end in runs:
+                end = min(end, dlc)
+                if start < end:
+                    # middleware 位号：第 k 字节占 8k..8k+7 位，value 的最低位写入 start_bit
+                    commands.append((frame_id, start * 8, (end - start) * 8,
+                                     int.from_bytes(data[start:end], "little")))
+        if commands:
+            payload = encode_batch(commands)
+            self.sock.sendall(payload)
+            self.sent += len(commands)
+            self.batches += (len(commands) + 254) // 255
+
+    def close(self, timeout=ACK_TIMEOUT):
+        """等待全部应答（最多 timeout 秒）后断开"""
+        deadline = time.monotonic() + timeout
+        while self.acks < self.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按原始时序、倍速或尽快回放录制的 CAN 会话")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    for name, help_text in (("bus", "替代 middleware 的接收通道，作为接收报文发给订阅者"),
+                            ("command", "作为二进制批量指令写入 middleware 的指令通道")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("path", help="right.txt、record.txt、录制文件或归档文件")
+        p.add_argument("--speed", type=parse_speed, default=1.0,
+                       help="倍速，1 为原始时序，max 为尽快（默认1）")
+        p.add_argument("--spin-us", type=int, default=SPIN_US,
+                       help="截止时刻前忙等的微秒数，越大越准，CPU 占用越高")
+        if name == "bus":
+            p.add_argument("--socket", default=SOCKET_READ_PATH, help="接收套接字路径")
+            p.add_argument("--wait", type=int, default=1, help="等待多少个订阅者连接后开始")
+            p.add_argument("--retime", action="store_true",
+                           help="把帧的时间戳改写为回放时刻（默认保留原始时间戳）")
+        else:
+            p.add_argument("--socket", default=SOCKET_PATH, help="指令套接字路径")
+            p.add_argument("--frames", default=DEFAULT_FRAME_CONFIG,
+                           help="控制帧表，不存在时使用内置的控制帧表")
+    args = parser.parse_args()
+
+    records = load_frames(args.path)
+    print(f"读取 {len(records)} 帧: {args.path}")
+    if args.mode == "bus":
+        server = ReadChannelServer(args.socket)
+        print(f"等待 {args.wait} 个订阅者连接 {args.socket} ...")
+        try:
+            server.wait(args.wait)
+            # 等待订阅者之后才确定起始时刻，改写的时间戳与实际发送时刻一致
+            speed = args.speed
+            start = start_time(speed > 0)
+            if args.retime and speed > 0:
+                # 改写后的时间戳已按倍速排好，按原始时序回放即可
+                records = retime(records, speed, start)
+                speed = 1.0
+            stats = play(records, server, speed, args.spin_us, start_ns=start)
+        except KeyboardInterrupt:
+            return
+        finally:
+            server.close()
+        print(stats.report())
+    else:
+        try:
+            specs = load_frame_config(args.frames)
+        except OSError:
+            print(f"未找到帧配置 {args.frames}，使用内置的控制帧表")
+            specs = CONTROL_FRAMES
+        sink = CommandSink(specs, args.socket)
+        try:
+            stats = play(records, sink, args.speed, args.spin_us)
+        except KeyboardInterrupt:
+            return
+        finally:
+            sink.close()
+        print(stats.report())
+        print(f"指令 {sink.sent} 条（{sink.batches} 批），应答 {sink.acks}，拒绝 {sink.rejected}，"
+              f"跳过非控制帧 {sink.skipped} 帧")
+        if sink.last_error:
+            print(f"最近一次拒绝: {sink.last_error}")
+
+
+if __name__ == "__main__":
+    main()
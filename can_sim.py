@@ -0,0 +1,596 @@
+"""
+不需要 USB-CAN 硬件的模拟总线，可替代 middleware 运行
+在 /tmp/can_socket 与 /tmp/can_read_socket 上提供与 middleware.c 相同的协议：
+    指令通道：换行分隔的 "send id start len bits" 文本指令与二进制批量指令；
+    接收通道：可多个订阅者，默认文本行，客户端发送 "format binary\n" 后改为24字节定长记录，
+        "filter <id> ..." 只接收指定ID，"overflow drop|disconnect" 选择积压过多时的策略。
+总线上按周期发送控制帧表（control_frames.yaml，不存在时为内置的4个控制帧）中的帧，
+心跳与异或同 middleware 的 update_heartbeat_and_xor，指令可以用 "set <信号名> <值>" 按名称设置信号，
+并可叠加每秒数万帧的背景报文，以及丢帧、心跳跳变、异或错误等故障注入。
+给定 --seed 时背景报文与故障序列可以复现。
+"""
+import argparse
+import asyncio
+import math
+import os
+import struct
+import time
+
+import numpy as np
+
+from can_encoder import Signal
+from can_records import FLAG_EXTERN, RECORD_DTYPE
+from frame_config import DEFAULT_FRAME_CONFIG, FrameSpec, load_frame_config
+
+SOCKET_PATH = "/tmp/can_socket"
+SOCKET_READ_PATH = "/tmp/can_read_socket"
+
+ESP_COMMAND = 0x1801B0A0
+SPEED_COMMAND = 0x1803B0A0
+LIGHT_COMMAND = 0x1805B0A0
+REMOTE_COMMAND = 0x1807B0A0
+
+# 内置控制帧表，与 middleware.c 的 default_control_frames 一致
+CONTROL_FRAMES = [
+    FrameSpec(ESP_COMMAND, 20, [0x00, 0x00, 0x00, 0x00, 0x27, 0x00, 0x00, 0x00], heartbeat=1,
+              checksum="xor"),
+    FrameSpec(SPEED_COMMAND, 20, [0x80, 0x18, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00], heartbeat=2,
+              checksum="xor"),
+    FrameSpec(LIGHT_COMMAND, 50, [0x01, 0x00, 0x00, 0x00, 0x09, 0x00, 0x00, 0x00], heartbeat=7),
+    FrameSpec(REMOTE_COMMAND, 100, [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00], heartbeat=7),
+]
+BACKGROUND_CHANNEL = 0
+
+# 二进制批量指令格式，与 middleware.c 中的 BIN_* 定义一致
+BIN_MAGIC = 0xB1
+BIN_VERSION = 1
+BIN_MAX_RECORDS = 255
+BIN_HEADER = struct.Struct("<BBH")
+BIN_RECORD = struct.Struct("<IBBHQ")
+CMD_BUFF_SIZE = BIN_HEADER.size + BIN_MAX_RECORDS * BIN_RECORD.size + 12
+
+# 指令通道最多同时服务的客户端数，与 middleware.c 的 MAX_COMMAND_CLIENTS 一致
+MAX_COMMAND_CLIENTS = 32
+# 应答积压超过该字节数时丢弃（客户端不读取应答），对应 middleware 的非阻塞写
+ACK_BACKLOG_LIMIT = 1 << 16
+
+# 接收通道订阅者，与 middleware.c 的 MAX_SUBSCRIBERS / SUB_RING_FRAMES 一致
+MAX_SUBSCRIBERS = 8
+SUB_RING_FRAMES = 16384
+
+
+def calculate_xor(data):
+    value = 0
+    for byte in data:
+        value ^= byte
+    return value
+
+
+class ControlFrame:
+    """单个控制帧的状态"""
+
+    def __init__(self, spec):
+        self.id = spec.id
+        self.data = bytearray(spec.data)
+        self.interval_ms = spec.interval_ms
+        self.channel = spec.channel
+        self.heartbeat_byte = spec.heartbeat
+        self.has_xor = spec.checksum == "xor"
+        self.next_send_time = 0.0
+
+    def update(self, value, start, length):
+        """按 middleware 的位号（小端64位整数，start 从第0字节最低位起）写入 value"""
+        if start < 0 or length < 1 or start + length > 64:
+            return False
+        mask = ((1 << length) - 1) << start
+        payload = int.from_bytes(self.data, "little")
+        payload = (payload & ~mask) | ((value << start) & mask)
+        self.data[:] = payload.to_bytes(8, "little")
+        return True
+
+    def set_signal(self, signal, raw):
+        """按 lookup.yaml 的位号（第0字节在最高位）写入信号的原始值"""
+        mask = signal.mask << signal.shift
+        payload = int.from_bytes(self.data, "big")
+        payload = (payload & ~mask) | ((raw << signal.shift) & mask)
+        self.data[:] = payload.to_bytes(8, "big")
+
+    def heartbeat(self, step=1):
+        """心跳加 step 并重新计算异或，与 update_heartbeat_and_xor 相同"""
+        index = self.heartbeat_byte
+        if index is not None:
+            self.data[index] = (self.data[index] + step) & 0xFF
+        if self.has_xor:
+            self.data[7] = calculate_xor(self.data[:7])
+
+
+class Faults:
+    """
+    故障注入的概率（0~1，每个控制帧独立判定）
+    Args:
+        drop: 控制帧被丢弃（心跳照常递增，接收端会看到周期与心跳同时跳变）。
+        skip_heartbeat: 心跳跳过一个值。
+        bad_xor: 带校验的帧异或字节错误。
+    """
+
+    def __init__(self, drop=0.0, skip_heartbeat=0.0, bad_xor=0.0):
+        self.drop = drop
+        self.skip_heartbeat = skip_heartbeat
+        self.bad_xor = bad_xor
+
+
+class SimulatedBus:
+    """
+    模拟总线，step() 返回到当前时刻为止应出现在总线上的全部帧
+    Args:
+        rate: 背景报文速率（帧/秒），0 表示不发送。
+        background_ids: 背景报文使用的ID个数。
+        faults: Faults 实例。
+        seed: 随机数种子。
+        frames: [FrameSpec, ...]，None 表示内置的 CONTROL_FRAMES。
+    """
+
+    def __init__(self, rate=0, background_ids=32, faults=None, seed=None, frames=None):
+        specs = CONTROL_FRAMES if frames is None else frames
+        self.frames = [ControlFrame(spec) for spec in specs]
+        self.by_id = {frame.id: frame for frame in self.frames}
+        self.signals = {field['name']: Signal(spec.id, field)
+                        for spec in specs for field in spec.signals}
+        self.rate = rate
+        self.faults = faults or Faults()
+        self.rng = np.random.default_rng(seed)
+        self.background_ids = self.rng.integers(0x100, 0x1FFFFFFF, background_ids, dtype=np.uint32)
+        self.background_debt = 0.0  # 尚未发出的背景报文（小数部分跨步累计）
+        self.last_step = None
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self, now_ms):
+        self.last_step = now_ms
+        for frame in self.frames:
+            frame.next_send_time = now_ms + frame.interval_ms
+
+    def apply(self, frame_id, start, length, value):
+        """应用一条指令，返回是否成功"""
+        frame = self.by_id.get(frame_id)
+        if frame is None:
+            print("未找到对应控制帧。")
+            return False
+        if not frame.update(value, start, length):
+            print("数据超出范围。")
+            return False
+        return True
+
+    def set_signal(self, name, value):
+        """
+        按信号名设置物理值，与 middleware 的 process_set_command 相同
+        Returns:
+            应答原因："ok"、"signal" 或 "range"。
+        """
+        signal = self.signals.get(name)
+        if signal is None:
+            print(f"未找到信号 {name}。")
+            return "signal"
+        raw = (value - signal.offset) / signal.factor
+        if not math.isfinite(raw) or not 0 <= round(raw) <= signal.mask:
+            print("数据超出范围。")
+            return "range"
+        self.by_id[signal.frame_id].set_signal(signal, round(raw))
+        return "ok"
+
+    def _control_frames(self, now_ms):
+        """按截止时间发出到期的控制帧，返回 [(frame_id, channel, data), ...]"""
+        due = []
+        for frame in self.frames:
+            while now_ms >= frame.next_send_time - 1:
+                faults = self.faults
+                step = 2 if self.rng.random() < faults.skip_heartbeat else 1
+                frame.heartbeat(step)
+                data = bytes(frame.data)
+                if frame.has_xor and self.rng.random() < faults.bad_xor:
+                    data = data[:7] + bytes([data[7] ^ 0x5A])
+                if self.rng.random() < faults.drop:
+                    self.dropped += 1
+                else:
+                    due.append((frame.id, frame.channel, data))
+                frame.next_send_time += frame.interval_ms
+                if frame.next_send_time < now_ms:
+                    frame.next_send_time = now_ms + frame.interval_ms
+        return due
+
+    def step(self, now_ms, timestamp_us):
+        """
+        推进到 now_ms（单调时钟，毫秒）
+        Returns:
+            RECORD_DTYPE 结构化数组，控制帧在前，背景报文在后。
+        """
+        control = self._control_frames(now_ms)
+        self.background_debt += self.rate * (now_ms - self.last_step) / 1000
+        self.last_step = now_ms
+        n_background = int(self.background_debt)
+        self.background_debt -= n_background
+
+        records = np.zeros(len(control) + n_background, dtype=RECORD_DTYPE)
+        records['timestamp_us'] = timestamp_us
+        records['dlc'] = 8
+        records['flags'] = FLAG_EXTERN
+        if control:
+            records['id'][:len(control)] = [frame_id for frame_id, _, _ in control]
+            records['channel'][:len(control)] = [channel for _, channel, _ in control]
+            records['data'][:len(control)] = np.frombuffer(
+                b"".join(data for _, _, data in control), dtype=np.uint8).reshape(-1, 8)
+        if n_background:
+            background = records[len(control):]
+            background['id'] = self.background_ids[
+                self.rng.integers(0, len(self.background_ids), n_background)]
+            background['channel'] = BACKGROUND_CHANNEL
+            background['data'] = self.rng.integers(0, 256, (n_background, 8), dtype=np.uint8)
+        self.sent += len(records)
+        return records
+
+
+def format_text(records):
+    """按 middleware 的文本格式输出：time:<毫秒> id:0x<id> data:<HEX>"""
+    milliseconds = (records['timestamp_us'] // 1000).tolist()
+    return "".join(
+        f"time:{t} id:0x{frame_id:x} data:{data[:dlc].hex().upper()}\n"
+        for t, frame_id, dlc, data in zip(milliseconds, records['id'].tolist(),
+                                          records['dlc'].tolist(),
+                                          (row.tobytes() for row in records['data']))
+    ).encode("ascii")
+
+
+def parse_text_command(line, bus):
+    """
+    解析并应用一条文本指令，规则与 middleware 的 process_command 相同
+    Returns:
+        应答原因：成功为 "ok"，否则同 middleware 的 cmd_error_names。
+    """
+    if line.startswith("set "):
+        tokens = line.split()
+        try:
+            if len(tokens) != 3:
+                raise ValueError
+            value = float(tokens[2])
+        except ValueError:
+            print("指令格式错误。")
+            return "format"
+        return bus.set_signal(tokens[1], value)
+    tokens = line.split(None, 4)
+    if len(tokens) < 5:
+        print("指令格式错误。")
+        return "format"
+    if tokens[0] != "send":
+        print("未知指令。")
+        return "unknown"
+    try:
+        frame_id, start, length = int(tokens[1], 0), int(tokens[2]), int(tokens[3])
+    except ValueError:
+        print("指令格式错误。")
+        return "format"
+    bits = tokens[4].strip()
+    if len(bits) != length:
+        print("数据长度与声明长度不匹配。")
+        return "length"
+    if frame_id not in bus.by_id:
+        print("未找到对应控制帧。")
+        return "frame"
+    if start > 63 or length > 64 or any(c not in "01" for c in bits):
+        print("数据超出范围。")
+        return "range"
+    return "ok" if bus.apply(frame_id, start, length, int(bits, 2)) else "range"
+
+
+class TraceLog:
+    """
+    延迟追踪，格式同 middleware 的 CAN_TRACE 文件（见 can_trace.py）
+    模拟总线没有真实的发送与回环，两者记为同一时刻。
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+        self.context = None  # 下一条指令的 (序号, 发送时刻, 读取时刻)
+        self.pending = []  # 等待发送的 [ID, 序号, 发送, 读取, 解析, 更新]
+
+    def expect(self, line, read_us):
+        try:
+            _, seq, client_us = line.split()
+            self.context = (int(seq), int(client_us), read_us)
+        except ValueError:
+            self.context = None
+
+    def updated(self, frame_ids, parse_us):
+        if self.context is None:
+            return
+        update_us = time.monotonic_ns() // 1000
+        for frame_id in frame_ids:
+            self.pending.append([frame_id, *self.context, parse_us, update_us])
+        self.context = None
+
+    def transmitted(self, frame_ids):
+        if not self.pending:
+            return
+        now = time.monotonic_ns() // 1000
+        remaining = []
+        for entry in self.pending:
+            if entry[0] in frame_ids:
+                frame_id, seq, *times = entry
+                self.file.write(f"{seq} {frame_id:x} " + " ".join(map(str, times))
+                                + f" {now} {now}\n")
+            else:
+                remaining.append(entry)
+        self.pending = remaining
+        self.file.flush()
+
+
+def consume_commands(buffer, bus, trace=None, read_us=0):
+    """
+    处理缓冲区中所有完整的指令（文本按换行分帧，二进制按批头长度分帧），
+    已处理的部分从 buffer 中删除
+    Returns:
+        应答，格式同 middleware：每条指令一行 "ok" / "err <原因>"，
+        二进制批量指令为 "ok <条数>" / "err invalid <无效条数>/<条数>"。
+    """
+    acks = []
+    pos = 0
+    while pos < len(buffer):
+        remain = len(buffer) - pos
+        if buffer[pos] == BIN_MAGIC:
+            if remain < BIN_HEADER.size:
+                break
+            _, version, count = BIN_HEADER.unpack_from(buffer, pos)
+            if version != BIN_VERSION or count > BIN_MAX_RECORDS:
+                print("二进制指令头无效，丢弃缓冲区。")
+                del buffer[:]
+                acks.append(b"err header\n")
+                return b"".join(acks)
+            size = BIN_HEADER.size + count * BIN_RECORD.size
+            if remain < size:
+                break
+            parse_us = time.monotonic_ns() // 1000
+            invalid = 0
+            touched = set()
+            for i in range(count):
+                frame_id, start, length, _, value = BIN_RECORD.unpack_from(
+                    buffer, pos + BIN_HEADER.size + i * BIN_RECORD.size)
+                frame = bus.by_id.get(frame_id)
+                if frame is None or not frame.update(value, start, length):
+                    invalid += 1
+                else:
+                    touched.add(frame_id)
+            if trace is not None:
+                trace.updated(touched, parse_us)
+            if invalid:
+                print(f"二进制指令中有 {invalid} 条无效。")
+                acks.append(f"err invalid {invalid}/{count}\n".encode())
+            else:
+                acks.append(f"ok {count}\n".encode())
+            pos += size
+            continue
+        newline = buffer.find(b"\n", pos)
+        if newline < 0:
+            if remain >= CMD_BUFF_SIZE - 1:
+                print("指令过长，丢弃。")
+                del buffer[:]
+                acks.append(b"err overflow\n")
+                return b"".join(acks)
+            break
+        line = buffer[pos:newline].rstrip(b"\r").decode("ascii", "replace")
+        if line.startswith("trace "):
+            # 追踪行只在开启追踪时生效，否则忽略
+            if trace is not None:
+                trace.expect(line, read_us)
+        elif line:
+            parse_us = time.monotonic_ns() // 1000
+            result = parse_text_command(line, bus)
+            if result == "ok" and trace is not None:
+                name = line.split()[1]
+                frame_id = bus.signals[name].frame_id if line.startswith("set ") else int(name, 0)
+                trace.updated([frame_id], parse_us)
+            acks.append(b"ok\n" if result == "ok" else f"err {result}\n".encode())
+        pos = newline + 1
+    del buffer[:pos]
+    return b"".join(acks)
+
+
+class Subscriber:
+    """
+    接收通道的一个订阅者
+    写缓冲区中积压超过 SUB_RING_FRAMES 帧时，按 overflow 丢弃本批或断开连接，
+    与 middleware 每个订阅者独立的环形缓冲区相对应，慢速订阅者不会拖慢总线循环。
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.binary = False
+        self.ids = None  # None 表示全部ID
+        self.overflow = "drop"
+        self.delivered = 0
+        self.dropped = 0
+
+    def request(self, line):
+        """处理订阅者发来的一行请求"""
+        if line == "format binary":
+            self.binary = True
+        elif line == "format text":
+            self.binary = False
+        elif line in ("overflow drop", "overflow disconnect"):
+            self.overflow = line.split()[1]
+        elif line == "filter all":
+            self.ids = None
+        elif line.startswith("filter "):
+            self.ids = np.array([int(x, 0) & 0x1FFFFFFF for x in line.split()[1:]], dtype=np.uint32)
+        else:
+            print(f"未知的接收通道请求: {line}")
+
+    def publish(self, records):
+        """写入一批记录；返回 False 表示应断开连接"""
+        if self.ids is not None:
+            records = records[np.isin(records['id'], self.ids)]
+        if not len(records):
+            return True
+        backlog = self.writer.transport.get_write_buffer_size()
+        if backlog > SUB_RING_FRAMES * RECORD_DTYPE.itemsize:
+            if self.overflow == "disconnect":
+                print("Rx 订阅者缓冲区溢出，断开连接。")
+                return False
+            self.dropped += len(records)
+            return True
+        self.writer.write(records.tobytes() if self.binary else format_text(records))
+        self.delivered += len(records)
+        return True
+
+
+class Simulator:
+    """
+    模拟 middleware：两个 Unix 域套接字服务器与总线发送循环
+    与 middleware 一样最多同时服务 MAX_SUBSCRIBERS 个接收通道订阅者。
+    Args:
+        bus: SimulatedBus 实例。
+        tick_ms: 总线推进的步长（毫秒）。
+        trace_path: 延迟追踪文件，None 表示不追踪。
+    """
+
+    def __init__(self, bus, socket_path=SOCKET_PATH, read_path=SOCKET_READ_PATH, tick_ms=1.0,
+                 trace_path=None):
+        self.bus = bus
+        self.trace = TraceLog(trace_path) if trace_path else None
+        self.socket_path = socket_path
+        self.read_path = read_path
+        self.tick_ms = tick_ms
+        self.subscribers = []
+        self.command_clients = 0
+        self.commands = 0
+
+    async def _handle_command(self, reader, writer):
+        if self.command_clients >= MAX_COMMAND_CLIENTS:
+            print(f"指令通道客户端已满（{MAX_COMMAND_CLIENTS}），拒绝连接。")
+            writer.close()
+            return
+        self.command_clients += 1
+        print("客户端已连接。")
+        buffer = bytearray()
+        acks_dropped = 0
+        try:
+            while True:
+                try:
+                    chunk = await reader.read(CMD_BUFF_SIZE)
+                except (ConnectionError, asyncio.CancelledError):
+                    break  # 断开，或模拟总线停止
+                if not chunk:
+                    break
+                buffer += chunk
+                acks = consume_commands(buffer, self.bus, self.trace, time.monotonic_ns() // 1000)
+                if acks and not writer.is_closing():
+                    if writer.transport.get_write_buffer_size() < ACK_BACKLOG_LIMIT:
+                        writer.write(acks)
+                    else:
+                        acks_dropped += 1
+        finally:
+            # 处理指令时出现意外异常也要释放名额，否则客户端名额会被逐渐占满
+            self.command_clients -= 1
+            print(f"客户端断开连接（应答写入失败 {acks_dropped} 次）。")
+            writer.close()
+
+    async def _handle_read(self, reader, writer):
+        if len(self.subscribers) >= MAX_SUBSCRIBERS:
+            print(f"Rx 数据通道订阅者已满（{MAX_SUBSCRIBERS}），拒绝连接。")
+            writer.close()
+            return
+        print("Rx 数据通道客户端已连接。")
+        subscriber = Subscriber(writer)
+        self.subscribers.append(subscriber)
+        pending = b""
+        while True:
+            try:
+                request = await reader.read(256)
+            except (ConnectionError, asyncio.CancelledError):
+                break  # 断开，或模拟总线停止
+            if not request:
+                break
+            lines = (pending + request).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                subscriber.request(line.decode("ascii", "replace").strip())
+        print(f"Rx 数据通道客户端断开，已发送 {subscriber.delivered} 帧，丢弃 {subscriber.dropped} 帧。")
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        writer.close()
+
+    async def _bus_loop(self):
+        start = time.monotonic()
+        self.bus.start(0.0)
+        ticks = 0
+        while True:
+            ticks += 1
+            # 按绝对时间推进，睡眠误差不会累积
+            delay = start + ticks * self.tick_ms / 1000 - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now_ms = (time.monotonic() - start) * 1000
+            records = self.bus.step(now_ms, time.time_ns() // 1000)
+            if self.trace is not None:
+                self.trace.transmitted(set(records['id'].tolist()))
+            if not len(records):
+                continue
+            for subscriber in list(self.subscribers):
+                if subscriber.writer.is_closing() or not subscriber.publish(records):
+                    self.subscribers.remove(subscriber)
+                    subscriber.writer.close()
+
+    async def run(self, duration=None):
+        for path in (self.socket_path, self.read_path):
+            if os.path.exists(path):
+                os.unlink(path)  # 如果套接字文件已存在，先删除
+        command_server = await asyncio.start_unix_server(self._handle_command, self.socket_path)
+        read_server = await asyncio.start_unix_server(self._handle_read, self.read_path)
+        print(f"模拟总线已启动: {self.socket_path} {self.read_path}")
+        task = asyncio.create_task(self._bus_loop())
+        try:
+            if duration is None:
+                await task
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            task.cancel()
+            command_server.close()
+            read_server.close()
+            for path in (self.socket_path, self.read_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+            print(f"模拟总线已停止，共发送 {self.bus.sent} 帧，丢弃 {self.bus.dropped} 帧")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="不需要硬件的模拟 CAN 总线（middleware 替身）")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="指令套接字路径")
+    parser.add_argument("--read-socket", default=SOCKET_READ_PATH, help="接收套接字路径")
+    parser.add_argument("--rate", type=float, default=0, help="背景报文速率（帧/秒）")
+    parser.add_argument("--ids", type=int, default=32, help="背景报文的ID个数")
+    parser.add_argument("--drop", type=float, default=0, help="控制帧丢帧概率")
+    parser.add_argument("--skip-heartbeat", type=float, default=0, help="心跳跳变概率")
+    parser.add_argument("--bad-xor", type=float, default=0, help="异或错误概率")
+    parser.add_argument("--tick", type=float, default=1.0, help="总线推进步长（毫秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子，用于复现")
+    parser.add_argument("--duration", type=float, default=None, help="运行秒数，默认一直运行")
+    parser.add_argument("--trace", default=None, help="延迟追踪文件（同 middleware 的 CAN_TRACE）")
+    parser.add_argument("--frames", default=DEFAULT_FRAME_CONFIG,
+                        help="控制帧表配置，不存在时使用内置的控制帧表")
+    args = parser.parse_args()
+
+    try:
+        frames = load_frame_config(args.frames)
+    except OSError:
+        print(f"未找到帧配置 {args.frames}，使用内置的控制帧表")
+        frames = None
+    bus = SimulatedBus(args.rate, args.ids, Faults(args.drop, args.skip_heartbeat, args.bad_xor),
+                       args.seed, frames)
+    simulator = Simulator(bus, args.socket, args.read_socket, args.tick, args.trace)
+    try:
+        asyncio.run(simulator.run(args.duration))
+    except KeyboardInterrupt:
+        print("\n[INFO] 用户中断程序，退出")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+内存映射的二进制录制文件
+数据文件为 64 字节文件头加上连续的 can_records.RECORD_DTYPE 记录，录制时通过
+numpy.memmap 直接追加。旁边的 <文件名>.idx.npz 保存两级索引：
+    稀疏时间索引：每 INDEX_STRIDE 条记录一个块，保存块内时间戳的最小/最大值；
+    ID 索引：每个ID的记录序号（CSR 形式），按序号递增排列。
+查询 "某ID在 t1~t2 之间的帧" 时先用时间索引定位记录区间，再在该ID的序号数组中
+二分查找，只读取命中的记录，不需要扫描整个文件。索引缺失或过期时按数据重建。
+"""
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+
+from can_records import FLAG_EXTERN, RECORD_DTYPE, RECORD_SIZE, SOCKET_READ_PATH, BinaryReceiver
+
+MAGIC = b"CANREC01"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")  # magic, version, record_size, count
+HEADER_SIZE = 64
+INDEX_STRIDE = 1024  # 稀疏时间索引的块大小（记录条数）
+GROW_RECORDS = 1 << 16  # 录制文件每次扩容的最少记录条数
+
+
+def is_store(path):
+    """判断文件是否为录制文件"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def index_path_for(path):
+    return f"{path}.idx.npz"
+
+
+def _block_bounds(timestamps, stride=INDEX_STRIDE):
+    """计算每个块的时间戳最小/最大值"""
+    if len(timestamps) == 0:
+        empty = np.empty(0, dtype=np.uint64)
+        return empty, empty
+    starts = np.arange(0, len(timestamps), stride)
+    return np.minimum.reduceat(timestamps, starts), np.maximum.reduceat(timestamps, starts)
+
+
+def _id_index(ids, base=0):
+    """
+    按ID分组记录序号
+    Returns:
+        (keys, starts, positions)，第 k 个ID的序号为 positions[starts[k]:starts[k+1]]。
+    """
+    order = np.argsort(ids, kind='stable')
+    keys, starts = np.unique(ids[order], return_index=True)
+    starts = np.append(starts, len(ids)).astype(np.int64)
+    return keys, starts, order.astype(np.int64) + base
+
+
+class Recorder:
+    """
+    追加写入录制文件
+    Args:
+        path: 录制文件名，已存在时在末尾继续追加。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path) and is_store(path):
+            with open(path, 'rb') as f:
+                _, _, _, self.count = HEADER.unpack(f.read(HEADER.size))
+        else:
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, 0).ljust(HEADER_SIZE, b"\0"))
+            self.count = 0
+        self.capacity = 0
+        self.records = None
+        self._reserve(self.count + GROW_RECORDS)
+        # 已有数据的索引一次性建立，之后随追加增量更新
+        existing = self.records[:self.count]
+        self.block_min, self.block_max = [list(a) for a in _block_bounds(
+            existing['timestamp_us'])]
+        self.id_chunks = {}
+        keys, starts, positions = _id_index(existing['id'])
+        for k, key in enumerate(keys.tolist()):
+            self.id_chunks[key] = [positions[starts[k]:starts[k + 1]]]
+
+    def _reserve(self, capacity):
+        """把文件扩容到至少 capacity 条记录并重新映射"""
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, self.capacity * 2)
+        if self.records is not None:
+            self.records.flush()
+            del self.records
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + capacity * RECORD_SIZE)
+        self.records = np.memmap(self.path, dtype=RECORD_DTYPE, mode='r+',
+                                 offset=HEADER_SIZE, shape=(capacity,))
+        self.capacity = capacity
+
+    def append(self, records):
+        """追加一批 RECORD_DTYPE 记录（如 BinaryReceiver.read() 的结果）"""
+        n = len(records)
+        if n == 0:
+            return
+        start = self.count
+        self._reserve(start + n)
+        self.records[start:start + n] = records
+        self.count += n
+
+        # 更新稀疏时间索引：先补齐最后一个未满的块，再追加新块
+        timestamps = self.records['timestamp_us'][start:self.count]
+        pos = 0
+        if start % INDEX_STRIDE:
+            fill = min(INDEX_STRIDE - start % INDEX_STRIDE, n)
+            head = timestamps[:fill]
+            self.block_min[-1] = min(self.block_min[-1], head.min())
+            self.block_max[-1] = max(self.block_max[-1], head.max())
+            pos = fill
+        block_min, block_max = _block_bounds(timestamps[pos:])
+        self.block_min.extend(block_min)
+        self.block_max.extend(block_max)
+
+        # 更新ID索引
+        keys, starts, positions = _id_index(records['id'], start)
+        for k, key in enumerate(keys.tolist()):
+            self.id_chunks.setdefault(key, []).append(positions[starts[k]:starts[k + 1]])
+
+    def flush(self):
+        """把记录、文件头中的条数和索引写回磁盘，之后读者即可看到新数据"""
+        self.records.flush()
+        with open(self.path, 'r+b') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, self.count))
+        keys = np.array(sorted(self.id_chunks), dtype=np.uint32)
+        chunks = [np.concatenate(self.id_chunks[key]) for key in keys.tolist()]
+        self.id_chunks = {key: [chunk] for key, chunk in zip(keys.tolist(), chunks)}
+        starts = np.cumsum([0] + [len(chunk) for chunk in chunks]).astype(np.int64)
+        positions = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+        tmp_file = index_path_for(self.path) + ".tmp.npz"
+        np.savez(tmp_file, count=np.int64(self.count),
+                 block_min=np.array(self.block_min, dtype=np.uint64),
+                 block_max=np.array(self.block_max, dtype=np.uint64),
+                 id_keys=keys, id_starts=starts, id_positions=positions)
+        os.replace(tmp_file, index_path_for(self.path))
+
+    def close(self):
+        """写回数据并把文件截断到实际长度"""
+        self.flush()
+        del self.records
+        self.records = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + self.count * RECORD_SIZE)
+
+
+class Store:
+    """
+    只读打开录制文件
+    Args:
+        path: 录制文件名。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, record_size, self.count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            raise ValueError(f"{path} 不是可识别的录制文件")
+        if self.count:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r',
+                                     offset=HEADER_SIZE, shape=(self.count,))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with np.load(index_path_for(self.path)) as index:
+                if int(index['count']) == self.count:
+                    self.block_min = index['block_min']
+                    self.block_max = index['block_max']
+                    self.id_keys = index['id_keys']
+                    self.id_starts = index['id_starts']
+                    self.id_positions = index['id_positions']
+                    return
+        except (OSError, KeyError, ValueError):
+            pass
+        # 索引缺失或与数据不一致（如录制进程异常退出），按数据重建
+        self.block_min, self.block_max = _block_bounds(self.records['timestamp_us'])
+        self.id_keys, self.id_starts, self.id_positions = _id_index(self.records['id'])
+
+    def __len__(self):
+        return self.count
+
+    def ids(self):
+        """录制文件中出现过的全部ID"""
+        return self.id_keys.tolist()
+
+    def _record_range(self, start_us, end_us):
+        """用稀疏时间索引求出可能包含 [start_us, end_us] 的记录区间"""
+        lo, hi = 0, self.count
+        if start_us is not None and len(self.block_max):
+            # 块最大值的前缀最大值单调不减，第一个 >= start_us 的块之前都可以跳过
+            lo = int(np.searchsorted(np.maximum.accumulate(self.block_max), start_us)) * INDEX_STRIDE
+        if end_us is not None and len(self.block_min):
+            # 块最小值的后缀最小值单调不减，最后一个 <= end_us 的块之后都可以跳过
+            suffix_min = np.minimum.accumulate(self.block_min[::-1])[::-1]
+            hi = min(int(np.searchsorted(suffix_min, end_us, side='right')) * INDEX_STRIDE,
+                     self.count)
+        return lo, max(lo, hi)
+
+    def positions(self, frame_id):
+        """某ID全部记录的序号（升序）"""
+        k = int(np.searchsorted(self.id_keys, frame_id))
+        if k == len(self.id_keys) or self.id_keys[k] != frame_id:
+            return np.empty(0, dtype=np.int64)
+        return self.id_positions[self.id_starts[k]:self.id_starts[k + 1]]
+
+    def query(self, frame_id=None, start_us=None, end_us=None):
+        """
+        查询记录
+        Args:
+            frame_id: 只返回该ID的帧，None 表示全部ID。
+            start_us / end_us: 时间范围（微秒，闭区间），None 表示不限。
+        Returns:
+            RECORD_DTYPE 结构化数组，按录制顺序排列。
+        """
+        lo, hi = self._record_range(start_us, end_us)
+        if frame_id is None:
+            records = self.records[lo:hi]
+        else:
+            positions = self.positions(frame_id)
+            a, b = np.searchsorted(positions, [lo, hi])
+            records = self.records[positions[a:b]]
+        if start_us is not None or end_us is not None:
+            ts = records['timestamp_us']
+            mask = np.ones(len(records), dtype=bool)
+            if start_us is not None:
+                mask &= ts >= start_us
+            if end_us is not None:
+                mask &= ts <= end_us
+            records = records[mask]
+        return records
+
+    def iter_chunks(self, chunk=1 << 18):
+        """按录制顺序分块遍历全部记录"""
+        for start in range(0, self.count, chunk):
+            yield self.records[start:start + chunk]
+
+    def iter_text(self, fmt, chunk=1 << 18):
+        """按 TEXT_FORMATS 中的格式逐行导出为文本"""
+        formatter = TEXT_FORMATS[fmt]
+        for records in self.iter_chunks(chunk):
+            yield from formatter(records)
+
+
+def format_right(records):
+    """checkright.py 使用的格式：time: <毫秒> id: <ID>, data: XX XX ..."""
+    for ts, frame_id, dlc, data in zip((records['timestamp_us'] // 1000).tolist(),
+                                       records['id'].tolist(), records['dlc'].tolist(),
+                                       records['data'].tolist()):
+        yield f"time: {ts} id: {frame_id:X}, data: " + "".join(
+            f"{b:02X} " for b in data[:dlc]) + "\n"
+
+
+def format_record(records):
+    """convert.py 使用的格式：[<秒>] <通道> Rx <ID> <Ext|Std> <DLC> <每字节8位二进制> ..."""
+    for ts, channel, frame_id, flags, dlc, data in zip(
+            (records['timestamp_us'] // 1000000).tolist(), records['channel'].tolist(),
+            records['id'].tolist(), records['flags'].tolist(), records['dlc'].tolist(),
+            records['data'].tolist()):
+        frame_type = "Ext" if flags & FLAG_EXTERN else "Std"
+        yield f"[{ts}] {channel} Rx {frame_id:08X} {frame_type} {dlc} " + " ".join(
+            format(b, "08b") for b in data[:dlc]) + "\n"
+
+
+def format_senddebug(records):
+    """send2sac.py 使用的格式：<毫秒> <通道> <ID>x Rx d <DLC> XX XX ..."""
+    for ts, channel, frame_id, dlc, data in zip(
+            (records['timestamp_us'] // 1000).tolist(), records['channel'].tolist(),
+            records['id'].tolist(), records['dlc'].tolist(), records['data'].tolist()):
+        yield f"{ts} {channel} {frame_id:X}x Rx d {dlc} " + " ".join(
+            f"{b:02X}" for b in data[:dlc]) + "\n"
+
+
+TEXT_FORMATS = {
+    "right": format_right,
+    "record": format_record,
+    "senddebug": format_senddebug,
+}
+
+
+def record(path, socket_path=SOCKET_READ_PATH, flush_interval=1.0):
+    """
+    订阅 middleware 的二进制接收流并追加到录制文件，按 flush_interval 秒写回索引
+    """
+    recorder = Recorder(path)
+    receiver = BinaryReceiver(socket_path)
+    print(f"[INFO] 开始录制到 {path}")
+    next_flush = time.monotonic() + flush_interval
+    try:
+        for records in receiver:
+            recorder.append(records)
+            if time.monotonic() >= next_flush:
+                recorder.flush()
+                next_flush += flush_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.close()
+        recorder.close()
+        print(f"[INFO] 录制结束，共 {recorder.count} 帧")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CAN 帧录制文件工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("record", help="从接收通道录制")
+    p.add_argument("path")
+    p.add_argument("--socket", default=SOCKET_READ_PATH)
+    p = sub.add_parser("export", help="导出为文本格式")
+    p.add_argument("path")
+    p.add_argument("-f", "--format", choices=sorted(TEXT_FORMATS), default="right")
+    p.add_argument("-o", "--output", required=True)
+    p = sub.add_parser("query", help="按ID和时间范围查询")
+    p.add_argument("path")
+    p.add_argument("--id", type=lambda s: int(s, 16), default=None, help="十六进制ID")
+    p.add_argument("--start", type=int, default=None, help="起始时间（微秒）")
+    p.add_argument("--end", type=int, default=None, help="结束时间（微秒）")
+    p.add_argument("-f", "--format", choices=sorted(TEXT_FORMATS), default="right")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.path, args.socket)
+    elif args.command == "export":
+        store = Store(args.path)
+        with open(args.output, 'w') as f:
+            f.writelines(store.iter_text(args.format))
+        print(f"导出完成，共 {len(store)} 帧，结果已保存到 {args.output} 文件中。")
+    else:
+        records = Store(args.path).query(args.id, args.start, args.end)
+        for line in TEXT_FORMATS[args.format](records):
+            print(line, end="")
+
+
+if __name__ == "__main__":
+    main()
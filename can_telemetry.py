@@ -0,0 +1,194 @@
+"""
+接收通道的实时遥测
+TelemetryReceiver 在后台线程订阅二进制接收通道，用 lookup.yaml 的解码器按ID批量解码，
+把结果合并为“每个信号的最新值”快照；界面只需按自己的刷新率调用 take() 取走变化的信号，
+解码频率与界面刷新率都与总线帧率无关。
+"""
+import socket
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from can_records import SOCKET_READ_PATH, BinaryReceiver, payloads
+
+DECODE_INTERVAL = 0.01  # 两次解码之间的最短间隔，期间到达的帧留在套接字缓冲区里合并为一批
+HISTORY_POINTS = 2000  # 每条曲线保留的最多采样点
+
+
+class TelemetrySnapshot:
+    """
+    每个信号的最新值，以及选中信号的历史曲线
+    信号以 (帧ID, 信号名) 为键；只解码数据长度为8字节的帧，载荷不变的帧不产生更新。
+    feed() 在接收线程调用，take() / series() 在界面线程调用，内部加锁。
+    Args:
+        decoders: convert.load_decoders 得到的 {ID: FrameDecoder}。
+        history_points: 每条曲线保留的最多采样点。
+    """
+
+    def __init__(self, decoders, history_points=HISTORY_POINTS):
+        self.decoders = decoders
+        self.history_points = history_points
+        self.lock = threading.Lock()
+        self.changed = {}  # 上次 take() 之后变化的信号 -> (值, timestamp_us)
+        self.history = {}  # 选中的信号 -> deque[(timestamp_us, 值)]
+        self.frames = 0
+        self.unknown = 0  # lookup.yaml 中没有的帧
+        self.last_timestamp_us = 0
+        self.fields = {}  # 帧ID -> 逐字段的 Python 标量解码参数
+        self.payloads = {}  # 帧ID -> 上次解码的载荷
+
+    def track(self, keys):
+        """设置需要记录曲线的信号，已有的历史保留"""
+        with self.lock:
+            self.history = {key: self.history.get(key) or deque(maxlen=self.history_points)
+                            for key in keys}
+
+    def _fields(self, frame_id):
+        # 单帧解码用纯 Python 整数运算，比对长度为1的数组调用 decode_columns 快一个数量级
+        fields = self.fields.get(frame_id)
+        if fields is None and frame_id in self.decoders:
+            decoder = self.decoders[frame_id]
+            if decoder.vectorized:
+                fields = list(zip(decoder.names, decoder.types, decoder.dics,
+                                  decoder.shifts.tolist(), decoder.masks.tolist(),
+                                  decoder.factors, decoder.offsets))
+            self.fields[frame_id] = fields
+        return fields
+
+    @staticmethod
+    def _decode_one(fields, payload):
+        """与 FrameDecoder.decode_columns 相同的规则解码一帧"""
+        values = {}
+        for name, field_type, dic, shift, mask, factor, offset in fields:
+            raw = (payload >> shift) & mask
+            if field_type == 'enum':
+                values[name] = dic.get(raw, "Unknown") if hasattr(dic, 'get') else 0
+            elif field_type == 'numeric':
+                values[name] = raw * factor + offset
+            else:
+                values[name] = raw
+        return values
+
+    def feed(self, records):
+        """
+        解码一批 can_records.RECORD_DTYPE 记录并合并到快照
+        每个ID只解码本批最后一帧，且载荷与上次相同时跳过；选中曲线的ID解码全部帧。
+        """
+        records = records[records["dlc"] == 8]
+        if len(records) == 0:
+            return
+        ids = records["id"]
+        # 倒序取首次出现的位置，即每个ID最后一帧的位置
+        frame_ids, reverse_index, counts = np.unique(ids[::-1], return_index=True,
+                                                     return_counts=True)
+        last = len(ids) - 1 - reverse_index
+        updates = {}
+        unknown = 0
+        for frame_id, payload, timestamp, count in zip(
+                frame_ids.tolist(), payloads(records[last]).tolist(),
+                records["timestamp_us"][last].tolist(), counts.tolist()):
+            fields = self._fields(frame_id)
+            if fields is None:
+                unknown += count
+                continue
+            if self.payloads.get(frame_id) == payload:
+                continue
+            self.payloads[frame_id] = payload
+            for name, value in self._decode_one(fields, payload).items():
+                updates[(frame_id, name)] = (value, timestamp)
+
+        samples = []
+        tracked = self.history.keys()
+        for frame_id in {frame_id for frame_id, _ in tracked}:
+            indices = np.flatnonzero(ids == frame_id)
+            if len(indices) == 0 or self._fields(frame_id) is None:
+                continue
+            columns = self.decoders[frame_id].decode_columns(payloads(records[indices]))
+            timestamps = records["timestamp_us"][indices].tolist()
+            for name, column in columns.items():
+                if (frame_id, name) in tracked and column.dtype != object:
+                    samples.append(((frame_id, name), zip(timestamps, column.tolist())))
+
+        with self.lock:
+            self.changed.update(updates)
+            for key, points in samples:
+                history = self.history.get(key)
+                if history is not None:
+                    history.extend(points)
+            self.frames += len(records)
+            self.unknown += unknown
+            self.last_timestamp_us = max(self.last_timestamp_us, int(records["timestamp_us"].max()))
+
+    def take(self):
+        """
+        取走上次调用之后变化的信号
+        Returns:
+            ({(帧ID, 信号名): (值, timestamp_us)}, 累计帧数)
+        """
+        with self.lock:
+            changed, self.changed = self.changed, {}
+            return changed, self.frames
+
+    def series(self, key, window_us):
+        """
+        选中信号最近 window_us 内的曲线
+        Returns:
+            [(timestamp_us, 值), ...]，时间相对于最新一帧（<= 0）。
+        """
+        with self.lock:
+            history = self.history.get(key)
+            points = list(history) if history else []
+            now = self.last_timestamp_us
+        return [(t - now, v) for t, v in points if t >= now - window_us]
+
+
+class TelemetryReceiver:
+    """
+    在后台线程订阅接收通道并把解码结果送入 TelemetrySnapshot
+    每次解码后至少间隔 interval 秒再读下一批，这段时间到达的帧在套接字缓冲区里合并，
+    帧率再高解码次数也不超过 1/interval 次每秒，界面线程不会被 GIL 饿死。
+    Args:
+        snapshot: TelemetrySnapshot 实例。
+        path: 接收套接字路径。
+        ids: 只订阅这些ID，None 表示全部。
+        interval: 两次解码之间的最短间隔（秒）。
+    Raises:
+        OSError: 无法连接接收套接字。
+    """
+
+    def __init__(self, snapshot, path=SOCKET_READ_PATH, ids=None, interval=DECODE_INTERVAL):
+        self.snapshot = snapshot
+        self.interval = interval
+        self.receiver = BinaryReceiver(path, capacity=16384, ids=ids)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while self.running:
+                started = time.monotonic()
+                records = self.receiver.read()
+                if records is None:
+                    break
+                self.snapshot.feed(records)
+                remaining = self.interval - (time.monotonic() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
+        except OSError as e:
+            if self.running:
+                print(f"[ERROR] 遥测接收异常: {e}")
+        finally:
+            self.running = False
+
+    def close(self):
+        """停止接收线程并断开连接"""
+        self.running = False
+        try:
+            self.receiver.sock.shutdown(socket.SHUT_RDWR)  # 唤醒阻塞中的 recv
+        except OSError:
+            pass
+        self.thread.join(1.0)
+        self.receiver.close()
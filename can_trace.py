@@ -0,0 +1,187 @@
+"""
+指令延迟追踪
+middleware 以环境变量 CAN_TRACE=<文件> 启动后，客户端在指令前发送
+"trace <序号> <发送时刻us>" 即可追踪这条指令，middleware 在回环接收到对应帧后
+向文件写出一行：序号 ID 发送 读取 解析 更新 发送到总线 回环接收，
+时刻均为 CLOCK_MONOTONIC 微秒（与 Python 的 time.monotonic_ns 同一时钟）。
+本模块负责生成追踪行、发送探测指令，并按阶段与ID汇总延迟分布。
+"""
+import argparse
+import socket
+import time
+
+import numpy as np
+
+SOCKET_PATH = "/tmp/can_socket"
+
+# 追踪文件中各时刻的列名
+COLUMNS = ["client", "read", "parse", "update", "transmit", "receive"]
+# 阶段：(名称, 起始列, 结束列, 说明)
+STAGES = [
+    ("socket", "client", "read", "客户端发送到 middleware 读取"),
+    ("parse", "read", "parse", "读取到解析完成"),
+    ("update", "parse", "update", "等待 frame_mutex 并更新帧"),
+    ("transmit", "update", "transmit", "等待下一次发送周期直到 VCI_Transmit"),
+    ("loopback", "transmit", "receive", "发送到回环接收"),
+    ("total", "client", "receive", "端到端"),
+]
+# 直方图的区间上界（毫秒）
+HISTOGRAM_BINS_MS = [0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, float("inf")]
+# probe 等待每条指令应答的时间（秒）
+ACK_TIMEOUT = 1.0
+
+
+def now_us():
+    """与 middleware 相同时钟的当前时刻（微秒）"""
+    return time.monotonic_ns() // 1000
+
+
+class Tracer:
+    """为指令生成递增序号的追踪行"""
+
+    def __init__(self):
+        self.seq = 0
+
+    def line(self):
+        """返回应紧接在被追踪指令之前发送的追踪行"""
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        return f"trace {self.seq} {now_us()}\n".encode("ascii")
+
+
+def load_traces(path):
+    """
+    读取追踪文件
+    Returns:
+        (ids, times)：ids 为 uint32 数组，times 为 {列名: int64 数组}。
+    """
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 2 + len(COLUMNS):
+                continue
+            try:
+                rows.append([int(parts[1], 16)] + [int(x) for x in parts[2:]])
+            except ValueError:
+                continue
+    table = np.array(rows, dtype=np.int64).reshape(-1, 1 + len(COLUMNS))
+    ids = table[:, 0].astype(np.uint32)
+    return ids, {name: table[:, i + 1] for i, name in enumerate(COLUMNS)}
+
+
+def stage_latencies(times):
+    """各阶段的延迟（毫秒）"""
+    return {name: (times[end] - times[start]) / 1000 for name, start, end, _ in STAGES}
+
+
+def histogram(values_ms):
+    """按 HISTOGRAM_BINS_MS 统计个数"""
+    counts = []
+    lower = -float("inf")
+    for upper in HISTOGRAM_BINS_MS:
+        counts.append(int(((values_ms > lower) & (values_ms <= upper)).sum()))
+        lower = upper
+    return counts
+
+
+def print_stage_table(latencies, title):
+    print(title)
+    print(f"  {'Stage':<10} {'p50':>8} {'p90':>8} {'p99':>8} {'Max':>8}   "
+          + " ".join(f"{'<=' + format(b, 'g'):>6}" if b != float('inf') else f"{'>':>6}"
+                     for b in HISTOGRAM_BINS_MS))
+    for name, values in latencies.items():
+        if len(values) == 0:
+            continue
+        p50, p90, p99, top = np.percentile(values, [50, 90, 99, 100])
+        print(f"  {name:<10} {p50:>8.2f} {p90:>8.2f} {p99:>8.2f} {top:>8.2f}   "
+              + " ".join(f"{c:>6}" for c in histogram(values)))
+
+
+def report(path, by_id=True):
+    """输出各阶段（以及每个ID）的延迟分布，单位毫秒"""
+    ids, times = load_traces(path)
+    if len(ids) == 0:
+        print("追踪文件中没有记录。")
+        return
+    print(f"共 {len(ids)} 条追踪记录（单位 ms，直方图区间上界为 ms）")
+    for name, _, _, description in STAGES:
+        print(f"  {name:<10} {description}")
+    latencies = stage_latencies(times)
+    print_stage_table(latencies, "全部ID")
+    if by_id:
+        for frame_id in np.unique(ids).tolist():
+            mask = ids == frame_id
+            print_stage_table({name: values[mask] for name, values in latencies.items()},
+                              f"ID {frame_id:X}（{int(mask.sum())} 条）")
+
+
+def probe(path, frame_id, start_bit, length, count, interval, timeout=ACK_TIMEOUT):
+    """
+    以固定间隔发送带追踪的指令，值在 0 和全1之间交替，用于在没有面板的情况下采样延迟
+    每条指令发送后读取 middleware 的应答（追踪行本身没有应答），统计被接受、
+    被拒绝和超时未应答的条数，并输出拒绝原因。
+    Returns:
+        (acked, rejected, missing)
+    """
+    tracer = Tracer()
+    sent = acked = rejected = missing = 0
+    errors = {}
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.settimeout(timeout)
+    replies = sock.makefile("rb")
+    try:
+        for i in range(count):
+            bits = ("1" if i % 2 else "0") * length
+            sock.sendall(tracer.line())
+            sock.sendall(f"send {frame_id} {start_bit} {length} {bits}\n".encode())
+            sent += 1
+            try:
+                reply = replies.readline()
+            except socket.timeout:
+                reply = None
+            if not reply:
+                # 超时后应答可能迟到，之后的应答无法再与指令对应
+                missing = 1
+                print(f"[ERROR] 第 {i + 1} 条指令没有应答（超时 {timeout} 秒或连接已关闭），停止探测")
+                break
+            if reply.startswith(b"ok"):
+                acked += 1
+            else:
+                rejected += 1
+                reason = reply.decode("ascii", "replace").strip()
+                errors[reason] = errors.get(reason, 0) + 1
+            time.sleep(interval)
+    finally:
+        replies.close()
+        sock.close()
+    print(f"已发送 {sent} 条带追踪的指令：接受 {acked}，拒绝 {rejected}"
+          + (f"，未应答 {missing}" if missing else ""))
+    for reason, n in errors.items():
+        print(f"  {reason}: {n} 条")
+    return acked, rejected, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="指令延迟追踪")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("report", help="汇总追踪文件")
+    p.add_argument("path")
+    p.add_argument("--no-id", action="store_true", help="不按ID分别输出")
+    p = sub.add_parser("probe", help="发送带追踪的探测指令")
+    p.add_argument("--socket", default=SOCKET_PATH)
+    p.add_argument("--id", type=lambda s: int(s, 0), default=0x1801B0A0)
+    p.add_argument("--start", type=int, default=32)
+    p.add_argument("--length", type=int, default=8)
+    p.add_argument("-n", "--count", type=int, default=100)
+    p.add_argument("--interval", type=float, default=0.05, help="两条指令的间隔（秒）")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        report(args.path, by_id=not args.no_id)
+    else:
+        probe(args.socket, args.id, args.start, args.length, args.count, args.interval)
+
+
+if __name__ == "__main__":
+    main()
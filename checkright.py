@@ -1,4 +1,15 @@
+import argparse
 import re
+import select
+import socket
+import time
+
+import numpy as np
+
+from can_archive import is_archive, open_records
+from can_records import RECORD_SIZE, frombuffer, subscription_request
+from can_store import is_store
+from frame_config import load_frame_config
 
 # 定义帧的周期（毫秒）
 TIME_INTERVALS = {
@@ -8,6 +19,36 @@ TIME_INTERVALS = {
     "1807B0A0": 100
 }
 
+# 各ID心跳位所在的字节
+HEARTBEAT_BYTES = {
+    "1801B0A0": 1,
+    "1803B0A0": 2,
+    "1805B0A0": 7,
+    "1807B0A0": 7
+}
+
+# 最后一个字节为前面所有字节异或值的ID
+XOR_IDS = ("1801B0A0", "1803B0A0")
+
+# 周期允许的偏差（毫秒）
+PERIOD_TOLERANCE = 1
+
+LINE_PATTERN = re.compile(r"^time: (\d+) id: ([0-9A-F]+), data: ((?:[0-9A-F]+ )+)", re.M)
+
+
+def use_frame_config(path):
+    """用控制帧表配置（control_frames.yaml）替换上面的周期、心跳与异或定义"""
+    global XOR_IDS
+    specs = load_frame_config(path)
+    TIME_INTERVALS.clear()
+    HEARTBEAT_BYTES.clear()
+    for spec in specs:
+        key = f"{spec.id:X}"
+        TIME_INTERVALS[key] = spec.interval_ms
+        if spec.heartbeat is not None:
+            HEARTBEAT_BYTES[key] = spec.heartbeat
+    XOR_IDS = tuple(f"{spec.id:X}" for spec in specs if spec.checksum == "xor")
+
 
 def calculate_xor(data_bytes):
     """
@@ -32,83 +73,495 @@ def parse_line(line):
     return None, None, None
 
 
-def check_frames(filename):
+class FrameLog:
     """
-    检查帧的发送周期、心跳位和异或解码。并输出每帧的时间间隔与心跳值。
+    单个ID的帧数组
+    Attributes:
+        index: 每帧在日志中的序号（只统计能解析的行），用于恢复全局顺序。
+        line: 每帧所在的行号（从1开始）。
+        timestamps: 每帧时间戳（毫秒），int64。
+        data: 每帧数据，int64 二维数组，不足最长帧的部分补0。
+        lengths: 每帧实际的字节数。
     """
-    last_timestamps = {}  # 用于记录每个ID的上一次时间戳
-    last_heartbeats = {}  # 用于记录每个ID的上一次心跳值
-    errors = []  # 用于记录所有发现的错误
 
-    print(f"{'ID':<12} {'Time Diff':<12} {'Heartbeat':<12} {'Expected HB':<12} {'Status':<12}")
+    def __init__(self, index, line, timestamps, data, lengths):
+        self.index = index
+        self.line = line
+        self.timestamps = timestamps
+        self.data = data
+        self.lengths = lengths
 
+    def __len__(self):
+        return len(self.timestamps)
+
+
+def _data_matrix(fields):
+    """把数据字段字符串列表转为补0的二维数组和长度数组"""
+    count = len(fields)
+    # 常见情况：每个字节都是两位十六进制，可以整批用 bytes.fromhex 转换
+    if fields and all(len(field) % 3 == 0 for field in fields):
+        try:
+            raw = [bytes.fromhex(field) for field in fields]
+        except ValueError:
+            raw = None
+        if raw is not None and all(len(r) * 3 == len(f) for r, f in zip(raw, fields)):
+            lengths = np.fromiter((len(r) for r in raw), dtype=np.int64, count=count)
+            width = int(lengths.max())
+            if (lengths == width).all():
+                data = np.frombuffer(b"".join(raw), dtype=np.uint8).reshape(count, width)
+                return data.astype(np.int64), lengths
+    # 通用情况：逐个字节转换（字节可能不是两位）
+    rows = [[int(byte, 16) for byte in field.split()] for field in fields]
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=count)
+    width = int(lengths.max()) if count else 0
+    data = np.zeros((count, width), dtype=np.int64)
+    for i, row in enumerate(rows):
+        data[i, :len(row)] = row
+    return data, lengths
+
+
+def load_store(filename):
+    """
+    直接从 can_store 录制文件或 can_archive 归档文件按ID取出数组，不经过文本解析
+    行号为该帧在导出的 right.txt 中所在的行。
+    Returns:
+        {frame_id: FrameLog}，按ID首次出现的顺序排列。
+    """
+    store = open_records(filename)
+    logs = {}
+    for frame_id in store.ids():
+        positions = store.positions(frame_id)
+        records = store.records[positions]
+        lengths = records['dlc'].astype(np.int64)
+        width = int(lengths.max())
+        data = records['data'][:, :width].astype(np.int64)
+        # 与文本日志一致，超出实际长度的字节补0
+        data[np.arange(width) >= lengths[:, None]] = 0
+        logs[f"{frame_id:X}"] = FrameLog(
+            index=positions,
+            line=positions + 1,
+            timestamps=(records['timestamp_us'] // 1000).astype(np.int64),
+            data=data,
+            lengths=lengths,
+        )
+    return dict(sorted(logs.items(), key=lambda item: item[1].index[0]))
+
+
+def load_log(filename):
+    """
+    读取日志并按ID拆分为数组
+    Args:
+        filename: 日志文件名，格式同 parse_line；也可以是 can_store 录制文件或 can_archive 归档文件。
+    Returns:
+        {frame_id: FrameLog}，按ID首次出现的顺序排列。
+    """
+    if is_store(filename) or is_archive(filename):
+        return load_store(filename)
     with open(filename, "r") as file:
-        for line in file:
-            timestamp, frame_id, data = parse_line(line)
-            if not frame_id:
-                continue
-
-            # 初始化相关变量
-            time_diff = "-"
-            heartbeat = "-"
-            expected_heartbeat = "-"
-            status = "OK"
-
-            # 检查时间间隔
-            if frame_id in last_timestamps:
-                time_diff = timestamp - last_timestamps[frame_id]
-                expected_interval = TIME_INTERVALS.get(frame_id, None)
-                if expected_interval and abs(time_diff - expected_interval) > 1:
-                    status = "ERR"
-                    errors.append(f"周期错误: {frame_id} 在 {timestamp}ms，实际间隔 {time_diff}ms，期待间隔 {expected_interval}ms")
-
-            last_timestamps[frame_id] = timestamp  # 更新时间戳
-
-            # 检查心跳位
-            if frame_id in ["1801B0A0", "1803B0A0", "1805B0A0", "1807B0A0"]:
-                if frame_id == "1801B0A0":
-                    heartbeat = int(data[1], 16)
-                elif frame_id == "1803B0A0":
-                    heartbeat = int(data[2], 16)
-                elif frame_id == "1805B0A0":
-                    heartbeat = int(data[7], 16)
-                elif frame_id == "1807B0A0":
-                    heartbeat = int(data[7], 16)
-
-                # 计算心跳递增关系
-                expected_heartbeat = "-"
-                if frame_id in last_heartbeats:
-                    expected_heartbeat = (last_heartbeats[frame_id] + 1) % 256  # 心跳溢出处理
-                    if heartbeat != expected_heartbeat:
-                        status = "ERR"
-                        errors.append(
-                            f"心跳错误: {frame_id} 在 {timestamp}ms, 当前值 {heartbeat}, 期待值 {expected_heartbeat}")
-
-                last_heartbeats[frame_id] = heartbeat  # 更新心跳值
-
-            # 检查异或值
-            if frame_id in ["1801B0A0", "1803B0A0"]:
-                calculated_xor = calculate_xor(data)  # 计算异或值
-                xor_value = int(data[-1], 16)
-                if calculated_xor != xor_value:
-                    status = "ERR"
-                    errors.append(f"异或错误: {frame_id} 在 {timestamp}ms，计算值 {calculated_xor:02X}，数据值 {xor_value:02X}")
-
-            # 打印当前帧信息
-            print(f"{frame_id:<12} {time_diff:<12} {heartbeat:<12} {expected_heartbeat:<12} {status:<12}")
-
-    return errors
+        text = file.read()
+    # 每个匹配位置之前的换行数即行号
+    newlines = np.array([m.start() for m in re.finditer("\n", text)], dtype=np.int64)
+    groups = {}
+    for index, match in enumerate(LINE_PATTERN.finditer(text)):
+        group = groups.get(match.group(2))
+        if group is None:
+            group = groups[match.group(2)] = ([], [], [], [])
+        group[0].append(index)
+        group[1].append(match.start())
+        group[2].append(match.group(1))
+        group[3].append(match.group(3))
+
+    logs = {}
+    for frame_id, (indices, offsets, timestamps, fields) in groups.items():
+        data, lengths = _data_matrix(fields)
+        logs[frame_id] = FrameLog(
+            index=np.array(indices, dtype=np.int64),
+            line=np.searchsorted(newlines, np.array(offsets, dtype=np.int64)) + 1,
+            timestamps=np.array(timestamps, dtype=np.int64),
+            data=data,
+            lengths=lengths,
+        )
+    return logs
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return None, None, None
+    p50, p99 = np.percentile(values, [50, 99])
+    return float(p50), float(p99), float(values.max())
+
+
+def validate(frame_id, log):
+    """
+    对单个ID的帧做向量化检查
+    Args:
+        frame_id: 帧ID字符串（大写十六进制）。
+        log: 该ID的 FrameLog。
+    Returns:
+        检查结果字典，包含周期、心跳、异或的错误位置（log 内的下标）与抖动统计。
+    """
+    report = {"id": frame_id, "count": len(log)}
+
+    # 周期检查：相邻两帧的时间差与期待周期的偏差
+    diffs = np.diff(log.timestamps)
+    expected_interval = TIME_INTERVALS.get(frame_id)
+    report["interval"] = expected_interval
+    report["diffs"] = diffs
+    nominal = expected_interval if expected_interval else (
+        float(np.median(diffs)) if len(diffs) else 0)
+    jitter = np.abs(diffs - nominal)
+    report["jitter_p50"], report["jitter_p99"], report["jitter_max"] = _percentiles(jitter)
+    if expected_interval:
+        report["period_errors"] = np.flatnonzero(
+            np.abs(diffs - expected_interval) > PERIOD_TOLERANCE) + 1
+    else:
+        report["period_errors"] = np.empty(0, dtype=np.int64)
+
+    # 心跳检查：每帧心跳值应为上一帧加一（256 溢出回0）
+    hb_byte = HEARTBEAT_BYTES.get(frame_id)
+    if hb_byte is not None:
+        heartbeats = np.where(log.lengths > hb_byte,
+                              log.data[:, hb_byte] if log.data.shape[1] > hb_byte else -1, -1)
+        expected = (heartbeats[:-1] + 1) % 256
+        report["heartbeats"] = heartbeats
+        report["heartbeat_errors"] = np.flatnonzero(heartbeats[1:] != expected) + 1
+    else:
+        report["heartbeats"] = None
+        report["heartbeat_errors"] = np.empty(0, dtype=np.int64)
+
+    # 异或检查：最后一个字节等于前面字节的异或，即全部字节异或为0
+    if frame_id in XOR_IDS:
+        total = np.bitwise_xor.reduce(log.data, axis=1) if log.data.shape[1] else \
+            np.zeros(len(log), dtype=np.int64)
+        report["xor_errors"] = np.flatnonzero(total != 0)
+    else:
+        report["xor_errors"] = np.empty(0, dtype=np.int64)
+    return report
+
+
+def error_messages(frame_id, log, report):
+    """
+    生成与逐帧检查相同文本的错误信息
+    Returns:
+        [(全局序号, 检查顺序, 文本), ...]，排序后即为日志中的出现顺序。
+    """
+    messages = []
+    ts = log.timestamps
+    for i in report["period_errors"].tolist():
+        messages.append((int(log.index[i]), 0,
+                         f"周期错误: {frame_id} 在 {ts[i]}ms，实际间隔 {ts[i] - ts[i - 1]}ms，"
+                         f"期待间隔 {report['interval']}ms"))
+    heartbeats = report["heartbeats"]
+    for i in report["heartbeat_errors"].tolist():
+        messages.append((int(log.index[i]), 1,
+                         f"心跳错误: {frame_id} 在 {ts[i]}ms, 当前值 {heartbeats[i]}, "
+                         f"期待值 {(heartbeats[i - 1] + 1) % 256}"))
+    for i in report["xor_errors"].tolist():
+        row = log.data[i, :log.lengths[i]]
+        calculated = int(np.bitwise_xor.reduce(row[:-1])) if len(row) > 1 else 0
+        messages.append((int(log.index[i]), 2,
+                         f"异或错误: {frame_id} 在 {ts[i]}ms，计算值 {calculated:02X}，"
+                         f"数据值 {int(row[-1]):02X}"))
+    return messages
+
+
+def print_frames(logs, reports):
+    """逐帧打印时间间隔与心跳值（verbose 模式）"""
+    print(f"{'ID':<12} {'Time Diff':<12} {'Heartbeat':<12} {'Expected HB':<12} {'Status':<12}")
+    rows = []
+    for frame_id, log in logs.items():
+        report = reports[frame_id]
+        bad = set(report["period_errors"].tolist()) | set(
+            report["heartbeat_errors"].tolist()) | set(report["xor_errors"].tolist())
+        diffs = report["diffs"]
+        heartbeats = report["heartbeats"]
+        for i in range(len(log)):
+            time_diff = int(diffs[i - 1]) if i else "-"
+            heartbeat = int(heartbeats[i]) if heartbeats is not None else "-"
+            expected_heartbeat = (int(heartbeats[i - 1]) + 1) % 256 \
+                if heartbeats is not None and i else "-"
+            status = "ERR" if i in bad else "OK"
+            rows.append((int(log.index[i]), frame_id, time_diff, heartbeat,
+                         expected_heartbeat, status))
+    rows.sort(key=lambda row: row[0])
+    for _, frame_id, time_diff, heartbeat, expected_heartbeat, status in rows:
+        print(f"{frame_id:<12} {time_diff:<12} {heartbeat:<12} {expected_heartbeat:<12} {status:<12}")
+
+
+def print_summary(logs, reports, max_positions=10):
+    """按ID打印汇总：帧数、抖动 p50/p99/max、各类错误数及前N个错误所在行"""
+    print(f"{'ID':<12} {'Frames':>8} {'Period':>7} {'p50':>7} {'p99':>7} {'Max':>7} "
+          f"{'PeriodErr':>10} {'HBErr':>7} {'XorErr':>7}")
+    for frame_id, report in reports.items():
+        interval = report["interval"] if report["interval"] else "-"
+        jitter = [f"{v:.1f}" if v is not None else "-" for v in (
+            report["jitter_p50"], report["jitter_p99"], report["jitter_max"])]
+        print(f"{frame_id:<12} {report['count']:>8} {interval:>7} {jitter[0]:>7} {jitter[1]:>7} "
+              f"{jitter[2]:>7} {len(report['period_errors']):>10} "
+              f"{len(report['heartbeat_errors']):>7} {len(report['xor_errors']):>7}")
+    for frame_id, report in reports.items():
+        line = logs[frame_id].line
+        for kind, key in (("周期", "period_errors"), ("心跳", "heartbeat_errors"),
+                          ("异或", "xor_errors")):
+            positions = report[key]
+            if len(positions):
+                shown = ", ".join(str(int(line[i])) for i in positions[:max_positions])
+                more = " ..." if len(positions) > max_positions else ""
+                print(f"  {frame_id} {kind}错误所在行: {shown}{more}")
+
+
+def check_frames(filename, verbose=False, max_positions=10, summary=False):
+    """
+    检查帧的发送周期、心跳位和异或解码。
+    日志先按ID拆分为数组，再对每个ID做向量化检查。
+    Args:
+        filename: 日志文件名。
+        verbose: 为 True 时逐帧输出时间间隔与心跳值。
+        max_positions: 汇总中每类错误最多列出的行号个数。
+        summary: 为 True 时输出按ID的汇总表。
+    Returns:
+        按日志顺序排列的错误信息列表。
+    """
+    logs = load_log(filename)
+    reports = {frame_id: validate(frame_id, log) for frame_id, log in logs.items()}
+
+    if verbose:
+        print_frames(logs, reports)
+    if summary:
+        print_summary(logs, reports, max_positions)
+
+    messages = []
+    for frame_id, log in logs.items():
+        messages.extend(error_messages(frame_id, log, reports[frame_id]))
+    messages.sort(key=lambda message: message[:2])
+    return [text for _, _, text in messages]
+
+
+SOCKET_READ_PATH = "/tmp/can_read_socket"
+
+
+class JitterHistogram:
+    """
+    固定内存的抖动直方图（毫秒）
+    以 bin_ms 为宽度统计 0 ~ bins*bin_ms 的偏差，超出范围的计入最后一格。
+    """
+
+    def __init__(self, bin_ms=0.5, bins=200):
+        self.bin_ms = bin_ms
+        self.counts = np.zeros(bins + 1, dtype=np.int64)
+        self.max = 0.0
+
+    def add(self, value):
+        value = abs(value)
+        self.counts[min(int(value / self.bin_ms), len(self.counts) - 1)] += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """按直方图估算分位数，返回所在格的上界"""
+        total = int(self.counts.sum())
+        if total == 0:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), total * q / 100.0))
+        return min((index + 1) * self.bin_ms, self.max)
+
+
+class IdState:
+    """单个ID（分通道时为单个通道上的ID）的在线检查状态，内存大小固定"""
+
+    def __init__(self, interval, label):
+        self.interval = interval
+        self.label = label  # 告警与汇总中显示的名称
+        self.count = 0
+        self.last_time = None
+        self.last_heartbeat = None
+        self.overdue = False
+        self.period_errors = 0
+        self.heartbeat_errors = 0
+        self.xor_errors = 0
+        self.timeouts = 0
+        self.jitter = JitterHistogram()
+
+
+class LiveValidator:
+    """
+    在线增量检查：对每个到达的帧做与 check_frames 相同的周期、心跳、异或检查，
+    并在某ID超过一个周期（加容差）未到达时立即告警。
+    Args:
+        alert: 告警回调，参数为告警文本。
+        tolerance: 周期允许的偏差（毫秒）。
+    """
+
+    def __init__(self, alert=print, tolerance=PERIOD_TOLERANCE):
+        self.alert = alert
+        self.tolerance = tolerance
+        self.states = {}
+
+    def _state(self, frame_id, channel):
+        state = self.states.get((frame_id, channel))
+        if state is None:
+            label = frame_id if channel is None else f"{frame_id}/{channel}"
+            state = self.states[(frame_id, channel)] = IdState(TIME_INTERVALS.get(frame_id), label)
+        return state
+
+    def feed(self, now_ms, frame_id, data, channel=None):
+        """
+        检查一帧
+        Args:
+            now_ms: 帧的时间（毫秒），同一ID的各帧须使用同一时钟。
+            frame_id: 大写十六进制ID字符串。
+            data: 帧数据 bytes。
+            channel: 接收通道，不为 None 时各通道分别检查（回环帧会在多个通道上出现）。
+        """
+        state = self._state(frame_id, channel)
+        label = state.label
+        state.count += 1
+        state.overdue = False
+
+        # 检查时间间隔
+        if state.last_time is not None and state.interval:
+            time_diff = now_ms - state.last_time
+            state.jitter.add(time_diff - state.interval)
+            if abs(time_diff - state.interval) > self.tolerance:
+                state.period_errors += 1
+                self.alert(f"周期错误: {label} 实际间隔 {time_diff:.1f}ms，"
+                           f"期待间隔 {state.interval}ms")
+        state.last_time = now_ms
+
+        # 检查心跳位
+        hb_byte = HEARTBEAT_BYTES.get(frame_id)
+        if hb_byte is not None and len(data) > hb_byte:
+            heartbeat = data[hb_byte]
+            if state.last_heartbeat is not None:
+                expected_heartbeat = (state.last_heartbeat + 1) % 256  # 心跳溢出处理
+                if heartbeat != expected_heartbeat:
+                    state.heartbeat_errors += 1
+                    self.alert(f"心跳错误: {label} 当前值 {heartbeat}, "
+                               f"期待值 {expected_heartbeat}")
+            state.last_heartbeat = heartbeat
+
+        # 检查异或值
+        if frame_id in XOR_IDS and data:
+            calculated_xor = 0
+            for byte in data[:-1]:
+                calculated_xor ^= byte
+            if calculated_xor != data[-1]:
+                state.xor_errors += 1
+                self.alert(f"异或错误: {label} 计算值 {calculated_xor:02X}，"
+                           f"数据值 {data[-1]:02X}")
+
+    def check_timeouts(self, now_ms):
+        """对超过一个周期（加容差）未到达的ID告警，每次断流只告警一次"""
+        for state in self.states.values():
+            if (state.interval and state.last_time is not None and not state.overdue
+                    and now_ms - state.last_time > state.interval + self.tolerance):
+                state.overdue = True
+                state.timeouts += 1
+                self.alert(f"超时: {state.label} 已 {now_ms - state.last_time:.1f}ms 未收到，"
+                           f"期待间隔 {state.interval}ms")
+
+    def next_deadline(self):
+        """最早的超时检查时间（毫秒），没有需要检查的ID时返回 None"""
+        deadlines = [state.last_time + state.interval + self.tolerance
+                     for state in self.states.values()
+                     if state.interval and state.last_time is not None and not state.overdue]
+        return min(deadlines) if deadlines else None
+
+    def print_summary(self):
+        print(f"{'ID':<12} {'Frames':>8} {'p50':>7} {'p99':>7} {'Max':>7} "
+              f"{'PeriodErr':>10} {'HBErr':>7} {'XorErr':>7} {'Timeout':>8}")
+        for state in self.states.values():
+            jitter = [f"{v:.1f}" if v is not None else "-" for v in (
+                state.jitter.percentile(50), state.jitter.percentile(99),
+                state.jitter.max if state.jitter.counts.any() else None)]
+            print(f"{state.label:<12} {state.count:>8} {jitter[0]:>7} {jitter[1]:>7} {jitter[2]:>7} "
+                  f"{state.period_errors:>10} {state.heartbeat_errors:>7} "
+                  f"{state.xor_errors:>7} {state.timeouts:>8}")
+
+
+def live_check(path=SOCKET_READ_PATH, tolerance=PERIOD_TOLERANCE, report_interval=5.0):
+    """
+    订阅 middleware 的接收通道（二进制记录）并在线检查
+    周期按记录的 timestamp_us 计算，即设备时间戳映射到 middleware 主机时钟后的发送时刻，
+    不受接收线程轮询与套接字转发延迟影响；超时检查换算到本机单调时钟。
+    Args:
+        path: 接收通道的 Unix 域套接字路径。
+        tolerance: 周期允许的偏差（毫秒）。
+        report_interval: 打印汇总的间隔（秒）。
+    """
+    validator = LiveValidator(tolerance=tolerance)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.sendall(subscription_request(binary=True))
+    print(f"[INFO] 已连接到 {path}，开始在线检查")
+    pending = b""
+    clock_offset = None  # 最近一批记录的时间 - 到达时的本机单调时钟（毫秒），超时检查据此扣除转发延迟
+    next_report = time.monotonic() + report_interval
+    try:
+        while True:
+            now_ms = time.monotonic() * 1000
+            deadline = validator.next_deadline()
+            timeout = report_interval
+            if deadline is not None and clock_offset is not None:
+                timeout = max(deadline - clock_offset - now_ms, 0) / 1000
+            ready, _, _ = select.select([sock], [], [], min(timeout, report_interval))
+            now_ms = time.monotonic() * 1000
+            if ready:
+                chunk = sock.recv(1 << 16)
+                if not chunk:
+                    print("[INFO] 服务器断开连接")
+                    break
+                pending += chunk
+                complete = len(pending) - len(pending) % RECORD_SIZE
+                records = frombuffer(pending[:complete])
+                pending = pending[complete:]
+                times_ms = records['timestamp_us'] / 1000
+                if len(records):
+                    clock_offset = float(times_ms.max()) - now_ms
+                # 只取 dlc 个字节：短帧不能按补零后的8字节检查心跳与异或
+                for t, frame_id, channel, dlc, data in zip(
+                        times_ms.tolist(), records['id'].tolist(), records['channel'].tolist(),
+                        records['dlc'].tolist(), (row.tobytes() for row in records['data'])):
+                    validator.feed(t, format(frame_id, "X"), data[:dlc], channel)
+            if clock_offset is not None:
+                validator.check_timeouts(now_ms + clock_offset)
+            if time.monotonic() >= next_report:
+                validator.print_summary()
+                next_report += report_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        validator.print_summary()
 
 
 if __name__ == "__main__":
-    # 替换为你的文件名
-    filename = "right.txt"
-    errors = check_frames(filename)
-
-    print("\n结果总结：")
-    if errors:
-        print("发现以下错误：")
-        for error in errors:
-            print(error)
+    parser = argparse.ArgumentParser(description="检查帧的发送周期、心跳位和异或值")
+    parser.add_argument("filename", nargs="?", default="right.txt", help="日志文件名")
+    parser.add_argument("-v", "--verbose", action="store_true", help="逐帧输出检查结果")
+    parser.add_argument("-n", "--max-positions", type=int, default=10,
+                        help="汇总中每类错误最多列出的行号个数")
+    parser.add_argument("--live", action="store_true",
+                        help=f"订阅 {SOCKET_READ_PATH} 在线检查，而不是检查日志文件")
+    parser.add_argument("--socket", default=SOCKET_READ_PATH, help="在线检查的套接字路径")
+    parser.add_argument("--tolerance", type=float, default=PERIOD_TOLERANCE,
+                        help="在线检查时周期允许的偏差（毫秒）")
+    parser.add_argument("--frames", default=None,
+                        help="从控制帧表配置（如 control_frames.yaml）读取周期、心跳与异或定义")
+    args = parser.parse_args()
+    if args.frames:
+        use_frame_config(args.frames)
+    if args.live:
+        live_check(args.socket, args.tolerance)
     else:
-        print("所有帧验证通过！")
+        errors = check_frames(args.filename, verbose=args.verbose,
+                              max_positions=args.max_positions, summary=True)
+
+        print("\n结果总结：")
+        if errors:
+            print(f"发现 {len(errors)} 个错误。")
+            if args.verbose:
+                for error in errors:
+                    print(error)
+        else:
+            print("所有帧验证通过！")
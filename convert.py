@@ -1,8 +1,21 @@
+import argparse
+import hashlib
+import io
+import os
 import yaml
 import json
 import struct
+import time
 import datetime
 from datetime import datetime, timezone
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from can_archive import Archive, is_archive
+from can_records import FLAG_EXTERN, payloads as record_payloads
+from can_store import Store, format_record, is_store
 
 def parse_data_from_lookup(data_bits, lookup):
     """
@@ -55,60 +68,774 @@ def parse_data_from_lookup(data_bits, lookup):
     return result
 
 
-def parse_record(file_name, lookup_file, output_file):
+class FrameDecoder:
+    """
+    单个ID的向量化解码器。
+    将 lookup.yaml 中该ID的字段定义一次性转换为 shift/mask/factor/offset 数组，
+    之后可以把该ID的所有帧作为一列 uint64 载荷一次性解码。
+    位序与 parse_data_from_lookup 完全一致：第0字节在最高位，每字节内高位在前，
+    start_bit=0 即第0字节的最高位。
+    """
+
+    def __init__(self, lookup):
+        self.lookup = lookup
+        self.names = []
+        self.types = []
+        self.dics = []
+        shifts, masks, factors, offsets = [], [], [], []
+        # 只有所有字段都落在64位载荷内时才能走向量化路径，否则退回逐帧解析
+        self.vectorized = True
+        for field in lookup:
+            start_bit = field['start_bit']
+            length = field['length']
+            if not (isinstance(start_bit, int) and isinstance(length, int)
+                    and start_bit >= 0 and length > 0 and start_bit + length <= 64):
+                self.vectorized = False
+                start_bit, length = 0, 1
+            self.names.append(field['name'])
+            self.types.append(field.get('type', 'numeric'))
+            self.dics.append(field.get('dic'))
+            shifts.append(64 - start_bit - length)
+            masks.append((1 << length) - 1)
+            factors.append(field.get('factor', 1))
+            offsets.append(field.get('offset', 0))
+        self.shifts = np.array(shifts, dtype=np.uint64)
+        self.masks = np.array(masks, dtype=np.uint64)
+        self.factors = factors
+        self.offsets = offsets
+
+    def decode_columns(self, payloads):
+        """
+        将一列载荷解码为每个信号一列的 NumPy 数组
+        Args:
+            payloads: uint64 数组，每个元素为一帧8字节数据（第0字节在最高位）。
+        Returns:
+            有序字典，键为信号名，值为该信号的列；枚举信号为 object 数组。
+        """
+        payloads = np.asarray(payloads, dtype=np.uint64)
+        columns = {}
+        for i, name in enumerate(self.names):
+            raw = (payloads >> self.shifts[i]) & self.masks[i]
+            field_type = self.types[i]
+            if field_type == 'enum':
+                column = self._map_enum(raw, self.dics[i])
+            elif field_type == 'numeric':
+                column = self._scale(raw, int(self.masks[i]), self.factors[i], self.offsets[i])
+            else:
+                column = raw
+            columns[name] = column
+        return columns
+
+    @staticmethod
+    def _map_enum(raw, dic):
+        """只对出现过的原始值查一次枚举表，再按索引展开成整列"""
+        if not hasattr(dic, 'get'):
+            # 与 parse_data_from_lookup 一致：缺少 dic 时每帧输出 wrong 并置0
+            for _ in range(len(raw)):
+                print("wrong")
+            return np.zeros(len(raw), dtype=object)
+        uniques, inverse = np.unique(raw, return_inverse=True)
+        mapped = np.empty(len(uniques), dtype=object)
+        for j, v in enumerate(uniques.tolist()):
+            mapped[j] = dic.get(v, "Unknown")
+        return mapped[inverse.reshape(-1)]
+
+    @staticmethod
+    def _scale(raw, mask, factor, offset):
+        """计算 value * factor + offset，保持与 Python 标量运算相同的 int/float 结果"""
+        if isinstance(factor, int) and isinstance(offset, int):
+            # 整数系数：结果可能超出 int64 时退回 Python 整数
+            if mask * abs(factor) + abs(offset) < (1 << 63):
+                return raw.astype(np.int64) * factor + offset
+            return np.array([v * factor + offset for v in raw.tolist()], dtype=object)
+        if isinstance(factor, (int, float)) and isinstance(offset, (int, float)):
+            if isinstance(factor, int):
+                # 先做精确的整数乘法，再与浮点 offset 相加
+                if mask * abs(factor) < (1 << 63):
+                    return (raw.astype(np.int64) * factor).astype(np.float64) + offset
+                return np.array([v * factor + offset for v in raw.tolist()], dtype=object)
+            return raw.astype(np.float64) * factor + offset
+        return np.array([v * factor + offset for v in raw.tolist()], dtype=object)
+
+    def decode_many(self, payloads):
+        """
+        批量解码，返回与 parse_data_from_lookup 相同结构的字典列表
+        Args:
+            payloads: uint64 数组或整数列表。
+        Returns:
+            每帧一个字典的列表。
+        """
+        columns = self.decode_columns(payloads)
+        if not columns:
+            return [{} for _ in range(len(payloads))]
+        names = list(columns)
+        values = [columns[name].tolist() for name in names]
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+
+def compile_lookup(lookup_data):
+    """
+    把 lookup.yaml 的内容编译为 {ID: FrameDecoder}
+    Args:
+        lookup_data: yaml.safe_load 得到的字典。
+    Returns:
+        以帧ID为键的解码器字典。
+    """
+    return {frame_id: FrameDecoder(lookup) for frame_id, lookup in lookup_data.items()}
+
+
+def payload_from_bits(data_bits):
+    """
+    把比特串形式的数据转为 uint64 载荷（第0字节在最高位）
+    Args:
+        data_bits: 与 parse_data_from_lookup 相同格式的比特串。
+    Returns:
+        8字节数据时返回整数，其余情况返回 None（由调用方退回逐帧解析）。
+    """
+    bitstream = "".join(data_bits.split())
+    if len(bitstream) // 8 != 8:
+        return None
+    try:
+        return int(bitstream[:64], 2)
+    except ValueError:
+        return None
+
+
+def decode_batch(pending, decoders):
+    """
+    按ID分组批量解码一批帧
+    Args:
+        pending: [(frame_id_int, data_bits), ...]，保持原始帧顺序。
+        decoders: compile_lookup 得到的解码器字典。
+    Returns:
+        与 pending 等长的解析结果列表；解析失败的帧为 None。
+    """
+    decoded = [None] * len(pending)
+    groups = {}
+    for index, (frame_id, data_bits) in enumerate(pending):
+        decoder = decoders[frame_id]
+        payload = payload_from_bits(data_bits) if decoder.vectorized else None
+        if payload is None:
+            # 非8字节或格式异常的数据，按原逻辑逐帧解析
+            try:
+                decoded[index] = parse_data_from_lookup(data_bits, decoder.lookup)
+            except Exception:
+                decoded[index] = None
+            continue
+        group = groups.setdefault(frame_id, ([], []))
+        group[0].append(index)
+        group[1].append(payload)
+    for frame_id, (indices, payloads) in groups.items():
+        rows = decoders[frame_id].decode_many(np.array(payloads, dtype=np.uint64))
+        for index, row in zip(indices, rows):
+            decoded[index] = row
+    return decoded
+
+
+def parse_line(line):
+    """
+    解析 record.txt 中的一行
+    Args:
+        line: 去掉首尾空白后的一行文本。
+    Returns:
+        (timestamp, frame_id, frame_type, data)，格式异常时抛出异常。
+    """
+    parts = line.split()
+    timestamp = parts[0][1:-1]  # 去掉中括号的时间戳
+    frame_type = parts[4]  # 标准帧 or 扩展帧
+    frame_id = parts[3]  # 提取ID
+    data = " ".join(parts[6:])  # 提取Data位
+    return timestamp, frame_id, frame_type, data
+
+
+def decode_lines(lines, decoders):
+    """
+    解码一批 record.txt 行，同一ID的帧一起向量化解码
+    Args:
+        lines: 文本行的可迭代对象。
+        decoders: compile_lookup 得到的解码器字典。
+    Returns:
+        按原始顺序排列的结果字典列表。
+    """
+    frames = []
+    pending = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        # 解析行数据
+        try:
+            timestamp, frame_id, frame_type, data = parse_line(line)
+            frame_id_upper = int(frame_id, 16) # 转为大写匹配YAML中定义
+
+            # 检查ID是否在lookup.yaml中
+            if frame_id_upper in decoders:
+                # 时间戳非法的帧与逐帧解析时一样视为错误行
+                datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+                frames.append((line, timestamp, frame_id, frame_type))
+                pending.append((frame_id_upper, data))
+            else:
+                # 如果ID没有在lookup文件里，跳过
+                print(f"{hex(frame_id_upper)}")
+        except:
+            print("ERROW",line)
+
+    results = []
+    for (line, timestamp, frame_id, frame_type), parsed_data in zip(
+            frames, decode_batch(pending, decoders)):
+        if parsed_data is None:
+            print("ERROW",line)
+            continue
+        # 构造解析后的结果
+        results.append({
+            "timestamp":timestamp,
+            "id": frame_id,
+            "type": frame_type,
+            "data": parsed_data
+        })
+    return results
+
+
+# 每批解码的行数，批越大向量化收益越高
+DECODE_BATCH = 65536
+
+
+def iter_batches(f, batch_size=DECODE_BATCH):
+    """
+    按固定行数分批读取文件，内存占用只与 batch_size 有关
+    Args:
+        f: 已打开的文本文件对象。
+        batch_size: 每批的行数。
+    Returns:
+        逐批产出行列表的生成器。
+    """
+    batch = []
+    for line in f:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_jsonl(results, f):
+    """把解析结果按 JSON Lines 格式（每帧一行）写入文件"""
+    f.writelines(json.dumps(result, ensure_ascii=False) + "\n" for result in results)
+
+
+def decode_records(records, decoders):
+    """
+    解码一批二进制记录（can_store 录制文件），结果与解码其导出的 record.txt 相同
+    Args:
+        records: can_records.RECORD_DTYPE 结构化数组。
+        decoders: compile_lookup 得到的解码器字典。
+    Returns:
+        按原始顺序排列的结果字典列表。
+    """
+    ids = records['id']
+    dlcs = records['dlc']
+    decoded = [None] * len(records)
+    for frame_id in np.unique(ids).tolist():
+        indices = np.flatnonzero(ids == frame_id)
+        decoder = decoders.get(frame_id)
+        if decoder is None:
+            continue
+        full = dlcs[indices] == 8 if decoder.vectorized else np.zeros(len(indices), dtype=bool)
+        rows = decoder.decode_many(record_payloads(records[indices[full]]))
+        for index, row in zip(indices[full].tolist(), rows):
+            decoded[index] = row
+        # 非8字节的帧按原逻辑逐帧解析
+        for index in indices[~full].tolist():
+            data = records['data'][index][:dlcs[index]].tolist()
+            try:
+                decoded[index] = parse_data_from_lookup(
+                    " ".join(format(b, "08b") for b in data), decoder.lookup)
+            except Exception:
+                decoded[index] = None
+
+    # 与 decode_lines 相同：先报告未知ID，再报告解析失败的帧
+    for frame_id in ids.tolist():
+        if frame_id not in decoders:
+            # 如果ID没有在lookup文件里，跳过
+            print(f"{hex(frame_id)}")
+
+    results = []
+    for index, (timestamp, frame_id, flags, parsed_data) in enumerate(zip(
+            (records['timestamp_us'] // 1000000).tolist(), ids.tolist(),
+            records['flags'].tolist(), decoded)):
+        if frame_id not in decoders:
+            continue
+        if parsed_data is None:
+            print("ERROW", next(format_record(records[index:index + 1])).strip())
+            continue
+        results.append({
+            "timestamp": str(timestamp),
+            "id": f"{frame_id:08X}",
+            "type": "Ext" if flags & FLAG_EXTERN else "Std",
+            "data": parsed_data
+        })
+    return results
+
+
+def iter_decoded(file_name, decoders, batch_size=DECODE_BATCH):
+    """
+    逐批解码输入文件，文本 record.txt、can_store 录制文件与 can_archive 归档文件均可
+    （归档文件按块解码，每批为一块）
+    Returns:
+        每批结果字典列表的生成器。
+    """
+    if is_archive(file_name):
+        for records in Archive(file_name).iter_chunks():
+            yield decode_records(records, decoders)
+        return
+    if is_store(file_name):
+        for records in Store(file_name).iter_chunks(batch_size):
+            yield decode_records(records, decoders)
+        return
+    with open(file_name, 'r') as f:
+        for batch in iter_batches(f, batch_size):
+            yield decode_lines(batch, decoders)
+
+
+# 编译缓存格式版本，缓存结构变化时递增以使旧缓存失效
+CACHE_VERSION = 2
+
+
+def cache_path_for(lookup_file):
+    """lookup.yaml 对应的编译缓存文件路径（与 yaml 同目录）"""
+    directory, name = os.path.split(os.path.abspath(lookup_file))
+    return os.path.join(directory, f".{name}.cache")
+
+
+def _to_plain(value):
+    """把 yaml 数据转为 JSON 可表示的结构；字典存为键值对列表以保留整数键"""
+    if isinstance(value, dict):
+        return {'map': [[_to_plain(k), _to_plain(v)] for k, v in value.items()]}
+    if isinstance(value, list):
+        return [_to_plain(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise TypeError(f"无法缓存的类型: {type(value).__name__}")
+
+
+def _from_plain(value):
+    """_to_plain 的逆变换"""
+    if isinstance(value, dict):
+        return {_from_plain(k): _from_plain(v) for k, v in value['map']}
+    if isinstance(value, list):
+        return [_from_plain(v) for v in value]
+    return value
+
+
+def _cache_trusted(f):
+    """缓存文件必须属于当前用户且组和其他用户不可写，否则不予使用"""
+    st = os.fstat(f.fileno())
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def load_decoders(lookup_file, use_cache=True):
+    """
+    加载 lookup.yaml 并编译为解码器字典
+    启用缓存时，yaml 的解析结果以 JSON 形式保存在 yaml 旁边，并以 yaml 内容的
+    sha256 作为键；yaml 未变化时从缓存重建解码器，跳过较慢的 yaml.safe_load，
+    yaml 变化、缓存损坏或缓存文件不属于当前用户（或他人可写）时重新解析。
+    缓存只包含普通数据，不会执行任何代码。
+    Args:
+        lookup_file: lookup.yaml文件名
+        use_cache: 是否使用编译缓存
+    Returns:
+        以帧ID为键的 FrameDecoder 字典。
+    """
+    with open(lookup_file, 'rb') as f:
+        content = f.read()
+    if not use_cache:
+        return compile_lookup(yaml.safe_load(content))
+
+    digest = hashlib.sha256(content).hexdigest()
+    cache_file = cache_path_for(lookup_file)
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            if _cache_trusted(f):
+                cached = json.load(f)
+                if cached.get('version') == CACHE_VERSION and cached.get('sha256') == digest:
+                    return compile_lookup(_from_plain(cached['lookup']))
+    except Exception:
+        pass  # 缓存不存在或已损坏，重新解析
+
+    lookup_data = yaml.safe_load(content)
+    decoders = compile_lookup(lookup_data)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        plain = _to_plain(lookup_data)
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'sha256': digest, 'lookup': plain}, f)
+        os.replace(tmp_file, cache_file)  # 原子替换，避免并发进程读到半个文件
+    except (OSError, TypeError, ValueError):
+        # 目录不可写或 yaml 中含有无法缓存的类型时仅跳过缓存
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return decoders
+
+
+# 并行模式下每个区间的最大字节数，限制单个任务的内存占用
+CHUNK_BYTES = 32 * 1024 * 1024
+
+# 工作进程内的解码器，由 _init_worker 在进程启动时加载一次
+_worker_decoders = None
+
+
+def split_ranges(file_name, n_chunks):
+    """
+    把文件切分为按换行符对齐的字节区间
+    Args:
+        file_name: 文件名。
+        n_chunks: 期望的区间个数。
+    Returns:
+        [(start, end), ...]，区间首尾相接且每个区间都以完整的行结束。
+    """
+    size = os.path.getsize(file_name)
+    bounds = [0]
+    with open(file_name, 'rb') as f:
+        for i in range(1, n_chunks):
+            f.seek(max(size * i // n_chunks, bounds[-1]))
+            f.readline()  # 跳到下一行行首
+            pos = min(f.tell(), size)
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    if size > bounds[-1]:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _init_worker(lookup_file, use_cache):
+    global _worker_decoders
+    _worker_decoders = load_decoders(lookup_file, use_cache)
+
+
+def _dump_array_items(results):
+    """按 json.dump(indent=4) 的格式序列化数组元素，便于直接拼接成完整数组"""
+    return ",\n    ".join(
+        json.dumps(result, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+        for result in results)
+
+
+def _decode_range(file_name, start, end, stream):
+    """工作进程：解码 [start, end) 字节区间，返回序列化后的文本和帧数"""
+    with open(file_name, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    pieces = []
+    count = 0
+    # 与文本模式读取一致，使用通用换行符拆分
+    for batch in iter_batches(io.StringIO(text, newline=None)):
+        results = decode_lines(batch, _worker_decoders)
+        count += len(results)
+        if stream:
+            pieces.append("".join(json.dumps(result, ensure_ascii=False) + "\n"
+                                  for result in results))
+        elif results:
+            pieces.append(_dump_array_items(results))
+    if stream:
+        return "".join(pieces), count
+    return ",\n    ".join(pieces), count
+
+
+def parse_record_parallel(file_name, lookup_file, output_file, workers, stream=False,
+                          use_cache=True):
+    """
+    多进程并行解析 record.txt
+    文件按换行符对齐切分为字节区间，每个区间交给进程池解码，
+    结果按区间顺序写出，因此帧的顺序与单进程模式相同。
+    同时在途的区间数有上限，父进程写出较慢时不会无限堆积结果。
+    Args:
+        file_name: record.txt文件名
+        lookup_file: lookup.yaml文件名
+        output_file: 输出文件名
+        workers: 进程数
+        stream: 为 True 时输出 JSON Lines，否则输出与单进程相同的 JSON 数组
+        use_cache: 是否使用 lookup.yaml 的编译缓存
+    """
+    if use_cache:
+        load_decoders(lookup_file)  # 先在父进程中生成缓存，工作进程直接加载
+    size = os.path.getsize(file_name)
+    n_chunks = max(workers * 4, -(-size // CHUNK_BYTES))
+    ranges = split_ranges(file_name, n_chunks)
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(lookup_file, use_cache)) as pool, \
+            open(output_file, 'w', encoding='utf-8') as out:
+        inflight = deque()
+        pending = deque(ranges)
+        first = True
+        if not stream:
+            out.write("[")
+        while pending or inflight:
+            # 保持最多 workers*2 个区间在途
+            while pending and len(inflight) < workers * 2:
+                start, end = pending.popleft()
+                inflight.append(pool.submit(_decode_range, file_name, start, end, stream))
+            text, n = inflight.popleft().result()
+            count += n
+            if stream:
+                out.write(text)
+            elif text:
+                out.write(("\n    " if first else ",\n    ") + text)
+                first = False
+        if not stream:
+            out.write("]" if first else "\n]")
+    print(f"解析完成，共 {count} 帧，结果已保存到 {output_file} 文件中。")
+
+
+# 增量解析的检查点格式版本
+CHECKPOINT_VERSION = 1
+# 增量模式下每次读取的最大字节数，每读完一块即写出结果并保存检查点
+INCREMENTAL_BLOCK = 4 * 1024 * 1024
+# 跟随模式下检查新增内容的间隔（秒）
+FOLLOW_INTERVAL = 0.5
+
+
+def checkpoint_path_for(output_file):
+    """输出文件对应的增量解析检查点路径（与输出同目录）"""
+    directory, name = os.path.split(os.path.abspath(output_file))
+    return os.path.join(directory, f".{name}.ckpt")
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+        if state.get('version') == CHECKPOINT_VERSION:
+            return state
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _save_checkpoint(path, state):
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, path)  # 原子替换，中断时保留上一个检查点
+
+
+def _reset_cursor(state, identity=None):
+    state['identity'] = identity
+    state['offset'] = 0
+    state['line_start'] = 0
+    state['fingerprint'] = None
+
+
+def _matches_checkpoint(f, state):
+    """f 中检查点之前的最后一行与记录的指纹一致，即文件确实是上次读到的那一份"""
+    length = state['offset'] - state['line_start']
+    if state['offset'] == 0:
+        return True
+    f.seek(state['line_start'])
+    line = f.read(length)
+    return len(line) == length and hashlib.sha256(line).hexdigest() == state['fingerprint']
+
+
+def _find_rotated(file_name, state):
+    """在同目录查找被轮转改名的原日志（record.txt.1 等，按设备号与 inode 匹配）"""
+    directory, base = os.path.split(os.path.abspath(file_name))
+    for name in sorted(os.listdir(directory)):
+        if not name.startswith(base) or name == base:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if [st.st_dev, st.st_ino] == state['identity']:
+            return path
+    return None
+
+
+def _append_results(out, results, stream, state):
+    """在输出末尾追加结果：JSON Lines 直接追加，JSON 数组在结尾的 ] 之前插入"""
+    if stream:
+        out.seek(state['output_size'])
+        out.write("".join(json.dumps(result, ensure_ascii=False) + "\n"
+                          for result in results).encode('utf-8'))
+    elif results:
+        # 与 json.dump(indent=4) 相同的格式：空数组为 "[]"，否则以 "\n]" 结尾
+        out.seek(0 if state['count'] == 0 else state['output_size'] - 2)
+        out.write((("[\n    " if state['count'] == 0 else ",\n    ")
+                   + _dump_array_items(results) + "\n]").encode('utf-8'))
+    else:
+        return
+    out.flush()
+    state['output_size'] = out.tell()
+    state['count'] += len(results)
+
+
+def _consume(f, state, decoders, out, stream, checkpoint_file):
+    """
+    从检查点读到文件末尾的最后一个完整行，解码后追加到输出并更新检查点
+    未以换行结束的最后一行留到下次读取。
+    Returns:
+        新增的帧数。
+    """
+    added = 0
+    while True:
+        f.seek(state['offset'])
+        block = f.read(INCREMENTAL_BLOCK)
+        end = block.rfind(b"\n") + 1
+        if end == 0:
+            return added
+        block = block[:end]
+        last_start = block.rfind(b"\n", 0, end - 1) + 1
+        results = []
+        for batch in iter_batches(io.StringIO(block.decode('utf-8', 'replace'), newline=None)):
+            results.extend(decode_lines(batch, decoders))
+        _append_results(out, results, stream, state)
+        state['line_start'] = state['offset'] + last_start
+        state['offset'] += end
+        state['fingerprint'] = hashlib.sha256(block[last_start:]).hexdigest()
+        _save_checkpoint(checkpoint_file, state)
+        added += len(results)
+
+
+def _identity(f):
+    st = os.fstat(f.fileno())
+    return [st.st_dev, st.st_ino]
+
+
+def parse_record_incremental(file_name, lookup_file, output_file, stream=False, follow=False,
+                             interval=FOLLOW_INTERVAL, use_cache=True):
+    """
+    增量解析不断增长的 record.txt
+    检查点（输出文件旁的 .<输出名>.ckpt）记录日志的设备号与 inode、已解析到的字节偏移
+    以及最后一行的 sha256 指纹；再次运行时只解码之后新增的完整行并追加到已有输出。
+    日志被轮转（改名后新建）时先在同目录找到原日志读完剩余部分，再从头读取新日志；
+    日志被截断或改写（指纹不符）时只从头解析新内容，已有输出保留。
+    lookup.yaml、输出格式或输入文件变化，或输出文件被改动时重新完整解析。
+    Args:
+        file_name: record.txt文件名
+        lookup_file: lookup.yaml文件名
+        output_file: 输出文件名
+        stream: 为 True 时输出 JSON Lines，否则输出与 parse_record 相同的 JSON 数组
+        follow: 为 True 时像 tail -f 一样持续解码新到达的行，Ctrl+C 结束
+        interval: 跟随模式下检查新增内容的间隔（秒），即新行写出的最大延迟
+        use_cache: 是否使用 lookup.yaml 的编译缓存
+    """
+    if is_store(file_name) or is_archive(file_name):
+        raise ValueError("增量模式只支持文本 record.txt")
+    decoders = load_decoders(lookup_file, use_cache)
+    with open(lookup_file, 'rb') as f:
+        lookup_digest = hashlib.sha256(f.read()).hexdigest()
+
+    checkpoint_file = checkpoint_path_for(output_file)
+    state = _load_checkpoint(checkpoint_file)
+    if state is not None and (
+            state['input'] != os.path.abspath(file_name) or state['lookup'] != lookup_digest
+            or state['stream'] != stream or not os.path.exists(output_file)
+            or os.path.getsize(output_file) < state['output_size']):
+        print("检查点与当前参数或输出文件不一致，重新完整解析")
+        state = None
+    if state is None:
+        state = {'version': CHECKPOINT_VERSION, 'input': os.path.abspath(file_name),
+                 'lookup': lookup_digest, 'stream': stream, 'count': 0,
+                 'output_size': 0 if stream else 2}
+        _reset_cursor(state)
+        with open(output_file, 'w', encoding='utf-8') as out:
+            out.write("" if stream else "[]")
+
+    added = 0
+    with open(output_file, 'r+b') as out:
+        out.truncate(state['output_size'])  # 丢弃上次中断时写了一半的内容
+        f = open(file_name, 'rb')
+        try:
+            identity = _identity(f)
+            if state['identity'] is not None and state['identity'] != identity:
+                rotated_path = _find_rotated(file_name, state)
+                if rotated_path is None:
+                    print(f"[WARN] {file_name} 已轮转，未找到原日志，其未解析部分将缺失")
+                else:
+                    with open(rotated_path, 'rb') as rotated:
+                        if _matches_checkpoint(rotated, state):
+                            added += _consume(rotated, state, decoders, out, stream, checkpoint_file)
+                _reset_cursor(state, identity)
+            elif state['identity'] is not None and not _matches_checkpoint(f, state):
+                print(f"[INFO] {file_name} 已被截断或改写，从头解析新内容")
+                _reset_cursor(state, identity)
+            state['identity'] = identity
+            added += _consume(f, state, decoders, out, stream, checkpoint_file)
+
+            while follow:
+                time.sleep(interval)
+                added += _consume(f, state, decoders, out, stream, checkpoint_file)
+                try:
+                    st = os.stat(file_name)
+                except FileNotFoundError:
+                    continue  # 轮转时新日志尚未创建
+                if [st.st_dev, st.st_ino] != state['identity']:
+                    # 上次读取到改名之间写入旧文件的行仍在旧句柄中，读完后再切换到新日志
+                    added += _consume(f, state, decoders, out, stream, checkpoint_file)
+                    f.close()
+                    f = open(file_name, 'rb')
+                    _reset_cursor(state, _identity(f))
+                    print(f"[INFO] {file_name} 已轮转，开始解析新日志")
+                elif not _matches_checkpoint(f, state):
+                    _reset_cursor(state, state['identity'])
+                    print(f"[INFO] {file_name} 已被截断或改写，从头解析新内容")
+        except KeyboardInterrupt:
+            pass  # 检查点在每块写出后已保存
+        finally:
+            f.close()
+    print(f"增量解析完成，新增 {added} 帧，共 {state['count']} 帧，结果已保存到 {output_file} 文件中。")
+
+
+def parse_record(file_name, lookup_file, output_file, stream=False, flush_size=DECODE_BATCH,
+                 workers=1, use_cache=True, incremental=False, follow=False,
+                 interval=FOLLOW_INTERVAL):
     """
     主函数：解析record.txt并生成JSON
     Args:
         file_name: record.txt文件名
         lookup_file: lookup.yaml文件名
         output_file: 输出的JSON文件名
+        stream: 为 True 时边解析边写出 JSON Lines，内存占用不随日志大小增长；
+            为 False 时保持原来的单个 JSON 数组输出。
+        flush_size: 流式模式下每解码多少行写出并刷新一次。
+        workers: 大于1时按字节区间切分文件并用多进程并行解码，输出顺序不变。
+            录制文件与归档文件本身已按列批量解码，忽略该参数。
+        use_cache: 是否使用 lookup.yaml 的编译缓存。
+        incremental: 按检查点只解码上次之后新增的行并追加到已有输出，见 parse_record_incremental。
+            新增部分通常很小，忽略 workers。
+        follow: 增量解析后继续跟随日志（类似 tail -f），隐含 incremental。
+        interval: 跟随模式下检查新增内容的间隔（秒）。
     """
-    # 加载 lookup.yaml 文件
-    with open(lookup_file, 'r') as f:
-        lookup_data = yaml.safe_load(f)
+    if incremental or follow:
+        parse_record_incremental(file_name, lookup_file, output_file, stream, follow, interval,
+                                 use_cache)
+        return
+    if workers > 1 and not is_store(file_name) and not is_archive(file_name):
+        parse_record_parallel(file_name, lookup_file, output_file, workers, stream, use_cache)
+        return
 
-    results = []
+    # 加载 lookup.yaml 文件（优先使用编译缓存）
+    decoders = load_decoders(lookup_file, use_cache)
 
-    # 逐行解析 record.txt 文件
-    with open(file_name, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
+    if stream:
+        # 流式输出：每批解码后立即写出，不保留历史结果
+        count = 0
+        with open(output_file, 'w', encoding='utf-8') as out:
+            for results in iter_decoded(file_name, decoders, flush_size):
+                write_jsonl(results, out)
+                out.flush()
+                count += len(results)
+        print(f"解析完成，共 {count} 帧，结果已保存到 {output_file} 文件中。")
+        return
 
-            # 解析行数据
-            try:
-                parts = line.split()
-                timestamp = parts[0][1:-1]  # 去掉中括号的时间戳
-                frame_type = parts[4]  # 标准帧 or 扩展帧
-                frame_id = parts[3]  # 提取ID
-                data = " ".join(parts[6:])  # 提取Data位
-
-                frame_id_upper = int(frame_id, 16) # 转为大写匹配YAML中定义
-                # lookup_data_lower = {str(key).lower(): value for key, value in lookup_data.items()}
-                
-
-                # 检查ID是否在lookup.yaml中
-                if frame_id_upper in lookup_data:
-                    lookup = lookup_data[frame_id_upper]  # 根据ID找到对应的解析规则
-                    parsed_data = parse_data_from_lookup(data, lookup)  # 解析具体字段
-                    
-                    timestamp_str = datetime.fromtimestamp(int(timestamp), tz=timezone.utc).isoformat()
-                    # 构造解析后的结果
-                    result = {
-                        "timestamp":timestamp,
-                        "id": frame_id,
-                        "type": frame_type,
-                        "data": parsed_data
-                    }
-                    results.append(result)
-                else:
-                    # 如果ID没有在lookup文件里，跳过
-                    print(f"{hex(frame_id_upper)}")
+    results = []
 
-                    # print(f"ID {hex(frame_id_upper)} 不在 lookup.yaml 文件中，跳过该条记录。")
-            except:
-                print("ERROW",line)
+    # 分批解析 record.txt 文件（或录制文件）
+    for batch in iter_decoded(file_name, decoders):
+        results.extend(batch)
     # 输出结果到JSON文件
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(results, f, indent=4, ensure_ascii=False)
@@ -116,6 +843,34 @@ def parse_record(file_name, lookup_file, output_file):
     print(f"解析完成，结果已保存到 {output_file} 文件中。")
 
 
+def main():
+    parser = argparse.ArgumentParser(description="根据 lookup.yaml 解析 record.txt")
+    parser.add_argument("input", nargs="?", default="record.txt", help="record.txt、can_store 录制文件或 can_archive 归档文件名")
+    parser.add_argument("-l", "--lookup", default="lookup.yaml", help="lookup.yaml 文件名")
+    parser.add_argument("-o", "--output", default=None,
+                        help="输出文件名（默认 output.json，流式模式默认 output.jsonl）")
+    parser.add_argument("--stream", action="store_true",
+                        help="流式输出 JSON Lines，内存占用与日志大小无关")
+    parser.add_argument("--flush-size", type=int, default=DECODE_BATCH,
+                        help="流式模式下每多少行写出一次")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="并行解码的进程数，0 表示使用全部CPU核")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不使用 lookup.yaml 的编译缓存")
+    parser.add_argument("--incremental", action="store_true",
+                        help="只解析上次运行之后新增的行并追加到已有输出（检查点保存在输出文件旁）")
+    parser.add_argument("-f", "--follow", action="store_true",
+                        help="增量解析后持续跟随日志，新行到达即解码追加，Ctrl+C 结束")
+    parser.add_argument("--interval", type=float, default=FOLLOW_INTERVAL,
+                        help="跟随模式下检查新增内容的间隔（秒）")
+    args = parser.parse_args()
+    output = args.output or ("output.jsonl" if args.stream else "output.json")
+    workers = args.workers or os.cpu_count() or 1
+    parse_record(args.input, args.lookup, output, stream=args.stream,
+                 flush_size=args.flush_size, workers=workers, use_cache=not args.no_cache,
+                 incremental=args.incremental, follow=args.follow, interval=args.interval)
+
+
 if __name__ == '__main__':
     # 解析record.txt，并保存为JSON
-   parse_record('record.txt', 'lookup.yaml', 'output.json')
+    main()
@@ -0,0 +1,530 @@
+#include "frame_config.h"
+#include <ctype.h>
+#include <errno.h>
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+/**
+ * 控制帧表的配置文件，写法与 lookup.yaml 相同：顶层键为帧ID（十进制或 0x 十六进制），
+ * 其下为帧属性，signals 为该帧可按名称设置的信号列表。只支持下面用到的 YAML 子集：
+ *
+ * 402763936:                # 0x1801B0A0
+ *   interval_ms: 20         # 发送周期（必填）
+ *   channel: 1              # 发送通道，默认 1
+ *   data: [0x00, 0x00, 0x00, 0x00, 0x27, 0x00, 0x00, 0x00]   # 默认载荷，8个字节
+ *   heartbeat: 1            # 每次发送前加1的字节，省略表示没有心跳
+ *   checksum: xor           # xor：第7字节为前7字节的异或；none（默认）
+ *   stop_data: [0x00, ~, ~, ~, 0x00, ~, ~, ~]   # 退出前写入的字节，~ 表示不变
+ *   signals:
+ *   - name: steering_angle
+ *     start_bit: 32         # 与 lookup.yaml 相同的位号
+ *     length: 8
+ *     factor: 1             # 物理值 = 原始值 * factor + offset
+ *     offset: 0
+ *
+ * 信号的其他字段（如 type、dic）会被忽略。
+ */
+
+#define CONFIG_LINE_MAX 512
+
+static char *trim(char *s)
+{
+    while (isspace((unsigned char)*s))
+        s++;
+    char *end = s + strlen(s);
+    while (end > s && isspace((unsigned char)end[-1]))
+        *--end = '\0';
+    return s;
+}
+
+static int parse_long(const char *text, long *out)
+{
+    char *end;
+    errno = 0;
+    long value = strtol(text, &end, 0);
+    if (errno != 0 || end == text || *trim(end) != '\0')
+        return 0;
+    *out = value;
+    return 1;
+}
+
+static int parse_double(const char *text, double *out)
+{
+    char *end;
+    errno = 0;
+    double value = strtod(text, &end);
+    if (errno != 0 || end == text || *trim(end) != '\0' || !isfinite(value))
+        return 0;
+    *out = value;
+    return 1;
+}
+
+/**
+ * 解析 "[b0, b1, ..., b7]"，allow_null 时 ~ / null 表示该字节不设置（mask 中对应位为0）
+ */
+static int parse_byte_list(char *text, uint8_t out[8], uint8_t *mask, int allow_null)
+{
+    size_t len = strlen(text);
+    if (len < 2 || text[0] != '[' || text[len - 1] != ']')
+        return 0;
+    text[len - 1] = '\0';
+    int count = 0;
+    char *save = NULL;
+    *mask = 0;
+    for (char *tok = strtok_r(text + 1, ",", &save); tok != NULL; tok = strtok_r(NULL, ",", &save))
+    {
+        if (count >= 8)
+            return 0;
+        tok = trim(tok);
+        long value;
+        if (allow_null && (strcmp(tok, "~") == 0 || strcmp(tok, "null") == 0))
+        {
+            out[count++] = 0;
+            continue;
+        }
+        if (!parse_long(tok, &value) || value < 0 || value > 0xFF)
+            return 0;
+        out[count] = (uint8_t)value;
+        *mask |= 1 << count;
+        count++;
+    }
+    return count == 8;
+}
+
+static uint32_t hash_id(uint32_t id)
+{
+    return id * 2654435761u;
+}
+
+static uint32_t hash_name(const char *name)
+{
+    uint32_t h = 2166136261u; // FNV-1a
+    for (; *name; name++)
+        h = (h ^ (uint8_t)*name) * 16777619u;
+    return h;
+}
+
+static int slot_count_for(int count)
+{
+    int size = 16;
+    while (size < count * 2)
+        size <<= 1;
+    return size;
+}
+
+int find_frame_index(const FrameTable *table, uint32_t id)
+{
+    int mask = table->frame_slot_count - 1;
+    for (int i = hash_id(id) & mask;; i = (i + 1) & mask)
+    {
+        int slot = table->frame_slots[i];
+        if (slot == 0)
+            return -1;
+        if (table->frames[slot - 1].id == id)
+            return slot - 1;
+    }
+}
+
+int find_signal_index(const FrameTable *table, const char *name)
+{
+    int mask = table->signal_slot_count - 1;
+    for (int i = hash_name(name) & mask;; i = (i + 1) & mask)
+    {
+        int slot = table->signal_slots[i];
+        if (slot == 0)
+            return -1;
+        if (strcmp(table->signals[slot - 1].name, name) == 0)
+            return slot - 1;
+    }
+}
+
+/**
+ * 建立哈希索引，ID 或信号名重复时返回 0
+ */
+static int build_index(FrameTable *table)
+{
+    table->frame_slot_count = slot_count_for(table->frame_count);
+    table->signal_slot_count = slot_count_for(table->signal_count);
+    table->frame_slots = (int *)calloc(table->frame_slot_count, sizeof(int));
+    table->signal_slots = (int *)calloc(table->signal_slot_count, sizeof(int));
+    if (table->frame_slots == NULL || table->signal_slots == NULL)
+        return 0;
+    int mask = table->frame_slot_count - 1;
+    for (int f = 0; f < table->frame_count; f++)
+    {
+        if (find_frame_index(table, table->frames[f].id) >= 0)
+        {
+            printf("帧配置错误: 帧ID %X 重复\n", table->frames[f].id);
+            return 0;
+        }
+        int i = hash_id(table->frames[f].id) & mask;
+        while (table->frame_slots[i] != 0)
+            i = (i + 1) & mask;
+        table->frame_slots[i] = f + 1;
+    }
+    mask = table->signal_slot_count - 1;
+    for (int s = 0; s < table->signal_count; s++)
+    {
+        if (find_signal_index(table, table->signals[s].name) >= 0)
+        {
+            printf("帧配置错误: 信号 %s 重复\n", table->signals[s].name);
+            return 0;
+        }
+        int i = hash_name(table->signals[s].name) & mask;
+        while (table->signal_slots[i] != 0)
+            i = (i + 1) & mask;
+        table->signal_slots[i] = s + 1;
+    }
+    return 1;
+}
+
+void free_frame_table(FrameTable *table)
+{
+    free(table->frames);
+    free(table->signals);
+    free(table->frame_slots);
+    free(table->signal_slots);
+    memset(table, 0, sizeof(FrameTable));
+}
+
+int init_frame_table(FrameTable *table, const ControlFrame *frames, int count)
+{
+    memset(table, 0, sizeof(FrameTable));
+    table->frames = (ControlFrame *)calloc(count, sizeof(ControlFrame));
+    if (table->frames == NULL)
+        return -2;
+    memcpy(table->frames, frames, count * sizeof(ControlFrame));
+    table->frame_count = count;
+    if (!build_index(table))
+    {
+        free_frame_table(table);
+        return -2;
+    }
+    return 0;
+}
+
+static int set_frame_key(ControlFrame *frame, const char *key, char *value)
+{
+    long number;
+    uint8_t mask;
+    if (strcmp(key, "interval_ms") == 0)
+    {
+        if (!parse_long(value, &number) || number <= 0)
+            return 0;
+        frame->interval_ms = (uint32_t)number;
+    }
+    else if (strcmp(key, "channel") == 0)
+    {
+        if (!parse_long(value, &number) || number < 0)
+            return 0;
+        frame->channel = (int)number;
+    }
+    else if (strcmp(key, "heartbeat") == 0)
+    {
+        if (!parse_long(value, &number) || number < 0 || number > 7)
+            return 0;
+        frame->heartbeat_byte = (int)number;
+    }
+    else if (strcmp(key, "checksum") == 0)
+    {
+        if (strcmp(value, "xor") == 0)
+            frame->checksum = CHECKSUM_XOR;
+        else if (strcmp(value, "none") == 0)
+            frame->checksum = CHECKSUM_NONE;
+        else
+            return 0;
+    }
+    else if (strcmp(key, "data") == 0)
+    {
+        if (!parse_byte_list(value, frame->data, &mask, 0))
+            return 0;
+    }
+    else if (strcmp(key, "stop_data") == 0)
+    {
+        if (!parse_byte_list(value, frame->stop_data, &frame->stop_mask, 1))
+            return 0;
+    }
+    else
+    {
+        return 0;
+    }
+    return 1;
+}
+
+static int set_signal_key(SignalDef *signal, const char *key, const char *value)
+{
+    long number;
+    if (strcmp(key, "name") == 0)
+    {
+        if (value[0] == '\0' || strlen(value) >= SIGNAL_NAME_MAX || strchr(value, ' ') != NULL)
+            return 0;
+        strcpy(signal->name, value);
+    }
+    else if (strcmp(key, "start_bit") == 0)
+    {
+        if (!parse_long(value, &number) || number < 0 || number > 63)
+            return 0;
+        signal->start_bit = (int)number;
+    }
+    else if (strcmp(key, "length") == 0)
+    {
+        if (!parse_long(value, &number) || number < 1 || number > 64)
+            return 0;
+        signal->length = (int)number;
+    }
+    else if (strcmp(key, "factor") == 0)
+    {
+        if (!parse_double(value, &signal->factor) || signal->factor == 0)
+            return 0;
+    }
+    else if (strcmp(key, "offset") == 0)
+    {
+        if (!parse_double(value, &signal->offset))
+            return 0;
+    }
+    // 其余字段（type、dic 等）忽略
+    return 1;
+}
+
+/**
+ * 块格式的字节列表（yaml.safe_dump 的输出）收集为 "[a, b, ...]" 后按流格式解析
+ */
+static int flush_byte_list(ControlFrame *frame, char *key, char *items, int line_no)
+{
+    size_t len = strlen(items);
+    items[len - 1] = ']'; // 替换最后一个逗号
+    if (len == 1 || !set_frame_key(frame, key, items))
+    {
+        printf("帧配置错误: 第 %d 行 %s 的值无效\n", line_no, key);
+        key[0] = '\0';
+        return 0;
+    }
+    key[0] = '\0';
+    return 1;
+}
+
+/**
+ * 把 "key: value" 拆开，value 可为空（如 "signals:"）
+ */
+static int split_key_value(char *text, char **key, char **value)
+{
+    char *colon = strchr(text, ':');
+    if (colon == NULL || (colon[1] != '\0' && colon[1] != ' '))
+        return 0;
+    *colon = '\0';
+    *key = trim(text);
+    *value = trim(colon + 1);
+    return (*key)[0] != '\0';
+}
+
+static int check_signal(const FrameTable *table, int line_no)
+{
+    const SignalDef *signal = &table->signals[table->signal_count - 1];
+    if (signal->name[0] == '\0' || signal->length == 0 ||
+        signal->start_bit + signal->length > 64)
+    {
+        printf("帧配置错误: 第 %d 行之前的信号缺少 name/length 或超出64位\n", line_no);
+        return 0;
+    }
+    return 1;
+}
+
+static int check_frame(const FrameTable *table)
+{
+    const ControlFrame *frame = &table->frames[table->frame_count - 1];
+    if (frame->interval_ms == 0)
+    {
+        printf("帧配置错误: 帧 %X 缺少 interval_ms\n", frame->id);
+        return 0;
+    }
+    return 1;
+}
+
+int load_frame_table(const char *path, FrameTable *table)
+{
+    memset(table, 0, sizeof(FrameTable));
+    FILE *fp = fopen(path, "r");
+    if (fp == NULL)
+        return -1;
+    table->frames = (ControlFrame *)calloc(MAX_CONTROL_FRAMES, sizeof(ControlFrame));
+    table->signals = (SignalDef *)calloc(MAX_SIGNALS, sizeof(SignalDef));
+    if (table->frames == NULL || table->signals == NULL)
+    {
+        fclose(fp);
+        free_frame_table(table);
+        return -2;
+    }
+
+    char line[CONFIG_LINE_MAX];
+    int line_no = 0;
+    int frame_indent = -1;  // 帧属性的缩进
+    int signal_indent = -1; // 信号字段的缩进
+    int in_signals = 0;
+    char list_key[16] = ""; // 正在收集的块格式字节列表
+    char list_items[CONFIG_LINE_MAX];
+    int list_line = 0;
+    int ok = 1;
+    while (ok && fgets(line, sizeof(line), fp) != NULL)
+    {
+        line_no++;
+        char *comment = strchr(line, '#');
+        if (comment != NULL)
+            *comment = '\0';
+        if (*trim(line) == '\0')
+            continue;
+        int indent = 0;
+        while (line[indent] == ' ')
+            indent++;
+        char *text = line + indent;
+        char *key, *value;
+
+        if (list_key[0] != '\0')
+        {
+            if (indent > 0 && strncmp(text, "- ", 2) == 0)
+            {
+                if (strlen(list_items) + strlen(text) + 1 >= sizeof(list_items))
+                {
+                    printf("帧配置错误: 第 %d 行 %s 过长\n", line_no, list_key);
+                    ok = 0;
+                    break;
+                }
+                strcat(list_items, trim(text + 2));
+                strcat(list_items, ",");
+                continue;
+            }
+            if (!flush_byte_list(&table->frames[table->frame_count - 1], list_key, list_items,
+                                 list_line))
+            {
+                ok = 0;
+                break;
+            }
+        }
+
+        if (indent == 0)
+        {
+            // 新的帧：顶层键为帧ID
+            long id;
+            if (!split_key_value(text, &key, &value) || value[0] != '\0' || !parse_long(key, &id) ||
+                id < 0 || id > 0x1FFFFFFF)
+            {
+                printf("帧配置错误: 第 %d 行应为帧ID\n", line_no);
+                ok = 0;
+                break;
+            }
+            if ((table->frame_count > 0 && !check_frame(table)) ||
+                (table->signal_count > 0 && !check_signal(table, line_no)))
+            {
+                ok = 0;
+                break;
+            }
+            if (table->frame_count == MAX_CONTROL_FRAMES)
+            {
+                printf("帧配置错误: 控制帧超过 %d 个\n", MAX_CONTROL_FRAMES);
+                ok = 0;
+                break;
+            }
+            ControlFrame *frame = &table->frames[table->frame_count++];
+            frame->id = (uint32_t)id;
+            frame->channel = 1;
+            frame->heartbeat_byte = -1;
+            frame->checksum = CHECKSUM_NONE;
+            frame_indent = -1;
+            in_signals = 0;
+            continue;
+        }
+        if (table->frame_count == 0)
+        {
+            printf("帧配置错误: 第 %d 行不属于任何帧\n", line_no);
+            ok = 0;
+            break;
+        }
+
+        if (in_signals && strncmp(text, "- ", 2) == 0)
+        {
+            // 新的信号
+            if (table->signal_count > 0 && !check_signal(table, line_no))
+            {
+                ok = 0;
+                break;
+            }
+            if (table->signal_count == MAX_SIGNALS)
+            {
+                printf("帧配置错误: 信号超过 %d 个\n", MAX_SIGNALS);
+                ok = 0;
+                break;
+            }
+            SignalDef *signal = &table->signals[table->signal_count++];
+            signal->frame_index = table->frame_count - 1;
+            signal->factor = 1;
+            signal_indent = indent + 2;
+            text += 2;
+            indent += 2;
+        }
+        else if (frame_indent < 0 || indent == frame_indent)
+        {
+            // 帧属性
+            frame_indent = indent;
+            if (!split_key_value(text, &key, &value))
+            {
+                printf("帧配置错误: 第 %d 行格式错误\n", line_no);
+                ok = 0;
+                break;
+            }
+            in_signals = strcmp(key, "signals") == 0;
+            if (in_signals)
+            {
+                signal_indent = -1;
+                continue;
+            }
+            if (value[0] == '\0' && (strcmp(key, "data") == 0 || strcmp(key, "stop_data") == 0))
+            {
+                strcpy(list_key, key);
+                strcpy(list_items, "[");
+                list_line = line_no;
+                continue;
+            }
+            if (!set_frame_key(&table->frames[table->frame_count - 1], key, value))
+            {
+                printf("帧配置错误: 第 %d 行 %s 的值无效\n", line_no, key);
+                ok = 0;
+            }
+            continue;
+        }
+        else if (!in_signals || signal_indent < 0 || indent < signal_indent)
+        {
+            printf("帧配置错误: 第 %d 行缩进错误\n", line_no);
+            ok = 0;
+            break;
+        }
+
+        if (indent > signal_indent)
+            continue; // 信号字段的嵌套内容（如 dic），忽略
+        if (!split_key_value(text, &key, &value) ||
+            !set_signal_key(&table->signals[table->signal_count - 1], key, value))
+        {
+            printf("帧配置错误: 第 %d 行信号字段无效\n", line_no);
+            ok = 0;
+        }
+    }
+    fclose(fp);
+
+    if (ok && list_key[0] != '\0')
+        ok = flush_byte_list(&table->frames[table->frame_count - 1], list_key, list_items, list_line);
+    if (ok && table->frame_count == 0)
+    {
+        printf("帧配置错误: 没有控制帧\n");
+        ok = 0;
+    }
+    if (ok)
+        ok = check_frame(table) && (table->signal_count == 0 || check_signal(table, line_no + 1));
+    if (ok)
+        ok = build_index(table);
+    if (!ok)
+    {
+        free_frame_table(table);
+        return -2;
+    }
+    return 0;
+}
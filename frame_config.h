@@ -0,0 +1,64 @@
+#ifndef FRAME_CONFIG_H
+#define FRAME_CONFIG_H
+#include <stdint.h>
+
+#define DEFAULT_FRAME_CONFIG "control_frames.yaml"
+#define MAX_CONTROL_FRAMES 512
+#define MAX_SIGNALS 4096
+#define SIGNAL_NAME_MAX 48
+
+// 校验规则
+#define CHECKSUM_NONE 0
+#define CHECKSUM_XOR 1 // 第7字节为前7字节的异或值
+
+// 控制帧的数据结构
+typedef struct
+{
+    uint32_t id;
+    int modified; // 是否使用修改的帧
+    uint8_t data[8];
+    uint32_t interval_ms;
+    uint64_t next_send_time; // 下一次发送的截止时刻（CLOCK_MONOTONIC 微秒）
+    uint8_t temp_data[8];    // 新增：临时数据缓冲区
+    int channel;             // 发送通道
+    int heartbeat_byte;      // 心跳字节，-1 表示没有心跳
+    int checksum;            // CHECKSUM_*
+    uint8_t stop_data[8];    // 退出前写入的字节
+    uint8_t stop_mask;       // stop_data 中生效的字节（第 i 位对应第 i 字节）
+    int touched;             // 批量指令处理时的临时标记
+} ControlFrame;
+
+// 可按名称设置的信号，位号与 lookup.yaml 相同（第0字节在最前，每字节内高位在前）
+typedef struct
+{
+    char name[SIGNAL_NAME_MAX];
+    int frame_index;
+    int start_bit;
+    int length;
+    double factor;
+    double offset;
+} SignalDef;
+
+// 控制帧表，ID 与信号名均通过开放寻址哈希表查找
+typedef struct
+{
+    ControlFrame *frames;
+    int frame_count;
+    SignalDef *signals;
+    int signal_count;
+    int *frame_slots; // 存放 帧下标+1，0 表示空
+    int frame_slot_count;
+    int *signal_slots; // 存放 信号下标+1，0 表示空
+    int signal_slot_count;
+} FrameTable;
+
+// 从配置文件加载，返回 0 成功，-1 文件不存在，-2 格式错误
+int load_frame_table(const char *path, FrameTable *table);
+// 由已有的帧数组（不含信号）建立表，返回 0 成功
+int init_frame_table(FrameTable *table, const ControlFrame *frames, int count);
+void free_frame_table(FrameTable *table);
+// 查找帧或信号，返回下标，未找到返回 -1
+int find_frame_index(const FrameTable *table, uint32_t id);
+int find_signal_index(const FrameTable *table, const char *name);
+
+#endif // FRAME_CONFIG_H
@@ -0,0 +1,135 @@
+"""
+控制帧表配置（control_frames.yaml），与 middleware 的 frame_config.c 读取同一文件
+顶层键为帧ID，帧属性为 interval_ms、channel、data、heartbeat、checksum、stop_data，
+signals 为可按名称设置的信号（字段同 lookup.yaml）。
+"""
+import math
+
+import yaml
+
+DEFAULT_FRAME_CONFIG = "control_frames.yaml"
+CHECKSUMS = ("none", "xor")  # xor：第7字节为前7字节的异或值
+# 与 frame_config.h 一致的上限
+MAX_CONTROL_FRAMES = 512
+MAX_SIGNALS = 4096
+SIGNAL_NAME_MAX = 48  # 含结尾的 '\0'
+FRAME_KEYS = ("interval_ms", "channel", "data", "heartbeat", "checksum", "stop_data", "signals")
+
+
+class FrameSpec:
+    """
+    一个控制帧的配置
+    Attributes:
+        heartbeat: 每次发送前加1的字节，None 表示没有心跳。
+        checksum: CHECKSUMS 之一。
+        stop_data: 8个元素，None 表示退出时不改写该字节。
+        signals: [字段定义, ...]，格式同 lookup.yaml。
+    """
+
+    def __init__(self, frame_id, interval_ms, data, channel=1, heartbeat=None, checksum="none",
+                 stop_data=None, signals=None):
+        self.id = frame_id
+        self.interval_ms = interval_ms
+        self.data = bytes(data)
+        self.channel = channel
+        self.heartbeat = heartbeat
+        self.checksum = checksum
+        self.stop_data = stop_data or [None] * 8
+        self.signals = signals or []
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_bytes(frame_id, key, values, allow_none):
+    if not isinstance(values, list) or len(values) != 8 or not all(
+            (allow_none and v is None) or (_is_int(v) and 0 <= v <= 0xFF) for v in values):
+        raise ValueError(f"帧 {frame_id:X} 的 {key} 应为8个字节")
+
+
+def _check_int(frame_id, key, value, low, high=None):
+    if not _is_int(value) or value < low or (high is not None and value > high):
+        limit = f"{low}~{high}" if high is not None else f">= {low}"
+        raise ValueError(f"帧 {frame_id:X} 的 {key} 应为整数（{limit}）: {value}")
+
+
+def _check_signal(frame_id, signal):
+    """检查一个信号的定义，缺省的 start_bit 与 frame_config.c 一样记为0"""
+    if not isinstance(signal, dict):
+        raise ValueError(f"帧 {frame_id:X} 的信号定义无效: {signal}")
+    name = signal.get("name")
+    if not isinstance(name, str) or not name or len(name) >= SIGNAL_NAME_MAX or " " in name:
+        raise ValueError(f"帧 {frame_id:X} 的信号缺少 name 或名称无效: {name}")
+    if "length" not in signal:
+        raise ValueError(f"信号 {name} 缺少 length")
+    signal.setdefault("start_bit", 0)
+    _check_int(frame_id, f"信号 {name} 的 start_bit", signal["start_bit"], 0, 63)
+    _check_int(frame_id, f"信号 {name} 的 length", signal["length"], 1, 64)
+    for key in ("factor", "offset"):
+        value = signal.get(key, 1 if key == "factor" else 0)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+            raise ValueError(f"信号 {name} 的 {key} 应为数值: {value}")
+    if signal.get("factor", 1) == 0:
+        raise ValueError(f"信号 {name} 的 factor 不能为0")
+    if signal["start_bit"] + signal["length"] > 64:
+        raise ValueError(f"信号 {name} 超出64位")
+
+
+def load_frame_config(path=DEFAULT_FRAME_CONFIG):
+    """
+    读取控制帧表，规则与 frame_config.c 相同
+    Returns:
+        [FrameSpec, ...]，顺序同配置文件。
+    Raises:
+        OSError: 文件不存在。
+        ValueError: 配置无效。
+    """
+    with open(path, "r") as f:
+        config = yaml.safe_load(f) or {}
+    specs = []
+    names = set()
+    if not isinstance(config, dict):
+        raise ValueError("顶层应为以帧ID为键的映射")
+    if len(config) > MAX_CONTROL_FRAMES:
+        raise ValueError(f"控制帧超过 {MAX_CONTROL_FRAMES} 个")
+    for frame_id, fields in config.items():
+        if not _is_int(frame_id) or not 0 <= frame_id <= 0x1FFFFFFF:
+            raise ValueError(f"无效的帧ID: {frame_id}")
+        fields = fields or {}
+        if not isinstance(fields, dict):
+            raise ValueError(f"帧 {frame_id:X} 的属性应为映射")
+        unknown = [key for key in fields if key not in FRAME_KEYS]
+        if unknown:
+            raise ValueError(f"帧 {frame_id:X} 的属性无效: {', '.join(map(str, unknown))}")
+        if "interval_ms" not in fields:
+            raise ValueError(f"帧 {frame_id:X} 缺少 interval_ms")
+        _check_int(frame_id, "interval_ms", fields["interval_ms"], 1)
+        channel = fields.get("channel", 1)
+        _check_int(frame_id, "channel", channel, 0)
+        heartbeat = fields.get("heartbeat")
+        if heartbeat is not None:
+            _check_int(frame_id, "heartbeat", heartbeat, 0, 7)
+        data = fields.get("data", [0] * 8)
+        _check_bytes(frame_id, "data", data, False)
+        stop_data = fields.get("stop_data")
+        if stop_data is not None:
+            _check_bytes(frame_id, "stop_data", stop_data, True)
+        checksum = fields.get("checksum", "none")
+        if checksum not in CHECKSUMS:
+            raise ValueError(f"帧 {frame_id:X} 的校验规则无效: {checksum}")
+        signals = fields.get("signals") or []
+        if not isinstance(signals, list):
+            raise ValueError(f"帧 {frame_id:X} 的 signals 应为列表")
+        for signal in signals:
+            _check_signal(frame_id, signal)
+            if signal["name"] in names:
+                raise ValueError(f"信号 {signal['name']} 重复")
+            names.add(signal["name"])
+        if len(names) > MAX_SIGNALS:
+            raise ValueError(f"信号超过 {MAX_SIGNALS} 个")
+        specs.append(FrameSpec(frame_id, fields["interval_ms"], data, channel, heartbeat,
+                               checksum, stop_data, signals))
+    if not specs:
+        raise ValueError("没有控制帧")
+    return specs
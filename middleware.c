@@ -1,9 +1,14 @@
 // battery.c
 #include "controlcan.h"
+#include "frame_config.h"
 #include "util.h"
 #include <errno.h>
 #include <fcntl.h>
+#include <math.h>
+#include <poll.h>
 #include <pthread.h>
+#include <signal.h>
+#include <stdarg.h>
 #include <stdbool.h>
 #include <stdint.h>
 #include <stdio.h>
@@ -36,33 +41,27 @@
 uint8_t gear_value = 0;
 // 用于缓存接收到的指令
 pthread_mutex_t frame_mutex = PTHREAD_MUTEX_INITIALIZER;
-// 定义控制帧的数据结构
 
-typedef struct
-{
-    UINT id;
-    int modified; // 是否使用修改的帧
-    uint8_t data[8];
-    uint8_t interval_ms;
-    uint64_t next_send_time; // 下一次发送的绝对时间
-    uint8_t temp_data[8];    // 新增：临时数据缓冲区
-} ControlFrame;
-
-#define FRAME_COUNT 4
-
-ControlFrame control_frames[FRAME_COUNT] = {
+// 配置文件不存在时使用的默认控制帧表
+const ControlFrame default_control_frames[] = {
     {ESP_COMMAND, .modified = 0,
      .data = {0x00, 0x00, 0x00, 0x00, 0x27, 0x00, 0x00, 0x00},
-     .interval_ms = 20},
+     .interval_ms = 20, .channel = 1, .heartbeat_byte = 1, .checksum = CHECKSUM_XOR},
     {SPEED_COMMAND, .modified = 0,
      .data = {0x80, 0x18, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00},
-     .interval_ms = 20},
+     .interval_ms = 20, .channel = 1, .heartbeat_byte = 2, .checksum = CHECKSUM_XOR},
     {LIGHT_COMMAND, .modified = 0,
      .data = {0x01, 0x00, 0x00, 0x00, 0x09, 0x00, 0x00, 0x00},
-     .interval_ms = 50},
+     .interval_ms = 50, .channel = 1, .heartbeat_byte = 7, .checksum = CHECKSUM_NONE,
+     .stop_data = {0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00}, .stop_mask = 0x11},
     {REMOTE_COMMAND, .modified = 0,
      .data = {0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00},
-     .interval_ms = 100}};
+     .interval_ms = 100, .channel = 1, .heartbeat_byte = 7, .checksum = CHECKSUM_NONE}};
+
+// 控制帧表，启动时由配置文件（见 frame_config.c）加载
+FrameTable frame_table;
+ControlFrame *control_frames;
+int frame_count;
 // 接收线程上下文
 typedef struct
 {
@@ -102,7 +101,60 @@ void init_unix_domain_socket()
 }
 
 int server_read_fd; // 监听套接字
-int client_read_fd; // 通信套接字
+// 接收通道输出格式，客户端连接后发送 "format binary\n" 切换为二进制记录
+#define RX_FORMAT_TEXT 0
+#define RX_FORMAT_BINARY 1
+#define RX_TEXT_LINE_MAX 64 // 单帧文本行的最大长度
+#define RX_FLAG_EXTERN 0x01
+#define RX_FLAG_REMOTE 0x02
+
+// 二进制接收记录，24 字节，小端
+typedef struct
+{
+    uint64_t timestamp_us; // 接收时间（微秒）
+    uint32_t id;
+    uint8_t channel;
+    uint8_t dlc;
+    uint8_t flags; // RX_FLAG_EXTERN / RX_FLAG_REMOTE
+    uint8_t reserved;
+    uint8_t data[8];
+} __attribute__((packed)) RxRecord;
+typedef char rx_record_size_check[(sizeof(RxRecord) == 24) ? 1 : -1];
+
+/**
+ * 接收通道订阅者
+ * 每个连接到 SOCKET_READ_PATH 的客户端占用一个槽位，拥有独立的环形缓冲区和发送线程。
+ * rx_thread 只把报文放入各订阅者的环形缓冲区，不直接写套接字，慢速订阅者不会阻塞接收。
+ * 客户端可发送以下请求（每行一条）：
+ *   format binary | format text        输出格式
+ *   filter all | filter <id> [<id>...] 只接收指定ID（可用十进制或 0x 十六进制）
+ *   overflow drop | overflow disconnect 缓冲区满时丢弃最旧的帧，或断开连接
+ */
+#define MAX_SUBSCRIBERS 8
+#define SUB_RING_FRAMES 16384 // 必须是2的幂
+#define SUB_MAX_FILTER 64
+#define SUB_REQUEST_MAX 1024 // 单条请求的最大长度（含换行），足够容纳 SUB_MAX_FILTER 个ID
+#define SUB_OVERFLOW_DROP 0
+#define SUB_OVERFLOW_DISCONNECT 1
+typedef struct
+{
+    int fd; // -1 表示槽位空闲
+    int format;
+    int overflow;
+    int overflowed; // 按 disconnect 策略溢出，等待发送线程断开
+    int filter_count; // 0 表示接收全部ID
+    UINT filter_ids[SUB_MAX_FILTER];
+    RxRecord ring[SUB_RING_FRAMES];
+    uint32_t head; // 写入位置（只增不减，取模后使用）
+    uint32_t tail; // 读取位置
+    uint64_t delivered;
+    uint64_t dropped;
+    int wake_pipe[2]; // rx_thread 写入一个字节唤醒发送线程
+    int wake_pending;
+} Subscriber;
+Subscriber subscribers[MAX_SUBSCRIBERS];
+pthread_mutex_t subscribers_mutex = PTHREAD_MUTEX_INITIALIZER;
+
 void init_unix_domain_socket_read()
 {
     struct sockaddr_un server_addr;
@@ -148,94 +200,391 @@ void construct_can_frame(VCI_CAN_OBJ *can, UINT id, const int *data_arr)
  * 更新帧的指定位 tmp_data
  */
 
+int update_data_value(ControlFrame *frame, int start, int len, uint64_t value)
+{
+    // 参数校验
+    if (frame == NULL || start < 0 || len < 1 || len > 64 || start + len > 64)
+    {
+        return 0; // 参数无效，返回失败
+    }
+
+    // 将 frame->data 转为 64 位整数 (小端模式)
+    unsigned long long data_value = 0;
+    for (int i = 0; i < 8; i++)
+    {
+        data_value |= ((unsigned long long)frame->data[i] << (i * 8));
+    }
+
+    // 用掩码一次性替换指定位区间的内容
+    unsigned long long mask = (len == 64) ? ~0ULL : (((1ULL << len) - 1) << start);
+    data_value = (data_value & ~mask) | (((unsigned long long)value << start) & mask);
+
+    // 将更新后的 data_value 写回 frame->data 中 (小端模式)
+    for (int i = 0; i < 8; i++)
+    {
+        frame->data[i] = (data_value >> (i * 8)) & 0xFF;
+    }
+
+    return 1; // 更新成功
+}
+
 int update_data_bits(ControlFrame *frame, int start, int len, const char *content_str)
 {
     // 参数校验
-    start += 1;
-    if (frame == NULL || content_str == NULL || start < 0 || start > 64 || len < 1 || len > 64 ||
-        (start + len - 1) > 64 || strlen(content_str) != len)
+    if (frame == NULL || content_str == NULL || start < 0 || start > 63 || len < 1 || len > 64 ||
+        (start + len) > 64 || strlen(content_str) != len)
     {
         return 0; // 参数或输入内容无效，返回失败
     }
 
+    // content_str 高位在前，最后一个字符对应 start 位
+    uint64_t value = 0;
     for (int i = 0; i < len; i++)
     {
         if (content_str[i] != '0' && content_str[i] != '1')
         {
             return 0; // content_str 必须只包含 '0' 和 '1'
         }
+        value = (value << 1) | (uint64_t)(content_str[i] - '0');
     }
 
-    // 将 frame->data 转为 64 位整数 (小端模式)
-    unsigned long long data_value = 0;
+    return update_data_value(frame, start, len, value);
+}
+/**
+ * 查找匹配的控制帧，返回其索引（未找到返回 -1）
+ */
+int find_control_frame(UINT id)
+{
+    return find_frame_index(&frame_table, id);
+}
+/**
+ * 如果需要，则重新计算校验值
+ */
+void recalculate_checksum(const ControlFrame *frame, uint8_t *data)
+{
+    if (frame->checksum == CHECKSUM_XOR)
+    {
+        data[7] = calculate_xor(data, 7);
+    }
+}
+/**
+ * 按信号设置帧数据，信号位号与 lookup.yaml 相同（第0字节在最高位的大端64位整数）
+ */
+void update_signal_value(ControlFrame *frame, const SignalDef *signal, uint64_t raw)
+{
+    uint64_t payload = 0;
     for (int i = 0; i < 8; i++)
+        payload = (payload << 8) | frame->data[i];
+    int shift = 64 - signal->start_bit - signal->length;
+    uint64_t mask = (signal->length == 64) ? ~0ULL : (((1ULL << signal->length) - 1) << shift);
+    payload = (payload & ~mask) | ((raw << shift) & mask);
+    for (int i = 7; i >= 0; i--)
     {
-        data_value |= ((unsigned long long)frame->data[i] << (i * 8));
+        frame->data[i] = payload & 0xFF;
+        payload >>= 8;
+    }
+}
+/**
+ * 延迟追踪（默认关闭）
+ * 启动时设置环境变量 CAN_TRACE=<文件> 开启。客户端在指令前发送一行
+ * "trace <序号> <发送时刻us>"，随后的一条文本指令或一批二进制指令即被追踪，
+ * 依次记录读取、解析、更新帧、VCI_Transmit、回环接收的时刻（CLOCK_MONOTONIC 微秒），
+ * 完成后向文件写出一行：序号 ID 发送 读取 解析 更新 发送到总线 回环接收。
+ * 关闭时各处只多一次指针判断。
+ */
+#define TRACE_SLOTS 64
+#define TRACE_IDLE 0
+#define TRACE_WAIT_TRANSMIT 1
+#define TRACE_WAIT_RECEIVE 2
+typedef struct
+{
+    int active; // 下一条指令需要追踪
+    uint32_t seq;
+    uint64_t client_us;
+    uint64_t read_us; // 所在数据块的读取时刻
+    uint64_t parse_us;
+} TraceContext;
+typedef struct
+{
+    int state;
+    UINT id;
+    uint32_t seq;
+    uint64_t client_us, read_us, parse_us, update_us, transmit_us;
+} TraceSlot;
+FILE *trace_file = NULL; // NULL 表示未开启追踪
+TraceSlot trace_slots[TRACE_SLOTS];
+int trace_dropped = 0;
+pthread_mutex_t trace_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+/**
+ * 指令已更新到帧，登记一条等待发送的追踪记录（调用方持有 frame_mutex）
+ */
+void trace_update(TraceContext *trace, UINT id)
+{
+    uint64_t now = get_monotonic_time_us();
+    pthread_mutex_lock(&trace_mutex);
+    int i = 0;
+    while (i < TRACE_SLOTS && trace_slots[i].state != TRACE_IDLE)
+        i++;
+    if (i == TRACE_SLOTS)
+    {
+        trace_dropped++;
+    }
+    else
+    {
+        TraceSlot *slot = &trace_slots[i];
+        slot->state = TRACE_WAIT_TRANSMIT;
+        slot->id = id;
+        slot->seq = trace->seq;
+        slot->client_us = trace->client_us;
+        slot->read_us = trace->read_us;
+        slot->parse_us = trace->parse_us;
+        slot->update_us = now;
     }
+    pthread_mutex_unlock(&trace_mutex);
+}
 
-    // 更新指定位区间的内容
-    for (int i = 0; i < len; i++)
+/**
+ * 帧已调用 VCI_Transmit（发送线程在释放 frame_mutex 后调用）
+ */
+void trace_transmit(UINT id, uint64_t now)
+{
+    pthread_mutex_lock(&trace_mutex);
+    for (int i = 0; i < TRACE_SLOTS; i++)
     {
-        int bit_pos = start - 1 + i; // 将1基准的 start 转换为0基准
-        if (content_str[len - 1 - i] == '1')
-        {                                    // 注意 C 中字符串不允许反转直接操作
-            data_value |= (1ULL << bit_pos); // 设置为 1
-        }
-        else if (content_str[len - 1 - i] == '0')
+        if (trace_slots[i].state == TRACE_WAIT_TRANSMIT && trace_slots[i].id == id)
         {
-            data_value &= ~(1ULL << bit_pos); // 设置为 0
+            trace_slots[i].transmit_us = now;
+            trace_slots[i].state = TRACE_WAIT_RECEIVE;
         }
     }
+    pthread_mutex_unlock(&trace_mutex);
+}
 
-    // 将更新后的 data_value 写回 frame->data 中 (小端模式)
-    for (int i = 0; i < 8; i++)
+/**
+ * 接收线程收到一批报文，完成其中回环帧对应的追踪记录
+ */
+void trace_receive(const VCI_CAN_OBJ *can, int count)
+{
+    uint64_t now = get_monotonic_time_us();
+    pthread_mutex_lock(&trace_mutex);
+    for (int i = 0; i < TRACE_SLOTS; i++)
     {
-        frame->data[i] = (data_value >> (i * 8)) & 0xFF;
+        TraceSlot *slot = &trace_slots[i];
+        if (slot->state != TRACE_WAIT_RECEIVE)
+            continue;
+        for (int j = 0; j < count; j++)
+        {
+            if ((can[j].ID & 0x1fffffff) == slot->id)
+            {
+                fprintf(trace_file, "%u %x %llu %llu %llu %llu %llu %llu\n", slot->seq, slot->id,
+                        (unsigned long long)slot->client_us, (unsigned long long)slot->read_us,
+                        (unsigned long long)slot->parse_us, (unsigned long long)slot->update_us,
+                        (unsigned long long)slot->transmit_us, (unsigned long long)now);
+                slot->state = TRACE_IDLE;
+                break;
+            }
+        }
     }
-
-    return 1; // 更新成功
+    fflush(trace_file);
+    pthread_mutex_unlock(&trace_mutex);
 }
+
 /**
- * 查找匹配的控制帧，返回其索引（未找到返回 -1）
+ * 解析 "trace <序号> <发送时刻us>"，未开启追踪时忽略
  */
-int find_control_frame(UINT id)
+void parse_trace_line(const char *line, TraceContext *trace)
 {
-    for (int i = 0; i < FRAME_COUNT; i++)
+    unsigned int seq;
+    unsigned long long client_us;
+    if (trace_file == NULL || trace == NULL)
+        return;
+    if (sscanf(line, "trace %u %llu", &seq, &client_us) == 2)
     {
-        if (control_frames[i].id == id)
-        {
-            return i;
-        }
+        trace->active = 1;
+        trace->seq = seq;
+        trace->client_us = client_us;
     }
-    return -1;
 }
+
+/**
+ * 指令处理结果，作为应答发回客户端："ok" 或 "err <原因>"
+ */
+#define CMD_OK 0
+#define CMD_ERR_FORMAT 1
+#define CMD_ERR_UNKNOWN 2
+#define CMD_ERR_LENGTH 3
+#define CMD_ERR_FRAME 4
+#define CMD_ERR_RANGE 5
+#define CMD_ERR_SIGNAL 6
+const char *cmd_error_names[] = {"ok", "format", "unknown", "length", "frame", "range", "signal"};
+#define CMD_RESULTS (CMD_ERR_SIGNAL + 1)
+
+/**
+ * 运行指标
+ * 各线程用 GCC __atomic 内建函数（relaxed）累加计数器，不加锁；指标线程读取时同样只做
+ * relaxed 原子读取，因此读取指标不会阻塞收发线程，32位编译下64位计数也不会读到撕裂值。
+ * 各计数器之间不保证同一时刻的一致性，对累计计数与直方图足够。
+ * 直方图按 metric_bucket_us 分桶（不累积），输出时再转为累积计数。
+ */
+#define METRICS_SOCKET_PATH "/tmp/can_metrics_socket"
+#define METRIC_ADD(var, n) __atomic_fetch_add(&(var), (n), __ATOMIC_RELAXED)
+#define METRIC_SUB(var, n) __atomic_fetch_sub(&(var), (n), __ATOMIC_RELAXED)
+#define METRIC_GET(var) __atomic_load_n(&(var), __ATOMIC_RELAXED)
+#define METRIC_SET(var, v) __atomic_store_n(&(var), (v), __ATOMIC_RELAXED)
+#define METRIC_BUCKETS 10
+static const uint64_t metric_bucket_us[METRIC_BUCKETS] = {50, 100, 200, 500, 1000,
+                                                          2000, 5000, 10000, 20000, 50000};
+typedef struct
+{
+    uint64_t buckets[METRIC_BUCKETS + 1]; // 最后一个桶为 +Inf
+    uint64_t sum;
+    uint64_t count;
+} Histogram;
+
+// VCI_ReadErrInfo 错误码的分类
+#define CAN_ERROR_KINDS 6
+static const UINT can_error_bits[CAN_ERROR_KINDS] = {
+    ERR_CAN_OVERFLOW, ERR_BUFFEROVERFLOW, ERR_CAN_ERRALARM, ERR_CAN_PASSIVE, ERR_CAN_LOSE,
+    ERR_CAN_BUSERR};
+static const char *can_error_names[CAN_ERROR_KINDS] = {
+    "controller_overflow", "buffer_overflow", "error_warning", "error_passive",
+    "arbitration_lost", "bus_error"};
+
+typedef struct
+{
+    uint64_t rx_frames[MAX_CHANNELS];
+    uint64_t rx_bits[MAX_CHANNELS];       // 按帧格式估算的总线位数（不含位填充）
+    uint64_t rx_reads[MAX_CHANNELS];      // 读到报文的 VCI_Receive 次数
+    uint64_t rx_full_reads[MAX_CHANNELS]; // 一次读满 RX_BUFF_SIZE，设备缓冲区有积压
+    uint64_t rx_errors[MAX_CHANNELS];     // VCI_Receive 返回 -1
+    uint64_t can_errors[MAX_CHANNELS][CAN_ERROR_KINDS];
+    Histogram rx_latency[MAX_CHANNELS];   // 设备时间戳映射后的接收延迟
+    uint64_t tx_frames[MAX_CHANNELS];
+    uint64_t tx_bits[MAX_CHANNELS];
+    uint64_t tx_failed[MAX_CHANNELS];     // VCI_Transmit 未发出的帧数
+    Histogram send_lateness;              // 控制帧实际发送时刻晚于截止时刻的量
+    uint64_t commands[CMD_RESULTS];       // 文本指令按处理结果计数
+    uint64_t binary_batches;
+    uint64_t binary_records;
+    uint64_t binary_invalid;
+    uint64_t acks_dropped;
+    uint64_t command_clients;
+    uint64_t subscribers;
+    uint64_t sub_delivered;
+    uint64_t sub_dropped;              // 订阅者环形缓冲区满时丢弃的帧
+    uint64_t sub_write_errors;         // 写订阅者套接字失败
+    uint64_t sub_overflow_disconnects; // 按 disconnect 策略断开的订阅者
+} Metrics;
+Metrics metrics;
+uint64_t metrics_start_us;
+int metrics_bitrate; // 总线波特率（bit/s），未知为0
+int metrics_fd = -1;  // 指标套接字
+
+static void histogram_observe(Histogram *h, uint64_t value)
+{
+    int i = 0;
+    while (i < METRIC_BUCKETS && value > metric_bucket_us[i])
+        i++;
+    METRIC_ADD(h->buckets[i], 1);
+    METRIC_ADD(h->sum, value);
+    METRIC_ADD(h->count, 1);
+}
+
+/**
+ * 一帧在总线上占用的位数：帧头、CRC、应答、帧尾与3位帧间隔，不含位填充
+ */
+static uint64_t can_frame_bits(const VCI_CAN_OBJ *can)
+{
+    int data_bits = can->RemoteFlag ? 0 : 8 * min(can->DataLen, 8);
+    return (can->ExternFlag ? 67 : 47) + data_bits;
+}
+
+static uint64_t can_frames_bits(const VCI_CAN_OBJ *can, int count)
+{
+    uint64_t bits = 0;
+    for (int i = 0; i < count; i++)
+        bits += can_frame_bits(&can[i]);
+    return bits;
+}
+
 /**
- * 如果需要，则重新计算异或值
+ * "set <信号名> <物理值>"：按配置中的信号定义换算为原始值后写入所在帧
  */
-void recalculate_xor(UINT id, uint8_t *data)
+int process_set_command(char *cmd, TraceContext *trace)
 {
-    if (id == ESP_COMMAND || id == SPEED_COMMAND)
+    char *save = NULL;
+    strtok_r(cmd, " ", &save);
+    char *name = strtok_r(NULL, " ", &save);
+    char *value_str = strtok_r(NULL, " ", &save);
+    char *end;
+    if (name == NULL || value_str == NULL || strtok_r(NULL, " ", &save) != NULL)
     {
-        data[7] = calculate_xor(data, 7);
+        printf("指令格式错误。\n");
+        return CMD_ERR_FORMAT;
+    }
+    double value = strtod(value_str, &end);
+    if (end == value_str || *end != '\0')
+    {
+        printf("指令格式错误。\n");
+        return CMD_ERR_FORMAT;
+    }
+    int signal_index = find_signal_index(&frame_table, name);
+    if (signal_index == -1)
+    {
+        printf("未找到信号 %s。\n", name);
+        return CMD_ERR_SIGNAL;
+    }
+    const SignalDef *signal = &frame_table.signals[signal_index];
+    int traced = trace != NULL && trace->active;
+    if (traced)
+    {
+        trace->active = 0;
+        trace->parse_us = get_monotonic_time_us();
     }
+    double raw = round((value - signal->offset) / signal->factor);
+    // nan 与 inf 不满足任何比较，必须先排除；上界取 2^length，转换为 uint64_t 前保证在范围内
+    if (!isfinite(value) || !isfinite(raw) || raw < 0 || raw >= ldexp(1.0, signal->length))
+    {
+        printf("数据超出范围。\n");
+        return CMD_ERR_RANGE;
+    }
+    pthread_mutex_lock(&frame_mutex);
+    ControlFrame *frame = &control_frames[signal->frame_index];
+    update_signal_value(frame, signal, (uint64_t)raw);
+    recalculate_checksum(frame, frame->temp_data);
+    frame->modified = 1;
+    if (traced)
+        trace_update(trace, frame->id);
+    pthread_mutex_unlock(&frame_mutex);
+    return CMD_OK;
 }
-void process_command(char *cmd)
+
+int process_command(char *cmd, TraceContext *trace)
 {
+    if (strncmp(cmd, "set ", 4) == 0)
+        return process_set_command(cmd, trace);
     // 提取并解析命令
     char *tokens[5]; // 静态分配存储分割后的5段命令
     if (!parse_command(cmd, tokens, 5))
     {
         printf("指令格式错误。\n");
-        return;
+        return CMD_ERR_FORMAT;
     }
     // 校验前缀是否为 "send"
     if (strcmp(tokens[0], "send") != 0)
     {
         printf("未知指令。\n");
-        return;
+        return CMD_ERR_UNKNOWN;
     }
     // 提取命令参数
     UINT id = strtoul(tokens[1], NULL, 0);
+    int traced = trace != NULL && trace->active;
+    if (traced)
+    {
+        trace->active = 0;
+        trace->parse_us = get_monotonic_time_us();
+    }
     int start = atoi(tokens[2]);
     int len = atoi(tokens[3]);
     char *content_str = tokens[4];
@@ -244,7 +593,7 @@ void process_command(char *cmd)
     if (content_len != len)
     {
         printf("数据长度与声明长度不匹配。\n");
-        return;
+        return CMD_ERR_LENGTH;
     }
     // 进入线程锁保护
     pthread_mutex_lock(&frame_mutex);
@@ -254,19 +603,21 @@ void process_command(char *cmd)
     {
         pthread_mutex_unlock(&frame_mutex);
         printf("未找到对应控制帧。\n");
-        return;
+        return CMD_ERR_FRAME;
     }
     if (!update_data_bits(&control_frames[frame_index], start, len,
                           content_str))
     {
         pthread_mutex_unlock(&frame_mutex);
         printf("数据超出范围。\n");
-        return;
+        return CMD_ERR_RANGE;
     }
     // 如果需要重新计算异或值
-    recalculate_xor(id, control_frames[frame_index].temp_data);
+    recalculate_checksum(&control_frames[frame_index], control_frames[frame_index].temp_data);
     // 标记帧已修改
     control_frames[frame_index].modified = 1;
+    if (traced)
+        trace_update(trace, id);
     // 输出调试信息
     //   printf("id: %X, data: ", id);
     //   for (int j = 0; j < 8; j++) {
@@ -275,206 +626,1048 @@ void process_command(char *cmd)
     //   printf("\n");
 
     pthread_mutex_unlock(&frame_mutex);
+    return CMD_OK;
 }
 
-volatile int server_running = 1; // 使用信号量或其他方式控制退出
+/**
+ * 二进制批量指令
+ * 批头 4 字节：magic(0xB1) version(1) count(uint16 小端)
+ * 之后 count 条 16 字节记录：id(uint32) start_bit(uint8) length(uint8)
+ * reserved(uint16) value(uint64)，均为小端；value 的最低位写入 start_bit。
+ * 文本指令总以字母开头，因此首字节为 magic 即可区分两种协议。
+ */
+#define BIN_MAGIC 0xB1
+#define BIN_VERSION 1
+#define BIN_HEADER_SIZE 4
+#define BIN_RECORD_SIZE 16
+#define BIN_MAX_RECORDS 255
+#define CMD_BUFF_SIZE (BIN_HEADER_SIZE + BIN_MAX_RECORDS * BIN_RECORD_SIZE + 12)
 
-void *command_thread(void *data)
+static uint32_t read_le32(const uint8_t *p)
 {
-    RX_CTX *ctx = (RX_CTX *)data;
-
-    while (server_running)
-    {
-        struct sockaddr_un client_addr;
-        socklen_t client_len = sizeof(client_addr);
-        int client_fd =
-            accept(server_fd, (struct sockaddr *)&client_addr, &client_len);
-        if (client_fd < 0)
-        {
-            perror("accept error");
-            if (!server_running)
-                break; // 如果服务关闭，退出循环
-            continue;
-        }
-        printf("客户端已连接。\n");
-        char buffer[256];
-        while (server_running)
-        {
-            ssize_t n = read(client_fd, buffer, sizeof(buffer) - 1);
-            if (n <= 0)
-            {
-                if (n < 0)
-                    perror("read error");
-                else
-                    printf("客户端断开连接。\n");
-                close(client_fd);
-                break;
-            }
-            process_command(buffer); // 调用处理指令的逻辑
-            msleep(1);
-        }
-    }
+    return (uint32_t)p[0] | ((uint32_t)p[1] << 8) | ((uint32_t)p[2] << 16) |
+           ((uint32_t)p[3] << 24);
+}
 
-    return NULL;
+static uint64_t read_le64(const uint8_t *p)
+{
+    return (uint64_t)read_le32(p) | ((uint64_t)read_le32(p + 4) << 32);
 }
 
-void update_heartbeat_and_xor(ControlFrame *frame)
+/**
+ * 在一次加锁内应用整批二进制指令，返回成功应用的条数
+ */
+int process_binary_batch(const uint8_t *records, int count, TraceContext *trace)
 {
-    if (frame->id == ESP_COMMAND)
+    int applied = 0;
+    int traced = trace != NULL && trace->active;
+    if (traced)
     {
-        frame->data[1] = (frame->data[1] + 1) & 0xFF;
-        frame->data[7] = calculate_xor(frame->data, 7);
-        frame->temp_data[1] = (frame->temp_data[1] + 1) & 0xFF;
-        frame->temp_data[7] = calculate_xor(frame->temp_data, 7);
+        trace->active = 0;
+        trace->parse_us = get_monotonic_time_us();
     }
-    else if (frame->id == SPEED_COMMAND)
+    int touched[BIN_MAX_RECORDS];
+    int touched_count = 0;
+    pthread_mutex_lock(&frame_mutex);
+    for (int i = 0; i < count; i++)
     {
-        frame->data[2] = (frame->data[2] + 1) & 0xFF;
-        frame->data[7] = calculate_xor(frame->data, 7);
-        frame->temp_data[2] = (frame->temp_data[2] + 1) & 0xFF;
-        frame->temp_data[7] = calculate_xor(frame->temp_data, 7);
+        const uint8_t *rec = records + i * BIN_RECORD_SIZE;
+        int frame_index = find_control_frame(read_le32(rec));
+        if (frame_index == -1 ||
+            !update_data_value(&control_frames[frame_index], rec[4], rec[5], read_le64(rec + 8)))
+        {
+            continue;
+        }
+        if (!control_frames[frame_index].touched)
+        {
+            control_frames[frame_index].touched = 1;
+            touched[touched_count++] = frame_index;
+        }
+        applied++;
     }
-    else if (frame->id == LIGHT_COMMAND)
+    // 每个被修改的帧只重新计算一次校验值
+    for (int i = 0; i < touched_count; i++)
     {
-        frame->data[7] = (frame->data[7] + 1) & 0xFF;
-        frame->temp_data[7] = (frame->temp_data[7] + 1) & 0xFF;
+        ControlFrame *frame = &control_frames[touched[i]];
+        frame->touched = 0;
+        recalculate_checksum(frame, frame->temp_data);
+        frame->modified = 1;
+        if (traced)
+            trace_update(trace, frame->id);
     }
-    else if (frame->id == REMOTE_COMMAND)
+    pthread_mutex_unlock(&frame_mutex);
+    if (applied != count)
     {
-        frame->data[7] = (frame->data[7] + 1) & 0xFF;
-        frame->temp_data[7] = (frame->temp_data[7] + 1) & 0xFF;
+        printf("二进制指令中有 %d 条无效。\n", count - applied);
     }
+    return applied;
 }
 
 /**
- * 主发送循环线程
+ * 一次读取所产生的应答，处理完后一次写回客户端
  */
-void *send_void_loop_frame_thread(void *arg)
+#define ACK_BUFF_SIZE 8192
+typedef struct
 {
-    RX_CTX *ctx = (RX_CTX *)arg;
-    VCI_CAN_OBJ can[RX_BUFF_SIZE]; // 接收结构体
-    uint64_t current_time_ms = get_current_time_ms();
-    pthread_mutex_lock(&frame_mutex);
-    for (int i = 0; i < FRAME_COUNT; i++)
-    {
-        control_frames[i].next_send_time =
-            current_time_ms + control_frames[i].interval_ms;
-    }
-    pthread_mutex_unlock(&frame_mutex);
-    while (server_running)
-    {
-        uint64_t current_time_ms = get_current_time_ms();
-        pthread_mutex_lock(&frame_mutex);
-        // 生成临时帧（控制帧的拷贝，可被临时修改）
+    char data[ACK_BUFF_SIZE];
+    int len;
+} AckBuffer;
 
-        for (int i = 0; i < FRAME_COUNT; i++)
+static void ack_append(AckBuffer *acks, const char *fmt, ...)
+{
+    if (acks == NULL)
+        return;
+    va_list args;
+    va_start(args, fmt);
+    int n = vsnprintf(acks->data + acks->len, ACK_BUFF_SIZE - acks->len, fmt, args);
+    va_end(args);
+    if (n > 0 && acks->len + n < ACK_BUFF_SIZE)
+        acks->len += n;
+}
+
+/**
+ * 处理缓冲区中所有完整的指令（文本按换行分帧，二进制按批头长度分帧），
+ * 每条指令在 acks 中追加一行应答：文本指令 "ok" 或 "err <原因>"，
+ * 二进制批量指令 "ok <条数>" 或 "err invalid <无效条数>/<条数>"；追踪行没有应答。
+ * 不完整的部分移到缓冲区开头等待下次读取，返回剩余字节数
+ */
+int consume_commands(char *buffer, int len, TraceContext *trace, AckBuffer *acks)
+{
+    int pos = 0;
+    while (pos < len)
+    {
+        uint8_t *p = (uint8_t *)buffer + pos;
+        int remain = len - pos;
+        if (p[0] == BIN_MAGIC)
         {
-            ControlFrame *frame = &control_frames[i];
-            if (current_time_ms >= frame->next_send_time - 1)
+            if (remain < BIN_HEADER_SIZE)
+                break;
+            int count = p[2] | (p[3] << 8);
+            if (p[1] != BIN_VERSION || count > BIN_MAX_RECORDS)
             {
-                // 更新心跳值
-                update_heartbeat_and_xor(frame);
-
-                // 发送控制帧
-                VCI_CAN_OBJ can_obj[1];
-                memset(&can_obj, 0, sizeof(can_obj));
-                can_obj[0].ID = frame->id;
-                can_obj[0].ExternFlag = 1;
-                can_obj[0].SendType = 2;
-                can_obj[0].RemoteFlag = 0;
-                can_obj[0].DataLen = 8;
-                if (frame->modified)
-                {
-                    memcpy(can_obj[0].Data, frame->temp_data, 8);
-                    frame->modified = 0; // 重置标志位
-                    memcpy(frame->temp_data, frame->data, 8);
-                }
-                else
-                {
-                    memcpy(can_obj[0].Data, frame->data, 8);
-                }
-                int sig = VCI_Transmit(ctx->DevType, ctx->DevIdx, 1, can_obj, 1);
-                frame->next_send_time += frame->interval_ms;
-                if (frame->next_send_time < current_time_ms)
-                {
-                    frame->next_send_time = current_time_ms + frame->interval_ms;
-                }
+                printf("二进制指令头无效，丢弃缓冲区。\n");
+                METRIC_ADD(metrics.commands[CMD_ERR_FORMAT], 1);
+                ack_append(acks, "err header\n");
+                return 0;
+            }
+            int size = BIN_HEADER_SIZE + count * BIN_RECORD_SIZE;
+            if (remain < size)
+                break;
+            int applied = process_binary_batch(p + BIN_HEADER_SIZE, count, trace);
+            METRIC_ADD(metrics.binary_batches, 1);
+            METRIC_ADD(metrics.binary_records, count);
+            METRIC_ADD(metrics.binary_invalid, count - applied);
+            if (applied == count)
+                ack_append(acks, "ok %d\n", count);
+            else
+                ack_append(acks, "err invalid %d/%d\n", count - applied, count);
+            pos += size;
+            continue;
+        }
+        char *newline = (char *)memchr(buffer + pos, '\n', remain);
+        if (newline == NULL)
+        {
+            if (remain == CMD_BUFF_SIZE - 1)
+            {
+                printf("指令过长，丢弃。\n");
+                METRIC_ADD(metrics.commands[CMD_ERR_FORMAT], 1);
+                ack_append(acks, "err overflow\n");
+                return 0;
             }
+            break;
         }
-        pthread_mutex_unlock(&frame_mutex);
-        msleep(1); // 休眠1ms，避免占用过多CPU
+        *newline = '\0';
+        if (newline > buffer + pos && newline[-1] == '\r')
+            newline[-1] = '\0';
+        if (strncmp(buffer + pos, "trace ", 6) == 0)
+            parse_trace_line(buffer + pos, trace);
+        else if (newline > buffer + pos)
+        {
+            int ret = process_command(buffer + pos, trace); // 调用处理指令的逻辑
+            METRIC_ADD(metrics.commands[ret], 1);
+            if (ret == CMD_OK)
+                ack_append(acks, "ok\n");
+            else
+                ack_append(acks, "err %s\n", cmd_error_names[ret]);
+        }
+        pos = newline - buffer + 1;
     }
-    return NULL;
+    memmove(buffer, buffer + pos, len - pos);
+    return len - pos;
 }
-void *rx_thread(void *data)
+
+volatile int server_running = 1; // 使用信号量或其他方式控制退出
+
+/**
+ * 指令通道客户端
+ * 每个连接独立缓存未完成的指令与追踪上下文，应答以非阻塞方式写回；
+ * 不读取应答的客户端缓冲区满后，其应答被丢弃，不影响指令处理。
+ */
+#define MAX_COMMAND_CLIENTS 32
+typedef struct
 {
-    RX_CTX *ctx = (RX_CTX *)data;
-    int DevType = ctx->DevType;
-    int DevIdx = ctx->DevIdx;
-    int chn_idx = ctx->index;
+    int fd;
+    int buffered;
+    char buffer[CMD_BUFF_SIZE];
+    TraceContext trace;
+    uint64_t acks_dropped;
+} CommandClient;
 
-    VCI_CAN_OBJ can[RX_BUFF_SIZE]; // 接收结构体
-    int cnt = 0;                   // 接收数量
-    int count = 0;                 // 缓冲区报文数量
+static void close_command_client(CommandClient *client)
+{
+    printf("客户端断开连接（应答写入失败 %llu 次）。\n", (unsigned long long)client->acks_dropped);
+    close(client->fd);
+    client->fd = -1;
+    METRIC_SUB(metrics.command_clients, 1);
+}
 
-    while (!ctx->stop && server_running)
+/**
+ * 处理一次可读事件，返回 -1 表示连接已关闭
+ */
+static int serve_command_client(CommandClient *client, AckBuffer *acks)
+{
+    ssize_t n = read(client->fd, client->buffer + client->buffered,
+                     sizeof(client->buffer) - 1 - client->buffered);
+    if (n < 0 && (errno == EAGAIN || errno == EINTR))
+        return 0;
+    if (n <= 0)
+    {
+        if (n < 0)
+            perror("read error");
+        close_command_client(client);
+        return -1;
+    }
+    if (trace_file != NULL)
+        client->trace.read_us = get_monotonic_time_us();
+    // 一次读取可能包含多条或半条指令，按分帧规则逐条处理
+    acks->len = 0;
+    client->buffered = consume_commands(client->buffer, client->buffered + n, &client->trace, acks);
+    if (acks->len > 0)
     {
-        memset(can, 0, sizeof(can));
-        count =
-            VCI_GetReceiveNum(DevType, DevIdx, ctx->index); // 获取缓冲区报文数量
-        if (count > 0)
+        ssize_t written = send(client->fd, acks->data, acks->len, MSG_DONTWAIT | MSG_NOSIGNAL);
+        if (written < acks->len)
         {
-            int rcount = VCI_Receive(DevType, DevIdx, ctx->index, can, RX_BUFF_SIZE,
-                                     RX_WAIT_TIME); // 读报文
-            for (int i = 0; i < rcount; i++)
-            {
-                // 将数据发送给64位程序
-                time_t now = time(NULL);
-                can[i].TimeStamp = (int)now;
-                char send_buffer[256];
-                snprintf(send_buffer, sizeof(send_buffer),
-                         "time:%d id:0x%x data:", can[i].TimeStamp,
-                         can[i].ID & 0x1fffffff);
-                for (int j = 0; j < can[i].DataLen; j++)
-                {
-                    char byte_str[4];
-                    snprintf(byte_str, sizeof(byte_str), "%02X", can[i].Data[j]);
-                    strncat(send_buffer, byte_str,
-                            sizeof(send_buffer) - strlen(send_buffer) - 1);
-                }
-                strncat(send_buffer, "\n",
-                        sizeof(send_buffer) - strlen(send_buffer) - 1);
-                for (int i = 0; i < sizeof(send_buffer); i++)
-                {
-                    // printf("%c", send_buffer[i]); // 使用 %c 格式化输出单个字符
-                }
-
-                if (client_read_fd > 0)
-                {
-                    int ret = write(client_read_fd, send_buffer, strlen(send_buffer));
-                    if (ret <= 0)
-                    {
-                        perror("write error");
-                        close(client_read_fd);
-                        client_read_fd = -1;
-                    }
-                }
-            }
+            client->acks_dropped++;
+            METRIC_ADD(metrics.acks_dropped, 1);
         }
-        msleep(10);
     }
-    pthread_exit(0);
+    return 0;
 }
 
-void stop_command(RX_CTX rx_ctx[2], pthread_t rx_threads[2], int DevType, int DevIdx, pthread_t cmd_thread, pthread_t send_thread)
+/**
+ * 指令线程：用 poll 同时服务监听套接字与所有已连接的客户端
+ */
+void *command_thread(void *data)
 {
+    static CommandClient clients[MAX_COMMAND_CLIENTS];
+    static AckBuffer acks;
+    struct pollfd fds[MAX_COMMAND_CLIENTS + 1];
+    int owners[MAX_COMMAND_CLIENTS + 1]; // fds 下标对应的 clients 下标
+    for (int i = 0; i < MAX_COMMAND_CLIENTS; i++)
+        clients[i].fd = -1;
 
-    control_frames[2].data[0] = 0x00;
-    control_frames[2].data[4] = 0x00;
-    for (int i = 0; i < MAX_CHANNELS; i++)
+    while (server_running)
     {
-        rx_ctx[i].stop = 1;                // 标记线程需要停止
-        pthread_join(rx_threads[i], NULL); // 等待线程退出
+        int nfds = 0;
+        fds[nfds].fd = server_fd;
+        fds[nfds].events = POLLIN;
+        owners[nfds++] = -1;
+        for (int i = 0; i < MAX_COMMAND_CLIENTS; i++)
+        {
+            if (clients[i].fd < 0)
+                continue;
+            fds[nfds].fd = clients[i].fd;
+            fds[nfds].events = POLLIN;
+            owners[nfds++] = i;
+        }
+        int ready = poll(fds, nfds, 100);
+        if (ready < 0)
+        {
+            if (errno != EINTR)
+                perror("poll error");
+            continue;
+        }
+        for (int k = 1; k < nfds && ready > 0; k++)
+        {
+            if (fds[k].revents == 0)
+                continue;
+            ready--;
+            serve_command_client(&clients[owners[k]], &acks);
+        }
+        if (fds[0].revents & POLLIN)
+        {
+            struct sockaddr_un client_addr;
+            socklen_t client_len = sizeof(client_addr);
+            int client_fd = accept(server_fd, (struct sockaddr *)&client_addr, &client_len);
+            if (client_fd < 0)
+            {
+                perror("accept error");
+                continue;
+            }
+            int slot = -1;
+            for (int i = 0; i < MAX_COMMAND_CLIENTS; i++)
+            {
+                if (clients[i].fd < 0)
+                {
+                    slot = i;
+                    break;
+                }
+            }
+            if (slot < 0)
+            {
+                printf("指令通道客户端已满（%d），拒绝连接。\n", MAX_COMMAND_CLIENTS);
+                close(client_fd);
+                continue;
+            }
+            memset(&clients[slot], 0, sizeof(CommandClient));
+            clients[slot].fd = client_fd;
+            METRIC_ADD(metrics.command_clients, 1);
+            printf("客户端已连接（槽位 %d）。\n", slot);
+        }
+    }
+
+    for (int i = 0; i < MAX_COMMAND_CLIENTS; i++)
+    {
+        if (clients[i].fd >= 0)
+            close(clients[i].fd);
+    }
+    return NULL;
+}
+
+void update_heartbeat_and_xor(ControlFrame *frame)
+{
+    if (frame->heartbeat_byte >= 0)
+    {
+        frame->data[frame->heartbeat_byte] = (frame->data[frame->heartbeat_byte] + 1) & 0xFF;
+        frame->temp_data[frame->heartbeat_byte] =
+            (frame->temp_data[frame->heartbeat_byte] + 1) & 0xFF;
+    }
+    recalculate_checksum(frame, frame->data);
+    recalculate_checksum(frame, frame->temp_data);
+}
+
+/**
+ * 发送调度：按 CLOCK_MONOTONIC 绝对截止时刻组织的最小堆（堆顶为最早到期的帧），
+ * 发送线程睡眠到堆顶的截止时刻，醒来后把 SCHED_BATCH_US 内到期的帧一起取出，
+ * 加锁只复制载荷快照，解锁后按通道各调用一次 VCI_Transmit。
+ * 堆与 next_send_time 只由发送线程访问。
+ */
+#define SCHED_BATCH_US 200 // 同一次唤醒内一起发送的提前量
+#define SCHED_MISS_US 1000 // 晚于截止时刻超过该值计为错过（与 checkright 的周期容差一致）
+#define SCHED_MAX_SLEEP_US 100000
+
+// 每个控制帧的调度统计，只由发送线程写入（原子写入，指标线程可随时读取）
+typedef struct
+{
+    uint64_t sent;
+    uint64_t missed;             // 晚于截止时刻超过 SCHED_MISS_US 的次数
+    uint64_t skipped;            // 整周期未能发送而跳过的次数
+    uint64_t transmit_failed;    // VCI_Transmit 未发出的帧数
+    int64_t lateness_max_us;     // 实际发送时刻与截止时刻之差的最大绝对值
+    uint64_t lateness_sum_us;
+    uint64_t last_sent_us;
+    int64_t period_error_max_us; // 相邻两次发送间隔与周期之差的最大绝对值
+} FrameSchedStats;
+FrameSchedStats *sched_stats = NULL;
+
+static int sched_before(int a, int b)
+{
+    if (control_frames[a].next_send_time != control_frames[b].next_send_time)
+        return control_frames[a].next_send_time < control_frames[b].next_send_time;
+    return a < b;
+}
+
+static void sched_sift_down(int *heap, int count, int pos)
+{
+    while (1)
+    {
+        int smallest = pos;
+        int left = 2 * pos + 1;
+        int right = left + 1;
+        if (left < count && sched_before(heap[left], heap[smallest]))
+            smallest = left;
+        if (right < count && sched_before(heap[right], heap[smallest]))
+            smallest = right;
+        if (smallest == pos)
+            return;
+        int tmp = heap[pos];
+        heap[pos] = heap[smallest];
+        heap[smallest] = tmp;
+        pos = smallest;
+    }
+}
+
+static void sched_sleep_until(uint64_t deadline_us)
+{
+    struct timespec ts;
+    ts.tv_sec = deadline_us / 1000000;
+    ts.tv_nsec = (deadline_us % 1000000) * 1000;
+    while (clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &ts, NULL) == EINTR)
+        ;
+}
+
+/**
+ * 记录一次发送的调度统计，并把截止时刻推进到下一个周期
+ */
+static void sched_account(int index, uint64_t sent_us)
+{
+    ControlFrame *frame = &control_frames[index];
+    FrameSchedStats *stats = &sched_stats[index];
+    uint64_t interval_us = (uint64_t)frame->interval_ms * 1000;
+    int64_t lateness = (int64_t)(sent_us - frame->next_send_time);
+    int64_t magnitude = lateness < 0 ? -lateness : lateness;
+    METRIC_ADD(stats->sent, 1);
+    METRIC_ADD(stats->lateness_sum_us, magnitude);
+    if (magnitude > stats->lateness_max_us)
+        METRIC_SET(stats->lateness_max_us, magnitude);
+    if (lateness > SCHED_MISS_US)
+        METRIC_ADD(stats->missed, 1);
+    histogram_observe(&metrics.send_lateness, lateness > 0 ? lateness : 0);
+    if (stats->last_sent_us != 0)
+    {
+        int64_t error = (int64_t)(sent_us - stats->last_sent_us) - (int64_t)interval_us;
+        if (error < 0)
+            error = -error;
+        if (error > stats->period_error_max_us)
+            METRIC_SET(stats->period_error_max_us, error);
+    }
+    stats->last_sent_us = sent_us;
+    // 保持相位：落后整周期时跳过，而不是连续补发
+    frame->next_send_time += interval_us;
+    while (frame->next_send_time + SCHED_MISS_US < sent_us)
+    {
+        frame->next_send_time += interval_us;
+        METRIC_ADD(stats->skipped, 1);
+    }
+}
+
+void print_sched_stats()
+{
+    if (sched_stats == NULL)
+        return;
+    printf("%-10s %8s %6s %6s %6s %10s %10s %10s\n", "帧ID", "发送", "错过", "跳过", "失败",
+           "平均偏差us", "最大偏差us", "周期误差us");
+    for (int i = 0; i < frame_count; i++)
+    {
+        FrameSchedStats *stats = &sched_stats[i];
+        printf("%-10X %8llu %6llu %6llu %6llu %10llu %10lld %10lld\n", control_frames[i].id,
+               (unsigned long long)stats->sent, (unsigned long long)stats->missed,
+               (unsigned long long)stats->skipped, (unsigned long long)stats->transmit_failed,
+               (unsigned long long)(stats->sent ? stats->lateness_sum_us / stats->sent : 0),
+               (long long)stats->lateness_max_us, (long long)stats->period_error_max_us);
+    }
+}
+
+/**
+ * 主发送循环线程
+ */
+void *send_void_loop_frame_thread(void *arg)
+{
+    RX_CTX *ctx = (RX_CTX *)arg;
+    static int heap[MAX_CONTROL_FRAMES];
+    static int due[MAX_CONTROL_FRAMES];
+    static VCI_CAN_OBJ batch[MAX_CONTROL_FRAMES];
+    static int traced[MAX_CONTROL_FRAMES]; // 本次发出的是 data，需要记录追踪
+    uint64_t start_us = get_monotonic_time_us();
+    for (int i = 0; i < frame_count; i++)
+    {
+        control_frames[i].next_send_time = start_us + (uint64_t)control_frames[i].interval_ms * 1000;
+        heap[i] = i;
+    }
+    for (int i = frame_count / 2 - 1; i >= 0; i--)
+        sched_sift_down(heap, frame_count, i);
+
+    while (server_running && frame_count > 0)
+    {
+        uint64_t now = get_monotonic_time_us();
+        uint64_t deadline = control_frames[heap[0]].next_send_time;
+        if (deadline > now + SCHED_BATCH_US)
+        {
+            sched_sleep_until(min(deadline, now + SCHED_MAX_SLEEP_US));
+            continue;
+        }
+
+        // 取出本次到期的帧，按通道排序（插入排序，保持截止时刻顺序）
+        int due_count = 0;
+        while (control_frames[heap[0]].next_send_time <= now + SCHED_BATCH_US && due_count < frame_count)
+        {
+            int index = heap[0];
+            int pos = due_count++;
+            while (pos > 0 && control_frames[due[pos - 1]].channel > control_frames[index].channel)
+            {
+                due[pos] = due[pos - 1];
+                pos--;
+            }
+            due[pos] = index;
+            // 暂时移到堆底，推进截止时刻后再整体重建
+            heap[0] = heap[frame_count - due_count];
+            heap[frame_count - due_count] = index;
+            sched_sift_down(heap, frame_count - due_count, 0);
+        }
+
+        // 加锁只更新心跳/校验并复制载荷
+        pthread_mutex_lock(&frame_mutex);
+        for (int k = 0; k < due_count; k++)
+        {
+            ControlFrame *frame = &control_frames[due[k]];
+            update_heartbeat_and_xor(frame);
+            VCI_CAN_OBJ *can_obj = &batch[k];
+            memset(can_obj, 0, sizeof(VCI_CAN_OBJ));
+            can_obj->ID = frame->id;
+            can_obj->ExternFlag = 1;
+            can_obj->SendType = 2;
+            can_obj->RemoteFlag = 0;
+            can_obj->DataLen = 8;
+            // 指令写入的是 data；modified 时本次发出的是旧的 temp_data
+            traced[k] = !frame->modified;
+            if (frame->modified)
+            {
+                memcpy(can_obj->Data, frame->temp_data, 8);
+                frame->modified = 0; // 重置标志位
+                memcpy(frame->temp_data, frame->data, 8);
+            }
+            else
+            {
+                memcpy(can_obj->Data, frame->data, 8);
+            }
+        }
+        pthread_mutex_unlock(&frame_mutex);
+
+        // 同一通道的帧合并为一次 VCI_Transmit
+        for (int k = 0; k < due_count;)
+        {
+            int channel = control_frames[due[k]].channel;
+            int run = 1;
+            while (k + run < due_count && control_frames[due[k + run]].channel == channel)
+                run++;
+            uint64_t sent_us = get_monotonic_time_us();
+            int sent = VCI_Transmit(ctx->DevType, ctx->DevIdx, channel, &batch[k], run);
+            if (sent < 0)
+                sent = 0;
+            if (channel >= 0 && channel < MAX_CHANNELS)
+            {
+                METRIC_ADD(metrics.tx_frames[channel], sent);
+                METRIC_ADD(metrics.tx_bits[channel], can_frames_bits(&batch[k], sent));
+                METRIC_ADD(metrics.tx_failed[channel], run - sent);
+            }
+            for (int j = k; j < k + run; j++)
+            {
+                if (j - k >= sent)
+                    METRIC_ADD(sched_stats[due[j]].transmit_failed, 1);
+                if (trace_file != NULL && traced[j])
+                    trace_transmit(control_frames[due[j]].id, sent_us);
+                sched_account(due[j], sent_us);
+            }
+            k += run;
+        }
+
+        // 已推进的帧位于堆尾，逐个上浮归位
+        for (int count = frame_count - due_count; count < frame_count; count++)
+        {
+            int pos = count;
+            while (pos > 0 && sched_before(heap[pos], heap[(pos - 1) / 2]))
+            {
+                int parent = (pos - 1) / 2;
+                int tmp = heap[pos];
+                heap[pos] = heap[parent];
+                heap[parent] = tmp;
+                pos = parent;
+            }
+        }
+    }
+    return NULL;
+}
+/**
+ * 向接收通道客户端写出整块数据，处理部分写入，失败时关闭连接
+ */
+int write_all(int fd, const char *buf, size_t len)
+{
+    while (len > 0)
+    {
+        ssize_t ret = write(fd, buf, len);
+        if (ret < 0 && errno == EINTR)
+            continue;
+        if (ret <= 0)
+            return -1;
+        buf += ret;
+        len -= ret;
+    }
+    return 0;
+}
+
+/**
+ * 把一批接收记录格式化为文本行 "time:<毫秒> id:0x<id> data:<HEX>"，返回写入的字节数
+ * 时间与 right.txt 一样精确到毫秒，文本订阅者同样得到设备时间戳的精度
+ */
+size_t format_text_records(char *out, const RxRecord *records, int count)
+{
+    static const char hex[] = "0123456789ABCDEF";
+    char *p = out;
+    for (int i = 0; i < count; i++)
+    {
+        p += sprintf(p, "time:%llu id:0x%x data:",
+                     (unsigned long long)(records[i].timestamp_us / 1000), records[i].id);
+        for (int j = 0; j < records[i].dlc; j++)
+        {
+            *p++ = hex[records[i].data[j] >> 4];
+            *p++ = hex[records[i].data[j] & 0x0F];
+        }
+        *p++ = '\n';
+    }
+    return p - out;
+}
+
+/**
+ * 设备时间戳映射到主机单调时钟
+ * VCI_CAN_OBJ.TimeStamp 为设备上电后的 0.1ms 计数（32位，约5天回绕），TimeFlag 为 0 时无效。
+ * 每批报文最后一帧的 "主机单调时刻 - 设备时刻" 是偏移的上界（多出 USB 传输与轮询延迟），
+ * 出现更小的候选值时立即下调偏移；每个 RX_CLOCK_WINDOW_US 窗口结束时以窗口内的最小候选值
+ * 重新估计偏移，并由相邻两次估计之差得到设备晶振相对主机的漂移率，窗口之间按漂移率外推。
+ * 记录中的 timestamp_us 为映射后的单调时刻加上启动时的墙钟偏移，运行期间不受墙钟跳变影响。
+ */
+#define RX_CLOCK_WINDOW_US 5000000
+#define RX_CLOCK_MAX_DRIFT 0.0005 // 漂移率上限（500ppm），超出视为异常估计
+typedef struct
+{
+    int valid;
+    uint32_t last_raw;
+    uint64_t wraps;          // 回绕次数
+    int64_t offset_us;       // base_dev_us 处的偏移：主机单调 = 设备 + 偏移
+    uint64_t base_dev_us;
+    double drift;            // 每设备微秒的偏移变化量
+    int has_estimate;        // 已完成至少一个窗口
+    int64_t window_min;      // 当前窗口内的最小候选偏移
+    uint64_t window_dev_us;  // window_min 对应的设备时刻
+    uint64_t window_start;   // 窗口开始的主机单调时刻
+    uint64_t latency_sum_us; // 主机收到时刻 - 映射后的发送时刻
+    uint64_t latency_max_us;
+    uint64_t frames;
+} DeviceClock;
+uint64_t rx_wall_offset_us; // 墙钟 - 单调时钟，启动时记录一次
+
+/**
+ * 把32位设备时间戳扩展为64位微秒，与最近一次时间戳相差超过半个周期时属于相邻的回绕周期
+ */
+static uint64_t extend_device_time(const DeviceClock *clock, uint32_t raw)
+{
+    uint64_t wraps = clock->wraps;
+    if (raw < clock->last_raw && clock->last_raw - raw > 0x80000000u)
+        wraps++;
+    else if (raw > clock->last_raw && raw - clock->last_raw > 0x80000000u && wraps > 0)
+        wraps--;
+    return ((wraps << 32) + raw) * 100;
+}
+
+static int64_t predicted_offset(const DeviceClock *clock, uint64_t dev_us)
+{
+    return clock->offset_us + (int64_t)(clock->drift * (double)((int64_t)(dev_us - clock->base_dev_us)));
+}
+
+/**
+ * 用一批报文最后一帧更新偏移估计
+ */
+static void update_device_clock(DeviceClock *clock, uint64_t dev_us, uint64_t now)
+{
+    int64_t candidate = (int64_t)(now - dev_us);
+    if (!clock->valid)
+    {
+        clock->valid = 1;
+        clock->offset_us = candidate;
+        clock->base_dev_us = dev_us;
+        clock->window_min = candidate;
+        clock->window_dev_us = dev_us;
+        clock->window_start = now;
+        return;
+    }
+    if (candidate < clock->window_min)
+    {
+        clock->window_min = candidate;
+        clock->window_dev_us = dev_us;
+    }
+    if (candidate < predicted_offset(clock, dev_us))
+    {
+        clock->offset_us = candidate;
+        clock->base_dev_us = dev_us;
+    }
+    if (now - clock->window_start >= RX_CLOCK_WINDOW_US)
+    {
+        if (clock->has_estimate && clock->window_dev_us != clock->base_dev_us)
+        {
+            double drift = (double)(clock->window_min - clock->offset_us) /
+                           (double)((int64_t)(clock->window_dev_us - clock->base_dev_us));
+            if (fabs(drift) <= RX_CLOCK_MAX_DRIFT)
+                clock->drift = drift;
+        }
+        clock->offset_us = clock->window_min;
+        clock->base_dev_us = clock->window_dev_us;
+        clock->has_estimate = 1;
+        clock->window_min = INT64_MAX;
+        clock->window_start = now;
+    }
+}
+
+/**
+ * 把一批报文转为定长二进制记录，返回写入的字节数
+ * 设备时间戳有效时映射到主机时钟，否则使用收到这批报文的时刻 now
+ */
+size_t format_binary_frames(RxRecord *out, const VCI_CAN_OBJ *can, int count, int channel,
+                            DeviceClock *clock, uint64_t now)
+{
+    memset(out, 0, count * sizeof(RxRecord));
+    if (count > 0 && can[count - 1].TimeFlag)
+    {
+        uint64_t dev_us = extend_device_time(clock, can[count - 1].TimeStamp);
+        clock->wraps = dev_us / 100 >> 32;
+        clock->last_raw = can[count - 1].TimeStamp;
+        update_device_clock(clock, dev_us, now);
+    }
+    for (int i = 0; i < count; i++)
+    {
+        uint64_t mono_us = now;
+        if (can[i].TimeFlag && clock->valid)
+        {
+            uint64_t dev_us = extend_device_time(clock, can[i].TimeStamp);
+            mono_us = dev_us + predicted_offset(clock, dev_us);
+            if (mono_us > now)
+                mono_us = now;
+            clock->latency_sum_us += now - mono_us;
+            if (now - mono_us > clock->latency_max_us)
+                clock->latency_max_us = now - mono_us;
+            histogram_observe(&metrics.rx_latency[channel], now - mono_us);
+        }
+        clock->frames++;
+        out[i].timestamp_us = mono_us + rx_wall_offset_us;
+        out[i].id = can[i].ID & 0x1fffffff;
+        out[i].channel = channel;
+        out[i].dlc = min(can[i].DataLen, 8);
+        out[i].flags = (can[i].ExternFlag ? RX_FLAG_EXTERN : 0) |
+                       (can[i].RemoteFlag ? RX_FLAG_REMOTE : 0);
+        memcpy(out[i].data, can[i].Data, out[i].dlc);
+    }
+    return count * sizeof(RxRecord);
+}
+
+static int subscriber_wants(const Subscriber *sub, UINT id)
+{
+    if (sub->filter_count == 0)
+        return 1;
+    for (int i = 0; i < sub->filter_count; i++)
+    {
+        if (sub->filter_ids[i] == id)
+            return 1;
+    }
+    return 0;
+}
+
+/**
+ * 把一批接收记录放入每个订阅者的环形缓冲区（不阻塞），并唤醒其发送线程
+ */
+void publish_records(const RxRecord *records, int count)
+{
+    pthread_mutex_lock(&subscribers_mutex);
+    for (int s = 0; s < MAX_SUBSCRIBERS; s++)
+    {
+        Subscriber *sub = &subscribers[s];
+        if (sub->fd < 0 || sub->overflowed)
+            continue;
+        int pushed = 0;
+        for (int i = 0; i < count; i++)
+        {
+            if (!subscriber_wants(sub, records[i].id))
+                continue;
+            if (sub->head - sub->tail == SUB_RING_FRAMES)
+            {
+                if (sub->overflow == SUB_OVERFLOW_DISCONNECT)
+                {
+                    sub->overflowed = 1;
+                    METRIC_ADD(metrics.sub_overflow_disconnects, 1);
+                    pushed = 1;
+                    break;
+                }
+                sub->tail++; // 丢弃最旧的帧
+                sub->dropped++;
+                METRIC_ADD(metrics.sub_dropped, 1);
+            }
+            sub->ring[sub->head % SUB_RING_FRAMES] = records[i];
+            sub->head++;
+            pushed = 1;
+        }
+        if (pushed && !sub->wake_pending)
+        {
+            sub->wake_pending = 1;
+            if (write(sub->wake_pipe[1], "", 1) < 0)
+                sub->wake_pending = 0;
+        }
+    }
+    pthread_mutex_unlock(&subscribers_mutex);
+}
+
+/**
+ * 处理订阅者发来的一行请求（格式、过滤、溢出策略）
+ */
+void handle_subscriber_request(Subscriber *sub, char *line)
+{
+    if (line[0] == '\0')
+        return;
+    pthread_mutex_lock(&subscribers_mutex);
+    if (strcmp(line, "format binary") == 0)
+        sub->format = RX_FORMAT_BINARY;
+    else if (strcmp(line, "format text") == 0)
+        sub->format = RX_FORMAT_TEXT;
+    else if (strcmp(line, "overflow drop") == 0)
+        sub->overflow = SUB_OVERFLOW_DROP;
+    else if (strcmp(line, "overflow disconnect") == 0)
+        sub->overflow = SUB_OVERFLOW_DISCONNECT;
+    else if (strcmp(line, "filter all") == 0)
+        sub->filter_count = 0;
+    else if (strncmp(line, "filter ", 7) == 0)
+    {
+        char *id_save = NULL;
+        sub->filter_count = 0;
+        for (char *tok = strtok_r(line + 7, " ", &id_save);
+             tok != NULL && sub->filter_count < SUB_MAX_FILTER;
+             tok = strtok_r(NULL, " ", &id_save))
+        {
+            sub->filter_ids[sub->filter_count++] = strtoul(tok, NULL, 0) & 0x1fffffff;
+        }
+    }
+    else
+        printf("未知的接收通道请求: %s\n", line);
+    pthread_mutex_unlock(&subscribers_mutex);
+}
+
+/**
+ * 按换行分帧处理缓冲区中所有完整的请求，一次读取可能包含多条或半条请求；
+ * 不完整的部分移到缓冲区开头等待下次读取，返回剩余字节数
+ */
+int consume_subscriber_requests(Subscriber *sub, char *buffer, int len)
+{
+    int pos = 0;
+    while (pos < len)
+    {
+        char *newline = (char *)memchr(buffer + pos, '\n', len - pos);
+        if (newline == NULL)
+        {
+            if (len - pos == SUB_REQUEST_MAX - 1)
+            {
+                printf("接收通道请求过长，丢弃。\n");
+                return 0;
+            }
+            break;
+        }
+        *newline = '\0';
+        if (newline > buffer + pos && newline[-1] == '\r')
+            newline[-1] = '\0';
+        handle_subscriber_request(sub, buffer + pos);
+        pos = newline - buffer + 1;
+    }
+    memmove(buffer, buffer + pos, len - pos);
+    return len - pos;
+}
+
+/**
+ * 订阅者发送线程：取出环形缓冲区中的帧，格式化后写给客户端，
+ * 同时处理客户端的请求；写入阻塞只影响该订阅者自己
+ */
+void *subscriber_thread(void *arg)
+{
+    Subscriber *sub = (Subscriber *)arg;
+    RxRecord batch[RX_BUFF_SIZE];
+    char *text = (char *)malloc(RX_BUFF_SIZE * RX_TEXT_LINE_MAX);
+    char request[SUB_REQUEST_MAX];
+    int buffered = 0; // request 中尚未以换行结束的部分
+    struct pollfd fds[2];
+    fds[0].fd = sub->fd;
+    fds[0].events = POLLIN;
+    fds[1].fd = sub->wake_pipe[0];
+    fds[1].events = POLLIN;
+
+    while (server_running)
+    {
+        pthread_mutex_lock(&subscribers_mutex);
+        int overflowed = sub->overflowed;
+        int format = sub->format;
+        int n = 0;
+        while (n < RX_BUFF_SIZE && sub->tail != sub->head)
+        {
+            batch[n++] = sub->ring[sub->tail % SUB_RING_FRAMES];
+            sub->tail++;
+        }
+        if (n == 0)
+            sub->wake_pending = 0;
+        pthread_mutex_unlock(&subscribers_mutex);
+
+        if (overflowed)
+        {
+            printf("Rx 订阅者缓冲区溢出，断开连接。\n");
+            break;
+        }
+        if (n > 0)
+        {
+            int ret;
+            if (format == RX_FORMAT_BINARY)
+                ret = write_all(sub->fd, (const char *)batch, n * sizeof(RxRecord));
+            else
+                ret = write_all(sub->fd, text, format_text_records(text, batch, n));
+            if (ret < 0)
+            {
+                METRIC_ADD(metrics.sub_write_errors, 1);
+                break;
+            }
+            pthread_mutex_lock(&subscribers_mutex);
+            sub->delivered += n;
+            pthread_mutex_unlock(&subscribers_mutex);
+            METRIC_ADD(metrics.sub_delivered, n);
+            continue;
+        }
+
+        if (poll(fds, 2, 100) <= 0)
+            continue;
+        if (fds[1].revents & POLLIN)
+        {
+            char drain[64];
+            while (read(sub->wake_pipe[0], drain, sizeof(drain)) > 0)
+                ;
+        }
+        if (fds[0].revents & (POLLIN | POLLHUP | POLLERR))
+        {
+            ssize_t r = read(sub->fd, request + buffered, sizeof(request) - 1 - buffered);
+            if (r <= 0)
+                break;
+            buffered = consume_subscriber_requests(sub, request, buffered + r);
+        }
+    }
+
+    printf("Rx 数据通道客户端断开，已发送 %llu 帧，丢弃 %llu 帧。\n",
+           (unsigned long long)sub->delivered, (unsigned long long)sub->dropped);
+    free(text);
+    pthread_mutex_lock(&subscribers_mutex);
+    close(sub->fd);
+    close(sub->wake_pipe[0]);
+    close(sub->wake_pipe[1]);
+    sub->fd = -1; // 槽位可以复用
+    pthread_mutex_unlock(&subscribers_mutex);
+    METRIC_SUB(metrics.subscribers, 1);
+    return NULL;
+}
+
+/**
+ * 接收方式（环境变量 CAN_RX_MODE 选择）
+ * adaptive（默认）：查询到报文后立即读取，空闲时轮询间隔从 RX_POLL_MIN_US 逐次加倍到 RX_POLL_MAX_US；
+ * blocking：直接以 RX_WAIT_TIME 超时阻塞在 VCI_Receive，报文到达即返回。
+ */
+#define RX_MODE_ADAPTIVE 0
+#define RX_MODE_BLOCKING 1
+#define RX_POLL_MIN_US 50
+#define RX_POLL_MAX_US 500
+#define RX_ERR_INFO_INTERVAL_US 1000000 // 定期读取一次设备错误信息（溢出、错误被动等）
+int rx_mode = RX_MODE_ADAPTIVE;
+
+/**
+ * 读取通道的错误信息并按错误类别计数（读取后设备清除错误码）
+ */
+static void read_can_errors(int DevType, int DevIdx, int channel)
+{
+    VCI_ERR_INFO info;
+    memset(&info, 0, sizeof(info));
+    if (VCI_ReadErrInfo(DevType, DevIdx, channel, &info) != 1)
+        return;
+    for (int k = 0; k < CAN_ERROR_KINDS; k++)
+    {
+        if (info.ErrCode & can_error_bits[k])
+            METRIC_ADD(metrics.can_errors[channel][k], 1);
+    }
+}
+
+void *rx_thread(void *data)
+{
+    RX_CTX *ctx = (RX_CTX *)data;
+    int DevType = ctx->DevType;
+    int DevIdx = ctx->DevIdx;
+    int chn_idx = ctx->index;
+
+    // 只读取 VCI_Receive 返回的条数，不需要每次清零
+    static VCI_CAN_OBJ can_buffers[MAX_CHANNELS][RX_BUFF_SIZE];
+    VCI_CAN_OBJ *can = can_buffers[chn_idx];
+    // 每次 VCI_Receive 的全部报文转为接收记录，一次分发给所有订阅者
+    static RxRecord record_buffers[MAX_CHANNELS][RX_BUFF_SIZE];
+    RxRecord *records = record_buffers[chn_idx];
+    DeviceClock clock;
+    memset(&clock, 0, sizeof(clock));
+    int poll_us = RX_POLL_MIN_US;
+    uint64_t err_info_us = get_monotonic_time_us();
+
+    while (!ctx->stop && server_running)
+    {
+        uint64_t loop_us = get_monotonic_time_us();
+        if (loop_us - err_info_us >= RX_ERR_INFO_INTERVAL_US)
+        {
+            read_can_errors(DevType, DevIdx, chn_idx);
+            err_info_us = loop_us;
+        }
+        int rcount = 0;
+        if (rx_mode == RX_MODE_BLOCKING)
+            rcount = VCI_Receive(DevType, DevIdx, chn_idx, can, RX_BUFF_SIZE, RX_WAIT_TIME);
+        else if (VCI_GetReceiveNum(DevType, DevIdx, chn_idx) > 0) // 获取缓冲区报文数量
+            rcount = VCI_Receive(DevType, DevIdx, chn_idx, can, RX_BUFF_SIZE, 0);
+        if (rcount > 0) // 出错时返回 -1
+        {
+            uint64_t now = get_monotonic_time_us();
+            if (trace_file != NULL)
+                trace_receive(can, rcount);
+            // 将数据分发给所有订阅者（64位程序）
+            format_binary_frames(records, can, rcount, chn_idx, &clock, now);
+            publish_records(records, rcount);
+            ctx->total += rcount;
+            METRIC_ADD(metrics.rx_frames[chn_idx], rcount);
+            METRIC_ADD(metrics.rx_bits[chn_idx], can_frames_bits(can, rcount));
+            METRIC_ADD(metrics.rx_reads[chn_idx], 1);
+            poll_us = RX_POLL_MIN_US;
+            if (rcount == RX_BUFF_SIZE)
+            {
+                METRIC_ADD(metrics.rx_full_reads[chn_idx], 1);
+                continue; // 缓冲区可能还有报文，立即再读
+            }
+        }
+        else
+        {
+            if (rcount < 0)
+            {
+                METRIC_ADD(metrics.rx_errors[chn_idx], 1);
+                err_info_us = 0; // 下一轮立即读取错误信息
+            }
+            if (rx_mode == RX_MODE_ADAPTIVE)
+                poll_us = min(poll_us * 2, RX_POLL_MAX_US);
+        }
+        if (rx_mode == RX_MODE_ADAPTIVE)
+            usleep(poll_us);
+    }
+    if (clock.frames > 0)
+        printf("通道%d 接收 %llu 帧，设备时间戳延迟 平均 %lluus 最大 %lluus，时钟漂移 %.1fppm\n",
+               chn_idx, (unsigned long long)clock.frames,
+               (unsigned long long)(clock.latency_sum_us / clock.frames),
+               (unsigned long long)clock.latency_max_us, clock.drift * 1e6);
+    pthread_exit(0);
+}
+
+void stop_command(RX_CTX rx_ctx[2], pthread_t rx_threads[2], int DevType, int DevIdx, pthread_t cmd_thread, pthread_t send_thread)
+{
+
+    // 写入各帧配置的退出数据（如关闭灯光）
+    pthread_mutex_lock(&frame_mutex);
+    for (int i = 0; i < frame_count; i++)
+    {
+        for (int j = 0; j < 8; j++)
+        {
+            if (control_frames[i].stop_mask & (1 << j))
+                control_frames[i].data[j] = control_frames[i].stop_data[j];
+        }
+    }
+    pthread_mutex_unlock(&frame_mutex);
+    for (int i = 0; i < MAX_CHANNELS; i++)
+    {
+        rx_ctx[i].stop = 1;                // 标记线程需要停止
+        pthread_join(rx_threads[i], NULL); // 等待线程退出
     }
     // 复位通道
     msleep(80);         // 等待线程退出
@@ -487,6 +1680,7 @@ void stop_command(RX_CTX rx_ctx[2], pthread_t rx_threads[2], int DevType, int De
     pthread_cancel(send_thread);
     pthread_join(send_thread, NULL);
     printf("send thread join success!\n");
+    print_sched_stats();
     for (int i = 0; i < MAX_CHANNELS; i++)
     {
         if (!VCI_ResetCAN(DevType, DevIdx, i))
@@ -501,11 +1695,21 @@ void stop_command(RX_CTX rx_ctx[2], pthread_t rx_threads[2], int DevType, int De
         close(client_fd);
     unlink(SOCKET_PATH);
     close(server_read_fd);
-    if (client_read_fd > 0)
+    // 唤醒所有订阅者发送线程，由其各自关闭连接
+    pthread_mutex_lock(&subscribers_mutex);
+    for (int i = 0; i < MAX_SUBSCRIBERS; i++)
     {
-        close(client_read_fd);
+        if (subscribers[i].fd >= 0)
+            shutdown(subscribers[i].fd, SHUT_RDWR);
     }
+    pthread_mutex_unlock(&subscribers_mutex);
     unlink(SOCKET_READ_PATH);
+    if (metrics_fd >= 0)
+    {
+        shutdown(metrics_fd, SHUT_RDWR); // 唤醒阻塞在 accept 的指标线程
+        close(metrics_fd);
+        unlink(METRICS_SOCKET_PATH);
+    }
 
     // 关闭设备
     if (!VCI_CloseDevice(DevType, DevIdx))
@@ -528,32 +1732,235 @@ void *write_socket_server_thread(void *arg)
             perror("accept error on server_read_fd");
             continue;
         }
-        printf("Rx 数据通道客户端已连接。\n");
-
-        // 如果你只允许一个客户端，则可以将其保存到 client_read_fd
-        // 如果你要支持多个，可以用别的方式管理
-        client_read_fd = tmp_fd;
-        // 简单阻塞在这里等待对端断开，如果想一边 accept 新连接，一边给旧连接发数据，就要更复杂的管理
-        // 这里仅演示一种最简单的模式
-        // 在这个例子里，只要连上，rx_thread 就可以使用 client_read_fd 写数据
-        // 直到对端断开连接
-        char dummy[16];
-        while (server_running)
+        // 分配空闲的订阅者槽位
+        Subscriber *sub = NULL;
+        int slot = -1;
+        pthread_mutex_lock(&subscribers_mutex);
+        for (int i = 0; i < MAX_SUBSCRIBERS; i++)
         {
-            ssize_t n = read(client_read_fd, dummy, sizeof(dummy));
-            if (n <= 0)
+            if (subscribers[i].fd < 0)
             {
-                printf("Rx 数据通道客户端断开。\n");
-                close(client_read_fd);
-                client_read_fd = -1;
+                sub = &subscribers[i];
+                slot = i;
                 break;
             }
-            // 如果还想处理对端发来的东西，就在此解析 dummy
         }
+        if (sub != NULL && pipe(sub->wake_pipe) == 0)
+        {
+            fcntl(sub->wake_pipe[0], F_SETFL, O_NONBLOCK);
+            fcntl(sub->wake_pipe[1], F_SETFL, O_NONBLOCK);
+            sub->format = RX_FORMAT_TEXT;
+            sub->overflow = SUB_OVERFLOW_DROP;
+            sub->overflowed = 0;
+            sub->filter_count = 0;
+            sub->head = sub->tail = 0;
+            sub->delivered = sub->dropped = 0;
+            sub->wake_pending = 0;
+            sub->fd = tmp_fd;
+        }
+        else
+            sub = NULL;
+        pthread_mutex_unlock(&subscribers_mutex);
+        if (sub == NULL)
+        {
+            printf("Rx 数据通道订阅者已满（%d），拒绝连接。\n", MAX_SUBSCRIBERS);
+            close(tmp_fd);
+            continue;
+        }
+        printf("Rx 数据通道客户端已连接（槽位 %d）。\n", slot);
+
+        pthread_t tid;
+        METRIC_ADD(metrics.subscribers, 1);
+        if (pthread_create(&tid, NULL, subscriber_thread, sub) != 0)
+        {
+            perror("pthread_create subscriber_thread");
+            METRIC_SUB(metrics.subscribers, 1);
+            pthread_mutex_lock(&subscribers_mutex);
+            close(sub->wake_pipe[0]);
+            close(sub->wake_pipe[1]);
+            close(tmp_fd);
+            sub->fd = -1;
+            pthread_mutex_unlock(&subscribers_mutex);
+            continue;
+        }
+        pthread_detach(tid);
     }
     return NULL;
 }
 
+/**
+ * 指标快照：每行 "<名称> [<标签>=<值> ...] <数值>"，数值均为启动以来的累计值或当前值，
+ * 直方图按 Prometheus 约定输出 _bucket（累积计数，le 为上界微秒）、_sum 与 _count。
+ * 客户端连接 METRICS_SOCKET_PATH 即收到一份快照，随后连接被关闭；
+ * can_metrics.py 把快照转换为 Prometheus 文本格式。
+ */
+typedef struct
+{
+    char *data;
+    size_t len;
+    size_t size;
+} MetricsBuffer;
+
+static void metrics_append(MetricsBuffer *out, const char *fmt, ...)
+{
+    va_list args;
+    va_start(args, fmt);
+    int n = vsnprintf(out->data + out->len, out->size - out->len, fmt, args);
+    va_end(args);
+    if (n > 0 && out->len + n < out->size)
+        out->len += n;
+}
+
+static void metrics_line(MetricsBuffer *out, const char *name, const char *labels, uint64_t value)
+{
+    metrics_append(out, "%s %s%llu\n", name, labels, (unsigned long long)value);
+}
+
+static void format_histogram(MetricsBuffer *out, const char *name, const char *labels,
+                             Histogram *h)
+{
+    uint64_t cumulative = 0;
+    for (int i = 0; i < METRIC_BUCKETS; i++)
+    {
+        cumulative += METRIC_GET(h->buckets[i]);
+        metrics_append(out, "%s_bucket %sle=%llu %llu\n", name, labels,
+                       (unsigned long long)metric_bucket_us[i], (unsigned long long)cumulative);
+    }
+    cumulative += METRIC_GET(h->buckets[METRIC_BUCKETS]);
+    metrics_append(out, "%s_bucket %sle=+Inf %llu\n", name, labels, (unsigned long long)cumulative);
+    metrics_append(out, "%s_sum %s%llu\n", name, labels, (unsigned long long)METRIC_GET(h->sum));
+    // 与 +Inf 桶保持一致，而不是单独读取 count
+    metrics_append(out, "%s_count %s%llu\n", name, labels, (unsigned long long)cumulative);
+}
+
+void format_metrics(MetricsBuffer *out)
+{
+    char labels[64];
+    metrics_line(out, "uptime_us", "", get_monotonic_time_us() - metrics_start_us);
+    metrics_line(out, "bus_bitrate", "", metrics_bitrate);
+    for (int ch = 0; ch < MAX_CHANNELS; ch++)
+    {
+        snprintf(labels, sizeof(labels), "channel=%d ", ch);
+        metrics_line(out, "rx_frames", labels, METRIC_GET(metrics.rx_frames[ch]));
+        metrics_line(out, "rx_bits", labels, METRIC_GET(metrics.rx_bits[ch]));
+        metrics_line(out, "rx_reads", labels, METRIC_GET(metrics.rx_reads[ch]));
+        metrics_line(out, "rx_full_reads", labels, METRIC_GET(metrics.rx_full_reads[ch]));
+        metrics_line(out, "rx_errors", labels, METRIC_GET(metrics.rx_errors[ch]));
+        metrics_line(out, "tx_frames", labels, METRIC_GET(metrics.tx_frames[ch]));
+        metrics_line(out, "tx_bits", labels, METRIC_GET(metrics.tx_bits[ch]));
+        metrics_line(out, "tx_failed", labels, METRIC_GET(metrics.tx_failed[ch]));
+        format_histogram(out, "rx_latency_us", labels, &metrics.rx_latency[ch]);
+        for (int k = 0; k < CAN_ERROR_KINDS; k++)
+        {
+            snprintf(labels, sizeof(labels), "channel=%d kind=%s ", ch, can_error_names[k]);
+            metrics_line(out, "can_errors", labels, METRIC_GET(metrics.can_errors[ch][k]));
+        }
+    }
+    for (int i = 0; i < CMD_RESULTS; i++)
+    {
+        snprintf(labels, sizeof(labels), "result=%s ", cmd_error_names[i]);
+        metrics_line(out, "commands", labels, METRIC_GET(metrics.commands[i]));
+    }
+    metrics_line(out, "binary_batches", "", METRIC_GET(metrics.binary_batches));
+    metrics_line(out, "binary_records", "", METRIC_GET(metrics.binary_records));
+    metrics_line(out, "binary_invalid", "", METRIC_GET(metrics.binary_invalid));
+    metrics_line(out, "acks_dropped", "", METRIC_GET(metrics.acks_dropped));
+    metrics_line(out, "command_clients", "", METRIC_GET(metrics.command_clients));
+    metrics_line(out, "subscribers", "", METRIC_GET(metrics.subscribers));
+    metrics_line(out, "sub_delivered", "", METRIC_GET(metrics.sub_delivered));
+    metrics_line(out, "sub_dropped", "", METRIC_GET(metrics.sub_dropped));
+    metrics_line(out, "sub_write_errors", "", METRIC_GET(metrics.sub_write_errors));
+    metrics_line(out, "sub_overflow_disconnects", "", METRIC_GET(metrics.sub_overflow_disconnects));
+    format_histogram(out, "send_lateness_us", "", &metrics.send_lateness);
+    for (int i = 0; i < frame_count; i++)
+    {
+        FrameSchedStats *stats = &sched_stats[i];
+        snprintf(labels, sizeof(labels), "id=%X ", control_frames[i].id);
+        metrics_line(out, "frame_sent", labels, METRIC_GET(stats->sent));
+        metrics_line(out, "frame_missed", labels, METRIC_GET(stats->missed));
+        metrics_line(out, "frame_skipped", labels, METRIC_GET(stats->skipped));
+        metrics_line(out, "frame_transmit_failed", labels, METRIC_GET(stats->transmit_failed));
+        metrics_line(out, "frame_lateness_max_us", labels, METRIC_GET(stats->lateness_max_us));
+        metrics_line(out, "frame_period_error_max_us", labels,
+                     METRIC_GET(stats->period_error_max_us));
+    }
+}
+
+/**
+ * 初始化指标套接字，失败时只打印错误，不影响收发
+ */
+int init_metrics_socket()
+{
+    struct sockaddr_un server_addr;
+    int fd = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (fd < 0)
+    {
+        perror("metrics socket error");
+        return -1;
+    }
+    memset(&server_addr, 0, sizeof(server_addr));
+    server_addr.sun_family = AF_UNIX;
+    strncpy(server_addr.sun_path, METRICS_SOCKET_PATH, sizeof(server_addr.sun_path) - 1);
+    unlink(METRICS_SOCKET_PATH);
+    if (bind(fd, (struct sockaddr *)&server_addr, sizeof(server_addr)) == -1 ||
+        listen(fd, 5) == -1)
+    {
+        perror("metrics bind error");
+        close(fd);
+        return -1;
+    }
+    printf("指标套接字已初始化: %s\n", METRICS_SOCKET_PATH);
+    return fd;
+}
+
+/**
+ * 指标线程：每个连接写出一份快照后关闭，只读取原子计数器，不获取收发线程使用的锁
+ */
+void *metrics_thread(void *arg)
+{
+    MetricsBuffer out;
+    out.size = 16384 + (size_t)frame_count * 512;
+    out.data = (char *)malloc(out.size);
+    while (server_running)
+    {
+        int fd = accept(metrics_fd, NULL, NULL);
+        if (fd < 0)
+        {
+            if (!server_running)
+                break;
+            if (errno != EINTR)
+                perror("accept error on metrics_fd");
+            continue;
+        }
+        out.len = 0;
+        format_metrics(&out);
+        write_all(fd, out.data, out.len);
+        close(fd);
+    }
+    free(out.data);
+    return NULL;
+}
+
+/**
+ * 波特率定时参数对应的位速率，用于计算总线负载
+ */
+static int timing_bitrate(int baud)
+{
+    switch (baud)
+    {
+    case 0x1400:
+        return 1000000;
+    case 0x1c00:
+        return 500000;
+    case 0x1c01:
+        return 250000;
+    case 0x1c03:
+        return 125000;
+    default:
+        return 0;
+    }
+}
+
 int main(int argc, char *argv[])
 {
     // 波特率，十六进制数字，可以由“zcanpro 波特率计算器”计算得出
@@ -565,6 +1972,47 @@ int main(int argc, char *argv[])
     RX_CTX rx_ctx[MAX_CHANNELS];        // 接收线程上下文
     pthread_t rx_threads[MAX_CHANNELS]; // 接收线程
 
+    // 加载控制帧表，可用第一个参数指定配置文件
+    const char *frame_config = argc > 1 ? argv[1] : DEFAULT_FRAME_CONFIG;
+    int loaded = load_frame_table(frame_config, &frame_table);
+    if (loaded == -1)
+    {
+        printf("未找到帧配置 %s，使用内置的控制帧表\n", frame_config);
+        loaded = init_frame_table(&frame_table, default_control_frames,
+                                  sizeof(default_control_frames) / sizeof(ControlFrame));
+    }
+    if (loaded != 0)
+    {
+        printf("加载帧配置 %s 失败\n", frame_config);
+        return 0;
+    }
+    control_frames = frame_table.frames;
+    frame_count = frame_table.frame_count;
+    printf("控制帧 %d 个，信号 %d 个\n", frame_count, frame_table.signal_count);
+    const char *rx_mode_name = getenv("CAN_RX_MODE");
+    if (rx_mode_name != NULL && strcmp(rx_mode_name, "blocking") == 0)
+        rx_mode = RX_MODE_BLOCKING;
+    rx_wall_offset_us = get_current_time_us() - get_monotonic_time_us();
+    metrics_start_us = get_monotonic_time_us();
+    metrics_bitrate = timing_bitrate(Baud);
+    sched_stats = (FrameSchedStats *)calloc(frame_count, sizeof(FrameSchedStats));
+
+    // 设置 CAN_TRACE 时开启延迟追踪
+    const char *trace_path = getenv("CAN_TRACE");
+    if (trace_path != NULL && trace_path[0] != '\0')
+    {
+        trace_file = fopen(trace_path, "a");
+        if (trace_file == NULL)
+            perror("open trace file");
+        else
+            printf("延迟追踪已开启: %s\n", trace_path);
+    }
+
+    // 订阅者断开时 write 返回 EPIPE，而不是终止整个进程
+    signal(SIGPIPE, SIG_IGN);
+    for (int i = 0; i < MAX_SUBSCRIBERS; i++)
+        subscribers[i].fd = -1;
+
     // 打开设备
     if (!VCI_OpenDevice(DevType, DevIdx, 0))
     {
@@ -621,6 +2069,15 @@ int main(int argc, char *argv[])
     pthread_t write_srv_thread;
     pthread_create(&write_srv_thread, NULL, write_socket_server_thread, NULL);
 
+    // 指标套接字，只读取计数器
+    metrics_fd = init_metrics_socket();
+    if (metrics_fd >= 0)
+    {
+        pthread_t metrics_tid;
+        if (pthread_create(&metrics_tid, NULL, metrics_thread, NULL) == 0)
+            pthread_detach(metrics_tid);
+    }
+
     // 阻塞等待，按下回车键退出
     char input;
     input = getchar();
@@ -1,9 +1,28 @@
+import bisect
+import os
 import socket
 import threading
+import time
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import messagebox, ttk
+
+import yaml
+
+from can_encoder import SignalEncoder, load_signals
+from can_telemetry import TelemetryReceiver, TelemetrySnapshot
+from can_trace import Tracer
+from convert import load_decoders
 
 SOCKET_PATH = "/tmp/can_socket"
+SOCKET_READ_PATH = "/tmp/can_read_socket"
+LOOKUP_FILE = "lookup.yaml"
+
+# 车辆反馈面板：按固定刷新率重绘，与接收帧率无关
+TELEMETRY_REFRESH_MS = 33  # 约30Hz
+SPARKLINE_MAX = 4  # 最多同时显示的曲线条数
+SPARKLINE_WIDTH = 360
+SPARKLINE_HEIGHT = 60
+SPARKLINE_WINDOW_US = 10 * 1000000  # 曲线显示最近10秒
 
 # 全局变量，用于存储各个参数的值
 params = {
@@ -22,12 +41,62 @@ class App:
         self.sock = None  # 初始时未连接
         self.connected = False
         self.root.title("控制界面")
+        self.create_telemetry_widgets()
         self.create_widgets()
         # 设置初始零点值
         self.steering_zero_point = 0
         self.acceleration_zero_point = 0
+        # 由 lookup.yaml 驱动的信号编码器
+        self.encoder = SignalEncoder(load_signals(LOOKUP_FILE))
+        # 设置环境变量 CAN_TRACE 时为每次发送附带追踪行（需 middleware 同样开启追踪）
+        self.tracer = Tracer() if os.environ.get("CAN_TRACE") else None
+        # 接收到的帧在后台线程解码，界面只按固定刷新率读取快照
+        # lookup.yaml 不可用时不显示车辆反馈，指令发送不受影响
+        self.telemetry_unavailable = None
+        try:
+            decoders = load_decoders(LOOKUP_FILE)
+        except (OSError, yaml.YAMLError) as e:
+            print(f"[WARN] 无法加载 {LOOKUP_FILE}: {e}")
+            decoders = {}
+            self.telemetry_unavailable = f"{LOOKUP_FILE} 不可用"
+            self.telemetry_status.config(text=self.telemetry_unavailable)
+        self.telemetry = TelemetrySnapshot(decoders)
+        self.telemetry_receiver = None
+        self.telemetry_rows = {}  # (帧ID, 信号名) -> 表格行
+        self.telemetry_keys = []  # 已显示的信号，按 (帧ID, 信号名) 排序
+        self.telemetry_texts = {}  # 表格中当前显示的值
+        self.telemetry_rate = (time.monotonic(), 0)
+        self.sparkline_keys = []
         # 启动定时发送线程
         self.root.after(3, self.periodic_send)
+        self.root.after(TELEMETRY_REFRESH_MS, self.refresh_telemetry)
+
+    def create_telemetry_widgets(self):
+        # 车辆反馈面板放在右侧，先于控制控件 pack 以占满整列高度
+        frame = tk.LabelFrame(self.root, text="车辆反馈")
+        frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=4, pady=4)
+        self.telemetry_status = tk.Label(frame, text="未连接")
+        self.telemetry_status.pack(anchor=tk.W)
+
+        table = tk.Frame(frame)
+        table.pack(fill=tk.BOTH, expand=True)
+        self.telemetry_tree = ttk.Treeview(
+            table, columns=("id", "name", "value"), show="headings", height=15
+        )
+        for column, text, width in (("id", "ID", 90), ("name", "信号", 160), ("value", "值", 110)):
+            self.telemetry_tree.heading(column, text=text)
+            self.telemetry_tree.column(column, width=width, anchor=tk.W)
+        scrollbar = ttk.Scrollbar(table, orient=tk.VERTICAL, command=self.telemetry_tree.yview)
+        self.telemetry_tree.configure(yscrollcommand=scrollbar.set)
+        self.telemetry_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.telemetry_tree.bind("<<TreeviewSelect>>", self.select_sparklines)
+
+        tk.Label(frame, text=f"选中信号显示最近曲线（最多{SPARKLINE_MAX}条）").pack(anchor=tk.W)
+        self.sparkline_canvas = tk.Canvas(
+            frame, width=SPARKLINE_WIDTH, height=SPARKLINE_HEIGHT * SPARKLINE_MAX, bg="white"
+        )
+        self.sparkline_canvas.pack()
 
     def create_widgets(self):
         # 创建连接按钮
@@ -161,11 +230,13 @@ class App:
                 self.sock.connect(SOCKET_PATH)
                 print("[INFO] 已成功连接到服务器")
                 self.connected = True
+                self.encoder.reset()  # 连接后先同步一次全部信号
                 self.connect_btn.config(text="断开连接")
                 # 启动接收线程
                 self.recv_thread = threading.Thread(target=self.receive_data)
                 self.recv_thread.daemon = True
                 self.recv_thread.start()
+                self.start_telemetry()
             except Exception as e:
                 print(f"[ERROR] 无法连接到服务器: {e}")
                 messagebox.showerror("连接错误", f"无法连接到服务器: {e}")
@@ -173,9 +244,90 @@ class App:
             # 断开连接
             self.sock.close()
             self.connected = False
+            self.stop_telemetry()
             self.connect_btn.config(text="连接服务器")
             print("[INFO] 已断开连接")
 
+    def start_telemetry(self):
+        if self.telemetry_unavailable:
+            return
+        try:
+            self.telemetry_receiver = TelemetryReceiver(self.telemetry, SOCKET_READ_PATH)
+            self.telemetry_status.config(text="接收中")
+        except OSError as e:
+            # 接收通道不可用时仍可正常发送指令
+            print(f"[WARN] 无法订阅接收通道: {e}")
+            self.telemetry_status.config(text=f"无法订阅接收通道: {e}")
+
+    def stop_telemetry(self):
+        if self.telemetry_receiver is not None:
+            self.telemetry_receiver.close()
+            self.telemetry_receiver = None
+        self.telemetry_status.config(text=self.telemetry_unavailable or "未连接")
+
+    def select_sparklines(self, event=None):
+        # 选中的表格行即显示曲线的信号
+        rows = {iid: key for key, iid in self.telemetry_rows.items()}
+        keys = [rows[iid] for iid in self.telemetry_tree.selection() if iid in rows]
+        self.sparkline_keys = keys[:SPARKLINE_MAX]
+        self.telemetry.track(self.sparkline_keys)
+        self.sparkline_canvas.delete("all")
+
+    def refresh_telemetry(self):
+        # 只更新上次刷新后变化的信号，每次刷新的开销与帧率无关
+        changed, frames = self.telemetry.take()
+        for key, (value, _) in changed.items():
+            text = f"{value:.6g}" if isinstance(value, float) else str(value)
+            iid = self.telemetry_rows.get(key)
+            if iid is None:
+                index = bisect.bisect(self.telemetry_keys, key)
+                self.telemetry_keys.insert(index, key)
+                iid = self.telemetry_tree.insert(
+                    "", index, values=(f"{key[0]:08X}", key[1], text)
+                )
+                self.telemetry_rows[key] = iid
+            elif self.telemetry_texts.get(key) != text:
+                self.telemetry_tree.set(iid, "value", text)
+            self.telemetry_texts[key] = text
+
+        now = time.monotonic()
+        last_time, last_frames = self.telemetry_rate
+        if now - last_time >= 1.0:
+            if self.telemetry_receiver is not None:
+                if self.telemetry_receiver.running:
+                    rate = (frames - last_frames) / (now - last_time)
+                    self.telemetry_status.config(text=f"接收中: {rate:.0f} 帧/s")
+                else:
+                    self.telemetry_status.config(text="接收通道已断开")
+            self.telemetry_rate = (now, frames)
+
+        if self.sparkline_keys:
+            self.draw_sparklines()
+        self.root.after(TELEMETRY_REFRESH_MS, self.refresh_telemetry)
+
+    def draw_sparklines(self):
+        canvas = self.sparkline_canvas
+        canvas.delete("all")
+        for row, key in enumerate(self.sparkline_keys):
+            top = row * SPARKLINE_HEIGHT
+            canvas.create_text(2, top + 2, anchor=tk.NW, text=key[1], fill="gray")
+            points = self.telemetry.series(key, SPARKLINE_WINDOW_US)
+            if len(points) < 2:
+                continue
+            # 每个像素最多画一个点
+            points = points[::max(1, len(points) // SPARKLINE_WIDTH)]
+            values = [v for _, v in points]
+            low, high = min(values), max(values)
+            span = (high - low) or 1
+            coords = []
+            for t, v in points:
+                coords.append(SPARKLINE_WIDTH + t * SPARKLINE_WIDTH / SPARKLINE_WINDOW_US)
+                coords.append(top + SPARKLINE_HEIGHT - 4 - (v - low) * (SPARKLINE_HEIGHT - 20) / span)
+            canvas.create_line(*coords, fill="blue")
+            canvas.create_text(
+                SPARKLINE_WIDTH - 2, top + 2, anchor=tk.NE, text=f"{low:.6g} ~ {high:.6g}", fill="gray"
+            )
+
     def reset_steering_angle(self):
         # 将当前值设定为新的零点
         self.steering_zero_point = self.steering_angle_scale.get()
@@ -199,93 +351,38 @@ class App:
         self.acceleration_value_label.config(text=f"当前加速度: {current_value}")
 
     def periodic_send(self):
-        # 每隔3ms发送一次数据
+        # 每隔10ms检查一次参数，只发送发生变化的信号
         # 更新显示的值
         self.update_steering_label()
         self.update_acceleration_label()
 
         if self.connected:
             # 获取当前参数值
-            steering_angle = self.steering_zero_point + self.steering_angle_scale.get()
-            acceleration = self.acceleration_zero_point + self.acceleration_scale.get()
-            elec_brake = self.elec_brake_var.get()
-            gear = self.gear_var.get()
-            emergency_braking = self.emergency_braking_var.get()
-            big_light = self.big_light_var.get()
+            values = {
+                "steering_angle": self.steering_zero_point + self.steering_angle_scale.get(),
+                "acceleration": self.acceleration_zero_point + self.acceleration_scale.get(),
+                "elec_brake": self.elec_brake_var.get(),
+                "gear": self.gear_var.get(),
+                "emergency_braking": self.emergency_braking_var.get(),
+                "big_light": self.big_light_var.get(),
+            }
             # 获取其他参数...
 
-            # 构建并发送steering_angle的指令
-            steering_angle_raw = int(
-                steering_angle 
-            )  # 使用factor和offset计算原始值
-            steering_angle_data = format(steering_angle_raw, "b").zfill(
-                8
-            )  # 转为2位的hex字符串
-            steering_angle_cmd = f"send 402763936 32 8 {steering_angle_data}\n"
-            self.send_data(steering_angle_cmd)
-
-            # 构建并发送402895008的指令
-            acceleration_raw = int((acceleration - (-128)) / 1)
-            acceleration_data = format(acceleration_raw, "b").zfill(8)
-            # 组装其他字段
-            elec_brake_data = elec_brake & 0b11  # 2位
-            gear_data = gear & 0b1111  # 4位
-            emergency_braking_data = emergency_braking & 0b1  # 1位
-
-            # 构建位字段
-            data_bits = ["0"] * 64  # 初始化64位的数据位
-            # acceleration
-            acc_bin = format(acceleration_raw, "b").zfill(8)
-            for i in range(8):
-                data_bits[0 + i] = acc_bin[i]
-            # elec_brake
-            elec_brake_bin = format(elec_brake_data, "02b").zfill(2)
-            for i in range(2):
-                data_bits[10 + i] = elec_brake_bin[i]
-            # gear
-            gear_bin = format(gear_data, "04b").zfill(4)
-            for i in range(4):
-                data_bits[12 + i] = gear_bin[i]
-            # emergency_braking
-            emergency_braking_bin = format(emergency_braking_data, "01b")
-            data_bits[24] = emergency_braking_bin
-
-            # 将位字段转为字节字符串
-            data_bytes = []
-            for i in range(0, 64, 8):
-                byte_str = "".join(data_bits[i : i + 8])
-                data_bytes.append(format(int(byte_str, 2), "02x"))
-
-            data_field = "".join(data_bytes)
-            # can_cmd = f"send 402895008 1 8 {data_field}"
-            # self.send_data(can_cmd)
-
-            # 构建并发送403026080的指令（包括各种灯的控制）
-            # 类似的方法，按照定义的start_bit和length填充数据位
-            # 示例：big_light控制
-            big_light_data = big_light & 0b11  # 2位
-            data_bits_403026080 = ["0"] * 64  # 初始化64位的数据位
-            big_light_bin = format(big_light_data, "02b").zfill(2)
-            for i in range(2):
-                data_bits_403026080[16 + i] = big_light_bin[i]
-            # 添加其他灯的控制...
-
-            # 将位字段转为字节字符串
-            data_bytes_403026080 = []
-            for i in range(0, 64, 8):
-                byte_str = "".join(data_bits_403026080[i : i + 8])
-                data_bytes_403026080.append(format(int(byte_str, 2), "02x"))
-
-            data_field_403026080 = "".join(data_bytes_403026080)
-            # can_cmd_403026080 = f"send 403026080 1 8 {data_field_403026080}"
-            # self.send_data(can_cmd_403026080)
+            # 只发送本次变化的信号，编码为一个二进制批量指令并一次写入
+            cmd = self.encoder.changes(values, binary=True)
+            if cmd:
+                if self.tracer is not None:
+                    cmd = self.tracer.line() + cmd  # 追踪行标记紧随其后的整批指令
+                self.send_data(cmd)
 
         # 设定下一次调用
         self.root.after(10, self.periodic_send)
 
     def send_data(self, cmd):
         try:
-            self.sock.sendall(cmd.encode("utf-8"))  # 向服务器发送数据
+            if isinstance(cmd, str):
+                cmd = cmd.encode("utf-8")
+            self.sock.sendall(cmd)  # 向服务器发送数据
         except Exception as e:
             print(f"[ERROR] 发送数据异常: {e}")
 
@@ -1,43 +1,274 @@
-def convert_timestamp(first_timestamp, current_timestamp):
-    # 计算时间差（秒）
-    time_diff = (int(current_timestamp) - int(first_timestamp)) / 1000
-    # 格式化为6位小数
-    return "{:.6f}".format(time_diff)
+"""
+把 senddebug.txt（或 can_store 录制文件）导出为 ASC、CSV、列式等格式
+输入只解析一遍，每批数据依次交给所有输出格式的写入器，多个格式同时导出。
+数据字节按行整体用 bytes.fromhex / bytes.hex 转换，不再逐字节 int/format。
+"""
+import argparse
+import csv
+import os
+import struct
 
-def convert_can_data(input_file, output_file):
-    first_timestamp = None
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
+import numpy as np
+
+from can_store import Store, is_store
+
+# 每批解析的行数
+EXPORT_BATCH = 65536
+
+
+def _hex_bytes(tokens):
+    """把十六进制字节字段转为 bytes；常见的两位字节整体转换，其余逐个转换"""
+    try:
+        return bytes.fromhex(" ".join(tokens))
+    except ValueError:
+        return bytes(int(x, base=16) for x in tokens)
+
+
+class Batch:
+    """
+    一批待导出的帧
+    Attributes:
+        timestamps: 每帧时间戳（毫秒），int64。
+        fields: 每帧时间戳之后、数据之前的6个字段（通道、ID、方向、类型、DLC、第0字节）。
+        data: 每帧数据字节。
+        skipped: 解析这一批时跳过的行或帧数。
+    """
+
+    def __init__(self, timestamps, fields, data, skipped=0):
+        self.timestamps = timestamps
+        self.fields = fields
+        self.data = data
+        self.skipped = skipped
+
+    def __len__(self):
+        return len(self.data)
+
+
+def parse_lines(lines):
+    """解析一批 senddebug.txt 行，跳过字段不足的行"""
+    timestamps, fields, data = [], [], []
+    skipped = 0
+    for line in lines:
+        parts = line.strip().split(' ')
+        if len(parts) >= 14:  # 确保行有足够的数据
+            timestamps.append(int(parts[0]))
+            fields.append(parts[1:7])
+            data.append(_hex_bytes(parts[6:]))
+        elif line.strip():
+            skipped += 1
+    return Batch(np.array(timestamps, dtype=np.int64), fields, data, skipped)
+
+
+def parse_records(records):
+    """
+    直接由录制文件记录构造批次，字段与 can_store 导出的 senddebug.txt 一致
+    只有8字节的帧满足 senddebug.txt 的字段数要求，其余帧计入 skipped。
+    """
+    skipped = len(records)
+    records = records[records['dlc'] == 8]
+    skipped -= len(records)
+    fields = [[str(channel), f"{frame_id:X}x", "Rx", "d", "8", f"{first:02X}"]
+              for channel, frame_id, first in zip(records['channel'].tolist(),
+                                                   records['id'].tolist(),
+                                                   records['data'][:, 0].tolist())]
+    data = [row.tobytes() for row in records['data']]
+    return Batch((records['timestamp_us'] // 1000).astype(np.int64), fields, data, skipped)
+
+
+def iter_batches(input_file, batch_size=EXPORT_BATCH):
+    """逐批读取输入文件，文本与录制文件均可"""
+    if is_store(input_file):
+        for records in Store(input_file).iter_chunks(batch_size):
+            yield parse_records(records)
+        return
+    with open(input_file, 'r') as infile:
+        lines = []
         for line in infile:
-            parts = line.strip().split(' ')
-            if len(parts) >= 14:  # 确保行有足够的数据
-                # 获取时间戳
-                timestamp = parts[0]
-                
-                # 记录第一个时间戳
-                if first_timestamp is None:
-                    first_timestamp = timestamp
-                
-                data_bytes = " ".join(["{:02x}".format(int(x, base=16)) for x in parts[6:]])
-                # 计算时间差
-                time_diff = convert_timestamp(first_timestamp, timestamp)
-                
-                # 构建新的行格式
-                # 替换Tx为Rx
-                # direction = "Rx"
-                
-                # 构建数据字节部分
-                
-                # 组合新的行
-                new_line = f"{time_diff} {parts[1]} {parts[2]} {parts[3]} {parts[4]} {parts[5]} {parts[6]} {data_bytes}"
-                outfile.write(new_line + "\n")
-
-# 使用示例
-input_file = "senddebug.txt"    # 原始数据文件
-output_file = "send.asc"        # 输出文件
-
-try:
-    convert_can_data(input_file, output_file)
-    print("转换完成！")
-except Exception as e:
-    print(f"转换过程中出现错误: {str(e)}")
+            lines.append(line)
+            if len(lines) >= batch_size:
+                yield parse_lines(lines)
+                lines = []
+        if lines:
+            yield parse_lines(lines)
+
+
+class AscWriter:
+    """原来 convert_can_data 的 ASC 格式：相对时间（秒）、6个原始字段、小写数据字节"""
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.first_timestamp = None
+
+    def write(self, batch):
+        if not len(batch):
+            return
+        if self.first_timestamp is None:
+            # 记录第一个时间戳
+            self.first_timestamp = int(batch.timestamps[0])
+        time_diff = ((batch.timestamps - self.first_timestamp) / 1000).tolist()
+        self.file.writelines(
+            f"{t:.6f} {' '.join(fields)} {data.hex(' ')}\n"
+            for t, fields, data in zip(time_diff, batch.fields, batch.data))
+
+    def close(self):
+        self.file.close()
+
+
+class CsvWriter:
+    """CSV 格式：相对时间（秒）、通道、ID、方向、DLC、数据"""
+
+    HEADER = ["time", "channel", "id", "direction", "dlc", "data"]
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.HEADER)
+        self.first_timestamp = None
+
+    def write(self, batch):
+        if not len(batch):
+            return
+        if self.first_timestamp is None:
+            self.first_timestamp = int(batch.timestamps[0])
+        time_diff = ((batch.timestamps - self.first_timestamp) / 1000).tolist()
+        self.writer.writerows(
+            (f"{t:.6f}", fields[0], fields[1].rstrip('x'), fields[2], fields[4], data.hex(' '))
+            for t, fields, data in zip(time_diff, batch.fields, batch.data))
+
+    def close(self):
+        self.file.close()
+
+
+class NpyColumn:
+    """
+    边写边追加的 .npy 文件
+    先写入预留长度的文件头，关闭时按实际行数改写，数据只写一遍。
+    """
+
+    HEADER_SIZE = 128
+
+    def __init__(self, path, dtype, row_shape=()):
+        self.file = open(path, 'wb')
+        self.dtype = np.dtype(dtype)
+        self.row_shape = row_shape
+        self.count = 0
+        self._write_header()
+
+    def _write_header(self):
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype),
+                       'fortran_order': False,
+                       'shape': (self.count,) + self.row_shape})
+        header = header.ljust(self.HEADER_SIZE - 10 - 1) + "\n"
+        self.file.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+    def write(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        self.file.write(values.tobytes())
+        self.count += len(values)
+
+    def close(self):
+        self.file.seek(0)
+        self._write_header()
+        self.file.close()
+
+
+class ColumnWriter:
+    """
+    列式格式：目录下每列一个 .npy 文件，可用 numpy.load(mmap_mode='r') 直接分析
+    timestamp_ms(int64) channel(int32) id(uint32) dlc(uint8) data(uint8 x 8，不足补0)
+    """
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.columns = {
+            "timestamp_ms": NpyColumn(os.path.join(path, "timestamp_ms.npy"), np.int64),
+            "channel": NpyColumn(os.path.join(path, "channel.npy"), np.int32),
+            "id": NpyColumn(os.path.join(path, "id.npy"), np.uint32),
+            "dlc": NpyColumn(os.path.join(path, "dlc.npy"), np.uint8),
+            "data": NpyColumn(os.path.join(path, "data.npy"), np.uint8, (8,)),
+        }
+
+    def write(self, batch):
+        if not len(batch):
+            return
+        dlc = np.fromiter((len(data) for data in batch.data), dtype=np.int64, count=len(batch))
+        data = np.zeros((len(batch), 8), dtype=np.uint8)
+        if (dlc == 8).all():
+            data[:] = np.frombuffer(b"".join(batch.data), dtype=np.uint8).reshape(-1, 8)
+        else:
+            for i, row in enumerate(batch.data):
+                row = row[:8]
+                data[i, :len(row)] = np.frombuffer(row, dtype=np.uint8)
+        self.columns["timestamp_ms"].write(batch.timestamps)
+        self.columns["channel"].write([int(fields[0]) for fields in batch.fields])
+        self.columns["id"].write([int(fields[1].rstrip('x'), 16) for fields in batch.fields])
+        self.columns["dlc"].write(np.minimum(dlc, 255))
+        self.columns["data"].write(data)
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+
+
+WRITERS = {
+    "asc": AscWriter,
+    "csv": CsvWriter,
+    "columns": ColumnWriter,
+}
+
+
+def export(input_file, outputs, batch_size=EXPORT_BATCH):
+    """
+    单遍导出为多种格式
+    Args:
+        input_file: senddebug.txt 或 can_store 录制文件。
+        outputs: {格式名: 输出路径}，格式名见 WRITERS。
+        batch_size: 每批解析的行数。
+    Returns:
+        导出的帧数。跳过的帧（文本行字段不足，或录制帧 DLC 不为8）只打印个数。
+    """
+    writers = [WRITERS[fmt](path) for fmt, path in outputs.items()]
+    count = 0
+    skipped = 0
+    try:
+        for batch in iter_batches(input_file, batch_size):
+            for writer in writers:
+                writer.write(batch)
+            count += len(batch)
+            skipped += batch.skipped
+    finally:
+        for writer in writers:
+            writer.close()
+    if skipped:
+        print(f"[WARN] 跳过 {skipped} 帧：senddebug.txt 格式要求8个数据字节（字段不足的行或 DLC 不为8的帧）")
+    return count
+
+
+def convert_can_data(input_file, output_file):
+    """只导出 ASC 格式（兼容原接口）"""
+    export(input_file, {"asc": output_file})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把 senddebug.txt 导出为 ASC/CSV/列式格式")
+    parser.add_argument("input", nargs="?", default="senddebug.txt",
+                        help="原始数据文件（senddebug.txt 或 can_store 录制文件）")
+    parser.add_argument("--asc", help="ASC 输出文件名")
+    parser.add_argument("--csv", help="CSV 输出文件名")
+    parser.add_argument("--columns", help="列式输出目录")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH, help="每批解析的行数")
+    args = parser.parse_args()
+    outputs = {fmt: path for fmt, path in
+               (("asc", args.asc), ("csv", args.csv), ("columns", args.columns)) if path}
+    if not outputs:
+        outputs = {"asc": "send.asc"}  # 默认与原来一样输出 send.asc
+
+    try:
+        count = export(args.input, outputs, args.batch_size)
+        print(f"转换完成！共 {count} 帧")
+    except Exception as e:
+        print(f"转换过程中出现错误: {str(e)}")
+
 
+if __name__ == "__main__":
+    main()
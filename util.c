@@ -2,6 +2,7 @@
 #include <string.h>
 #include <strings.h>
 #include <sys/time.h>
+#include <time.h>
 uint8_t calculate_xor(uint8_t *data, int len) {
   uint8_t xor_value = 0;
   for (int i = 0; i < len; i++) {
@@ -23,6 +24,18 @@ int parse_command(char *cmd, char **tokens, int max_tokens) {
   return tokens[max_tokens - 1] != NULL; // 确保有5个参数
 }
 
+uint64_t get_current_time_us() {
+  struct timeval tv;
+  gettimeofday(&tv, NULL);
+  return (uint64_t)(tv.tv_sec) * 1000000 + (uint64_t)(tv.tv_usec);
+}
+
+uint64_t get_monotonic_time_us() {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)(ts.tv_sec) * 1000000 + (uint64_t)(ts.tv_nsec) / 1000;
+}
+
 uint64_t get_current_time_ms() {
   struct timeval tv;
   gettimeofday(&tv, NULL);
@@ -6,6 +6,8 @@
 int parse_command(char *cmd, char **tokens, int max_tokens);
 uint8_t calculate_xor(uint8_t *data, int len);
 uint64_t get_current_time_ms();
+uint64_t get_current_time_us();
+uint64_t get_monotonic_time_us();
 void init_unix_domain_socket();
 
 #endif // UTIL_H
\ No newline at end of file